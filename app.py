@@ -1,34 +1,67 @@
 import os
 import json
 import time
+import argparse
 from datetime import datetime
 import utils
 import parser_ads
 import phones_parser
+import config
+import metrics
+import profiling
+import regions_io
 
-def main():
+def run_phone_parser(profiler, session=None):
+    """Создает парсер телефонов и запускает его, замеряя этапы для профилировщика"""
+    with profiler.stage("activation"):
+        parser = phones_parser.CianPhoneParser(session=session)
+    with profiler.stage("phones"):
+        return parser.parse()
+
+def main(profiler=None):
+    profiler = profiler or profiling.NullProfiler()
     utils.ensure_output_dir()
-    region_file = utils.get_region_file()
     
     print("\n" + "="*50)
     print(f"CIAN Parser запущен: {datetime.now()}")
     print("="*50)
     
+    # Сессия API для застройщиков активируется в фоне, пока идет поиск объявлений:
+    # перехват ждет первое объявление застройщика из этого поиска
+    activation = phones_parser.ActivationUrls() if config.DEFAULT_TYPE == 'developer' else None
+    session = phones_parser.start_session(utils.get_region_id(), background=True, activation=activation) \
+        if activation else None
+    try:
+        _run_stages(profiler, session, activation)
+    finally:
+        # Если до телефонов не дошло, останавливаем фоновый перехват
+        if session is not None:
+            activation.close()
+            session.pool.close()
+
+def _run_stages(profiler, session, activation=None):
+    """Поиск объявлений (если нужно) и телефоны через заранее запущенную сессию"""
+    region_file = utils.get_region_file()
+    
+    def run_phones():
+        if activation is not None:
+            # Поиск закончен или не нужен: перехват больше не ждет его и берет URL из файла регионов
+            activation.close()
+        run_phone_parser(profiler, session)
+    
     # Проверяем наличие файла с данными
     if os.path.exists(region_file):
         try:
-            with open(region_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            listings_count = regions_io.read_header(region_file).get("count", 0)
             
-            if "data" in data and len(data["data"]) > 0:
-                # Фильтруем только застройщиков
-                developer_data = [item for item in data["data"] if item.get('author_type') == "developer"]
-                print(f"Найдено {len(data['data'])} объявлений ({len(developer_data)} от застройщиков) в {region_file}")
+            if listings_count > 0:
+                # Считаем только застройщиков (потоково, без загрузки файла целиком)
+                developer_count = regions_io.count_listings(region_file, author_type="developer")
+                print(f"Найдено {listings_count} объявлений ({developer_count} от застройщиков) в {region_file}")
                 print("="*50)
                 print(f"Начинаем парсинг телефонов для застройщиков...")
                 print("="*50 + "\n")
-                parser = phones_parser.CianPhoneParser()
-                parser.parse()
+                run_phones()
                 return
         
         except (json.JSONDecodeError, KeyError) as e:
@@ -44,19 +77,39 @@ def main():
             print("Ожидание...")
         
         print("Парсинг объявлений завершен! Начинаем парсинг телефонов...")
-        parser = phones_parser.CianPhoneParser()
-        parser.parse()
+        run_phones()
     else:
         print("Запускаем парсинг объявлений...")
-        success, developer_count = parser_ads.parse_cian_ads(log_callback=print)
+        try:
+            with profiler.stage("discovery"):
+                success, developer_count = parser_ads.parse_cian_ads(
+                    log_callback=print, on_developer_url=activation.offer if activation else None)
+        finally:
+            if activation is not None:
+                activation.close()
         if success:
             print("\n" + "="*50)
             print(f"Данные объявлений сохранены в {region_file}")
             print(f"Найдено {developer_count} объявлений от застройщиков")
             print("Начинаем парсинг телефонов для застройщиков...")
             print("="*50 + "\n")
-            parser = phones_parser.CianPhoneParser()
-            parser.parse()
+            run_phones()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    arg_parser = argparse.ArgumentParser(description="CIAN Parser")
+    arg_parser.add_argument("--profile", action="store_true", default=config.PROFILE_RUNS,
+                            help="Профилировать запуск (cProfile + tracemalloc) и сохранить отчет")
+    args = arg_parser.parse_args()
+    
+    if config.METRICS_PORT:
+        metrics.start_http_server(config.METRICS_PORT, host=config.METRICS_HOST)
+    
+    profiler = profiling.create_profiler(args.profile, label="app").start()
+    try:
+        main(profiler)
+    finally:
+        metrics.export_textfile()
+        profiler.stop()
+        report_path = profiler.write_report()
+        if report_path:
+            print(f"🔬 Отчет профилирования сохранен: {report_path}")
\ No newline at end of file
@@ -0,0 +1,320 @@
+"""Офлайн-бенчмарк конвейера парсинга против локального заменителя cian.ru.
+
+Запуск из корня репозитория:
+    python -m benchmarks.run --listings 300 --api-latency 0.05 --api-error-rate 0.05
+"""
+import sys
+import json
+import time
+import types
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from collections import Counter
+import requests
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import config
+import metrics
+import http_client
+import circuit_breaker
+import response_classifier
+import parser_ads
+import phones_parser
+from records import Listing, PhoneResult
+from benchmarks.stand_in_proxy import start_proxies
+from benchmarks.stand_in_server import StandInServer, StandInSettings
+
+VERDICT_KINDS = (response_classifier.OK, response_classifier.BLOCKED, response_classifier.CAPTCHA,
+                 response_classifier.RATE_LIMITED, response_classifier.SEARCH_REDIRECT,
+                 response_classifier.REMOVED, response_classifier.ERROR)
+
+REPORT_STAGES = ("discovery", "listing_enrichment", "html_fetch", "api_call", "save_data")
+
+class _StandInCianParser:
+    """Заменитель cianparser.CianParser: читает выдачу с локального сервера постранично"""
+
+    def __init__(self, base_url, location):
+        self.base_url = base_url
+        self.location = location
+
+    def get_flats(self, deal_type, rooms, additional_settings=None):
+        page = (additional_settings or {}).get("start_page", 1)
+        results = []
+        while True:
+            response = requests.get(f"{self.base_url}/search", params={"page": page}, timeout=15)
+            response.raise_for_status()
+            chunk = response.json()
+            if not chunk:
+                break
+            results.extend(chunk)
+            page += 1
+        return results
+
+def _stand_in_cianparser(base_url):
+    return types.SimpleNamespace(CianParser=lambda location: _StandInCianParser(base_url, location))
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss: КБ в Linux, байты в macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _stage_latencies():
+    report = {}
+    for stage in REPORT_STAGES:
+        count = metrics.stage_duration.count_matching(stage=stage)
+        if not count:
+            continue
+        report[stage] = {
+            "count": count,
+            "p50_ms": round(metrics.stage_duration.quantile_matching(0.5, stage=stage) * 1000, 1),
+            "p95_ms": round(metrics.stage_duration.quantile_matching(0.95, stage=stage) * 1000, 1),
+        }
+    return report
+
+def _traced_size(build):
+    """Возвращает объем памяти (байт), который удерживает результат build()"""
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    result = build()
+    after, _ = tracemalloc.get_traced_memory()
+    del result
+    if started:
+        tracemalloc.stop()
+    return after - before
+
+def _records_memory(listings):
+    """Сравнивает память объявлений и результатов по номерам: словари против slotted-записей"""
+    # Сериализованный текст - чтобы строки в каждом замере создавались заново, как при чтении файла
+    listings_text = json.dumps(listings, ensure_ascii=False)
+    results = {}
+    for index, item in enumerate(json.loads(listings_text)):
+        aid = item["url"].rstrip("/").rsplit("/", 1)[-1]
+        if index % 4 == 0:
+            results[aid] = {"phone": "не удалось получить", "notFormattedPhone": "", "source": "failed"}
+        else:
+            results[aid] = {"phone": f"+7 (345) 000-00-{index % 100:02d}", "notFormattedPhone": f"73450000{index % 100:02d}",
+                            "source": "api", "siteBlockId": 10000 + index}
+    results_text = json.dumps(results, ensure_ascii=False)
+
+    report = {}
+    for name, text, to_record in (
+        ("listings", listings_text, lambda data: [Listing.from_dict(item) for item in data]),
+        ("phone_results", results_text, lambda data: {aid: PhoneResult.from_dict(entry) for aid, entry in data.items()}),
+    ):
+        dict_bytes = _traced_size(lambda: json.loads(text))
+        record_bytes = _traced_size(lambda: to_record(json.loads(text)))
+        report[name] = {
+            "count": len(listings) if name == "listings" else len(results),
+            "dict_kb": round(dict_bytes / 1024, 1),
+            "slots_kb": round(record_bytes / 1024, 1),
+            "reduction_pct": round(100 * (1 - record_bytes / dict_bytes), 1) if dict_bytes else None,
+        }
+    return report
+
+class _QuietLog:
+    """Считает строки логов вместо вывода, чтобы не искажать замеры"""
+
+    def __init__(self, verbose=False):
+        self.lines = 0
+        self.verbose = verbose
+
+    def __call__(self, message):
+        self.lines += 1
+        if self.verbose:
+            print(message)
+
+def run_benchmark(settings, author_types=("developer", "real_estate_agent"), verbose=False, host_rate=0,
+                  proxies=0, proxy_latency=0.0, proxy_rate=None, hedge=False):
+    """Прогоняет parse_cian_ads и CianPhoneParser.parse против локального сервера и возвращает отчет"""
+    output_dir = tempfile.mkdtemp(prefix="cian_bench_")
+    saved_config = {name: getattr(config, name) for name in (
+        "OUTPUT_DIR", "API_URL", "BROWSER_ENABLED", "ENRICH_DELAY", "PHONE_DELAY",
+        "API_RETRY_DELAY", "REQUEST_DELAY", "HOST_RATE", "HOST_BURST", "PROXIES", "PROXIES_FILE",
+        "PROXY_RATE", "PROXY_BURST", "PROXY_COOLDOWN", "PROXY_BAN_COOLDOWN", "IDENTITY_RATE",
+        "BLOCK_BACKOFF", "BLOCK_MAX_BACKOFF", "HEDGE_ENABLED")}
+    saved_cianparser = parser_ads.cianparser
+    log = _QuietLog(verbose)
+    stand_in_proxies = start_proxies(proxies, latency=proxy_latency) if proxies else []
+    proxy_stats = []
+
+    try:
+        with StandInServer(settings) as server:
+            config.OUTPUT_DIR = output_dir
+            config.API_URL = server.api_url
+            config.BROWSER_ENABLED = False
+            config.ENRICH_DELAY = 0
+            config.PHONE_DELAY = 0
+            config.API_RETRY_DELAY = 0
+            config.REQUEST_DELAY = 0
+            # Общий лимит на хост (0 - без ограничения, как по умолчанию в бенчмарке)
+            config.HOST_RATE = host_rate
+            config.HOST_BURST = max(1, int(host_rate))
+            # Прокси-заменители: каждый - отдельный исходящий адрес со своим лимитом на сервере
+            config.PROXIES = ",".join(proxy.url for proxy in stand_in_proxies)
+            config.PROXIES_FILE = None
+            # По умолчанию чуть ниже лимита сервера, чтобы не ловить 429 из-за рассинхронизации бакетов
+            config.PROXY_RATE = settings.client_rate * 0.8 if proxy_rate is None else proxy_rate
+            config.PROXY_BURST = max(1, int(config.PROXY_RATE))
+            config.PROXY_COOLDOWN = 1
+            config.PROXY_BAN_COOLDOWN = 5
+            # Без браузера в пуле одна идентичность по умолчанию - ее лимит бенчмарк не ограничивает
+            config.IDENTITY_RATE = 0
+            # Паузы после капчи - короткие, чтобы бенчмарк показывал число повторов, а не ожидание
+            config.BLOCK_BACKOFF = 0.05
+            config.BLOCK_MAX_BACKOFF = 0.5
+            config.HEDGE_ENABLED = hedge
+            http_client.reset()
+            circuit_breaker.reset()
+            parser_ads.cianparser = _stand_in_cianparser(server.base_url)
+
+            started = time.perf_counter()
+            success, listings_count = parser_ads.parse_cian_ads(log_callback=log)
+            discovery_seconds = time.perf_counter() - started
+            if not success:
+                raise RuntimeError("parse_cian_ads завершился с ошибкой")
+
+            phone_runs = {}
+            for author_type in author_types:
+                started = time.perf_counter()
+                parser = phones_parser.CianPhoneParser(log_callback=log, clear_existing=True, author_type=author_type)
+                parser.parse()
+                elapsed = time.perf_counter() - started
+                processed = len(parser.parsed_data)
+                phone_runs[author_type] = {
+                    "listings": processed,
+                    "seconds": round(elapsed, 3),
+                    "listings_per_sec": round(processed / elapsed, 2) if elapsed else None,
+                    "sources": dict(Counter(entry.source.label for entry in parser.parsed_data.values())),
+                }
+
+            server_stats = server.stats.as_dict()
+            proxy_stats = http_client.proxy_report()
+            verdicts = {kind: metrics.response_verdicts.get(verdict=kind) for kind in VERDICT_KINDS
+                        if metrics.response_verdicts.get(verdict=kind)}
+            records_memory = _records_memory(server.listings)
+    finally:
+        for name, value in saved_config.items():
+            setattr(config, name, value)
+        parser_ads.cianparser = saved_cianparser
+        http_client.reset()
+        circuit_breaker.reset()
+        for proxy in stand_in_proxies:
+            proxy.stop()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    return {
+        "settings": vars(settings),
+        "discovery": {
+            "listings": listings_count,
+            "seconds": round(discovery_seconds, 3),
+            "listings_per_sec": round(listings_count / discovery_seconds, 2) if discovery_seconds else None,
+        },
+        "phones": phone_runs,
+        "latency": _stage_latencies(),
+        "peak_rss_mb": _peak_rss_mb(),
+        "bytes_transferred": server_stats["bytes_sent"],
+        "bytes_downloaded_client": metrics.bytes_downloaded.total(),
+        "server": server_stats,
+        "records_memory": records_memory,
+        "proxies": proxy_stats,
+        "verdicts": verdicts,
+        "hedging": {outcome: metrics.hedged_calls.get(stage="api_call", outcome=outcome)
+                    for outcome in ("not_hedged", "primary_won", "hedge_won")},
+        "log_lines": log.lines,
+    }
+
+def format_report(report):
+    lines = ["📊 БЕНЧМАРК КОНВЕЙЕРА ПАРСИНГА", "=" * 60]
+    discovery = report["discovery"]
+    lines.append(f"Поиск + обогащение: {discovery['listings']} объявлений за {discovery['seconds']} сек "
+                 f"({discovery['listings_per_sec']} объявл./сек)")
+    for author_type, run in report["phones"].items():
+        lines.append(f"Телефоны [{author_type}]: {run['listings']} объявлений за {run['seconds']} сек "
+                     f"({run['listings_per_sec']} объявл./сек), источники: {run['sources']}")
+    lines.append("-" * 60)
+    lines.append(f"{'Этап':<22}{'кол-во':>8}{'p50, мс':>12}{'p95, мс':>12}")
+    for stage, stats in report["latency"].items():
+        lines.append(f"{stage:<22}{stats['count']:>8}{stats['p50_ms']:>12}{stats['p95_ms']:>12}")
+    lines.append("-" * 60)
+    if report["peak_rss_mb"] is not None:
+        lines.append(f"Пиковый RSS: {report['peak_rss_mb']:.1f} МБ")
+    for name, stats in report["records_memory"].items():
+        lines.append(f"Память записей [{name}]: {stats['count']} шт., dict {stats['dict_kb']} КБ -> "
+                     f"slots {stats['slots_kb']} КБ (-{stats['reduction_pct']}%)")
+    for proxy in report["proxies"]:
+        lines.append(f"Прокси {proxy['proxy']}: запросов {proxy['requests']}, ошибок {proxy['failures']}, "
+                     f"банов {proxy['bans']}, задержка {proxy['latency_ms']} мс")
+    lines.append(f"Передано сервером: {report['bytes_transferred'] / 1024 / 1024:.2f} МБ")
+    lines.append(f"Ошибок API (инъекция): {report['server']['api_errors']}, пустых ответов: {report['server']['api_empty']}, "
+                 f"отказов 429 (лимит на адрес): {report['server']['rate_limited']}")
+    hedging = report["hedging"]
+    hedged = hedging["primary_won"] + hedging["hedge_won"]
+    if hedged or hedging["not_hedged"]:
+        lines.append(f"Хеджирование API: дублей {hedged} из {hedged + hedging['not_hedged']}, "
+                     f"дубль быстрее в {hedging['hedge_won']}")
+    lines.append(f"Капч отдано: {report['server']['captchas']}, вердикты ответов: {report['verdicts']}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Офлайн-бенчмарк парсера CIAN")
+    arg_parser.add_argument("--listings", type=int, default=200)
+    arg_parser.add_argument("--developer-share", type=float, default=0.5)
+    arg_parser.add_argument("--page-kb", type=int, default=256, help="Размер HTML карточки объявления (КБ)")
+    arg_parser.add_argument("--api-latency", type=float, default=0.05, help="Средняя задержка API (сек)")
+    arg_parser.add_argument("--api-jitter", type=float, default=0.03)
+    arg_parser.add_argument("--api-error-rate", type=float, default=0.05)
+    arg_parser.add_argument("--api-empty-rate", type=float, default=0.02)
+    arg_parser.add_argument("--html-latency", type=float, default=0.01)
+    arg_parser.add_argument("--host-rate", type=float, default=0, help="Лимит запросов в секунду на хост (0 - без лимита)")
+    arg_parser.add_argument("--client-rate", type=float, default=0,
+                            help="Лимит сервера на один исходящий адрес, запросов/сек (0 - без лимита)")
+    arg_parser.add_argument("--proxies", type=int, default=0, help="Количество локальных прокси-заменителей")
+    arg_parser.add_argument("--proxy-latency", type=float, default=0.0, help="Задержка прокси (сек)")
+    arg_parser.add_argument("--proxy-rate", type=float, default=None,
+                            help="Лимит запросов через один прокси (по умолчанию 0.8 от --client-rate)")
+    arg_parser.add_argument("--captcha-rate", type=float, default=0.0, help="Доля страниц объявлений с капчей")
+    arg_parser.add_argument("--removed-share", type=float, default=0.0, help="Доля снятых с публикации объявлений")
+    arg_parser.add_argument("--api-slow-rate", type=float, default=0.0, help="Доля медленных ответов API")
+    arg_parser.add_argument("--api-slow-latency", type=float, default=1.0, help="Доп. задержка медленного ответа (сек)")
+    arg_parser.add_argument("--hedge", action="store_true", help="Хеджирование запросов к API (CIAN_HEDGE)")
+    arg_parser.add_argument("--author-types", default="developer,real_estate_agent")
+    arg_parser.add_argument("--json", dest="json_path", help="Сохранить отчет в JSON")
+    arg_parser.add_argument("--verbose", action="store_true", help="Печатать логи парсера")
+    args = arg_parser.parse_args(argv)
+
+    settings = StandInSettings(
+        listings=args.listings,
+        developer_share=args.developer_share,
+        page_kb=args.page_kb,
+        api_latency=args.api_latency,
+        api_jitter=args.api_jitter,
+        api_error_rate=args.api_error_rate,
+        api_empty_rate=args.api_empty_rate,
+        html_latency=args.html_latency,
+        client_rate=args.client_rate,
+        captcha_rate=args.captcha_rate,
+        removed_share=args.removed_share,
+        api_slow_rate=args.api_slow_rate,
+        api_slow_latency=args.api_slow_latency,
+    )
+    report = run_benchmark(settings, author_types=tuple(args.author_types.split(",")), verbose=args.verbose,
+                           host_rate=args.host_rate, proxies=args.proxies, proxy_latency=args.proxy_latency,
+                           proxy_rate=args.proxy_rate, hedge=args.hedge)
+    print(format_report(report))
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import time
+import socket
+import random
+import threading
+import http.client
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Заголовок, по которому заменитель cian.ru различает исходящие адреса
+EGRESS_HEADER = "X-Stand-In-Egress"
+
+# Заголовки, которые прокси не пересылает
+HOP_BY_HOP = {"connection", "keep-alive", "proxy-connection", "proxy-authorization", "te", "trailers",
+              "transfer-encoding", "upgrade"}
+
+def make_proxy_handler(name, latency, failure_rate, seed):
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def _forward(self):
+            with rng_lock:
+                roll = rng.random()
+            time.sleep(latency)
+            if roll < failure_rate:
+                self.send_response(502)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            target = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else None
+            headers = {key: value for key, value in self.headers.items() if key.lower() not in HOP_BY_HOP}
+            headers[EGRESS_HEADER] = name
+
+            connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+            try:
+                connection.connect()
+                connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                path = target.path + (f"?{target.query}" if target.query else "")
+                connection.request(self.command, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            finally:
+                connection.close()
+
+            self.send_response(response.status)
+            for key, value in response.getheaders():
+                if key.lower() not in HOP_BY_HOP and key.lower() != "content-length":
+                    self.send_header(key, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = _forward
+        do_POST = _forward
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+class StandInProxy:
+    """Локальный HTTP-прокси: помечает запросы своим именем, может добавлять задержку и сбои"""
+
+    def __init__(self, name, latency=0.0, failure_rate=0.0, seed=0, host="127.0.0.1", port=0):
+        self.name = name
+        self._httpd = ThreadingHTTPServer((host, port), make_proxy_handler(name, latency, failure_rate, seed))
+        self._httpd.daemon_threads = True
+        self.url = f"http://{host}:{self._httpd.server_port}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+def start_proxies(count, latency=0.0, failure_rate=0.0):
+    """Запускает count прокси-заменителей и возвращает их список"""
+    return [StandInProxy(f"proxy-{index}", latency, failure_rate, seed=index).start() for index in range(count)]
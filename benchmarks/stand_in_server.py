@@ -0,0 +1,277 @@
+import os
+import re
+import json
+import time
+import random
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from rate_limit import TokenBucket
+from benchmarks.stand_in_proxy import EGRESS_HEADER
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Распределение типов авторов в фейковой выдаче
+AUTHOR_TYPES = ("developer", "real_estate_agent", "homeowner", "realtor")
+
+def _load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+class StandInSettings:
+    """Параметры поведения локального заменителя cian.ru"""
+
+    def __init__(self, listings=200, developer_share=0.5, page_size=28, page_kb=256,
+                 api_latency=0.05, api_jitter=0.03, api_error_rate=0.05, api_empty_rate=0.02,
+                 html_latency=0.01, client_rate=0, captcha_rate=0.0, removed_share=0.0, api_slow_rate=0.0,
+                 api_slow_latency=1.0, seed=42):
+        self.listings = listings
+        self.developer_share = developer_share
+        self.page_size = page_size
+        self.page_kb = page_kb
+        self.api_latency = api_latency
+        self.api_jitter = api_jitter
+        self.api_error_rate = api_error_rate
+        self.api_empty_rate = api_empty_rate
+        self.html_latency = html_latency
+        self.client_rate = client_rate  # Лимит запросов в секунду с одного адреса (0 - без лимита), сверх - 429
+        self.captcha_rate = captcha_rate  # Доля страниц объявлений, вместо которых отдается капча
+        self.removed_share = removed_share  # Доля объявлений, снятых с публикации
+        self.api_slow_rate = api_slow_rate  # Доля "зависших" ответов API (хвост задержек)
+        self.api_slow_latency = api_slow_latency
+        self.seed = seed
+
+class StandInStats:
+    """Счетчики обслуженных запросов и переданных байт"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.bytes_sent = 0
+        self.api_errors = 0
+        self.api_empty = 0
+        self.rate_limited = 0
+        self.captchas = 0
+        self.by_egress = {}
+
+    def record(self, route, size, egress=None):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            self.bytes_sent += size
+            if egress:
+                self.by_egress[egress] = self.by_egress.get(egress, 0) + 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "bytes_sent": self.bytes_sent,
+                "api_errors": self.api_errors,
+                "api_empty": self.api_empty,
+                "rate_limited": self.rate_limited,
+                "captchas": self.captchas,
+                "by_egress": dict(self.by_egress),
+            }
+
+def build_listings(settings, base_url):
+    """Генерирует детерминированную выдачу поиска в формате cianparser"""
+    rng = random.Random(settings.seed)
+    listings = []
+    for i in range(settings.listings):
+        announcement_id = 300000000 + i
+        if rng.random() < settings.developer_share:
+            author_type = "developer"
+        else:
+            author_type = rng.choice(AUTHOR_TYPES[1:])
+        floors_count = rng.randint(5, 25)
+        rooms_count = rng.randint(1, 4)
+        listings.append({
+            "author": "ГК ЭНКО" if author_type == "developer" else "Частное лицо",
+            "author_type": author_type,
+            "url": f"{base_url}/sale/flat/{announcement_id}/",
+            "location": "Тюмень",
+            "deal_type": "sale",
+            "accommodation_type": "flat",
+            "floor": rng.randint(1, floors_count),
+            "floors_count": floors_count,
+            "rooms_count": rooms_count,
+            "total_meters": round(rng.uniform(25, 110), 1),
+            "price": rng.randrange(3000000, 15000000, 50000),
+        })
+    # Небольшая доля дублей, как в реальной выдаче с разных поддоменов
+    for item in listings[:max(1, settings.listings // 50)]:
+        listings.append(dict(item, url=item["url"] + "?from=duplicate"))
+    return listings
+
+def make_handler(settings, stats, listings_by_id, listings):
+    developer_template = _load_fixture("offer_developer.html")
+    agent_template = _load_fixture("offer_agent.html")
+    padding = "<!-- " + ("x" * max(0, settings.page_kb * 1024 - 4096)) + " -->"
+    rng = random.Random(settings.seed + 1)
+    rng_lock = threading.Lock()
+    egress_buckets = {}
+    captcha_page = ("<html><head><title>Captcha</title></head><body><form action=\"/showcaptcha\">"
+                    "Подтвердите, что запросы отправляли вы, а не робот</form></body></html>")
+    removed_banner = "<div class=\"removed\">Объявление снято с публикации</div>"
+
+    def allowed(egress):
+        """Лимит запросов на исходящий адрес (как у настоящего сайта для одного IP)"""
+        if not settings.client_rate:
+            return True
+        with rng_lock:
+            bucket = egress_buckets.get(egress)
+            if bucket is None:
+                bucket = egress_buckets[egress] = TokenBucket(settings.client_rate, max(1, int(settings.client_rate)))
+        return bucket.try_acquire() == 0
+
+    def render_offer(item, announcement_id):
+        template = developer_template if item["author_type"] == "developer" else agent_template
+        values = {
+            "{announcement_id}": announcement_id,
+            "{price}": str(item["price"]),
+            "{floor}": str(item["floor"]),
+            "{floors_count}": str(item["floors_count"]),
+            "{rooms_count}": str(item["rooms_count"]),
+            "{author_type}": item["author_type"],
+            "{site_block_id}": str(10000 + int(announcement_id) % 5000),
+            "{offer_phone}": f"+7 (912) {announcement_id[-7:-4]}-{announcement_id[-4:-2]}-{announcement_id[-2:]}",
+            "{padding}": padding,
+        }
+        for key, value in values.items():
+            template = template.replace(key, value)
+        return template
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Клиент держит keep-alive соединения: без TCP_NODELAY ответы ждут delayed ACK (~40 мс)
+        disable_nagle_algorithm = True
+
+        @property
+        def egress(self):
+            return self.headers.get(EGRESS_HEADER, "direct")
+
+        def _send(self, route, status, body, content_type):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            stats.record(route, len(data), self.egress)
+
+        def _rate_limited(self):
+            if allowed(self.egress):
+                return False
+            with stats._lock:
+                stats.rate_limited += 1
+            self._send("rate_limited", 429, "Too many requests", "text/plain")
+            return True
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            if parsed.path == "/search":
+                page = int(parse_qs(parsed.query).get("page", ["1"])[0])
+                start = (page - 1) * settings.page_size
+                chunk = listings[start:start + settings.page_size]
+                self._send("search", 200, json.dumps(chunk, ensure_ascii=False), "application/json")
+                return
+
+            match = re.match(r"^/sale/flat/(\d+)/?$", parsed.path)
+            if match and match.group(1) in listings_by_id:
+                if self._rate_limited():
+                    return
+                time.sleep(settings.html_latency)
+                announcement_id = match.group(1)
+                with rng_lock:
+                    roll = rng.random()
+                if roll < settings.captcha_rate:
+                    with stats._lock:
+                        stats.captchas += 1
+                    self._send("captcha", 200, captcha_page, "text/html; charset=utf-8")
+                    return
+                body = render_offer(listings_by_id[announcement_id], announcement_id)
+                if int(announcement_id) % 100 < settings.removed_share * 100:
+                    # Снятое объявление: карточка без данных для связи, с плашкой
+                    body = removed_banner + re.sub(r'"(?:siteBlockId|offerPhone)"', '"hidden"', body)
+                self._send("offer", 200, body, "text/html; charset=utf-8")
+                return
+
+            self._send("not_found", 404, "Not found", "text/plain")
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            if urlparse(self.path).path != "/get-dynamic-phone":
+                self._send("not_found", 404, "Not found", "text/plain")
+                return
+            if self._rate_limited():
+                return
+
+            with rng_lock:
+                delay = max(0.0, settings.api_latency + rng.uniform(-settings.api_jitter, settings.api_jitter))
+                if rng.random() < settings.api_slow_rate:
+                    delay += settings.api_slow_latency
+                roll = rng.random()
+            time.sleep(delay)
+
+            if roll < settings.api_error_rate:
+                with stats._lock:
+                    stats.api_errors += 1
+                self._send("api", 500, json.dumps({"message": "Internal error"}), "application/json")
+                return
+            if roll < settings.api_error_rate + settings.api_empty_rate:
+                with stats._lock:
+                    stats.api_empty += 1
+                self._send("api", 200, json.dumps({"phone": None}), "application/json")
+                return
+
+            try:
+                payload = json.loads(raw or b"{}")
+            except json.JSONDecodeError:
+                payload = {}
+            announcement_id = str(payload.get("announcementId", "0")).rjust(7, "0")
+            phone = f"+7 (345) {announcement_id[-7:-4]}-{announcement_id[-4:-2]}-{announcement_id[-2:]}"
+            self._send("api", 200, json.dumps({"phone": phone, "notFormattedPhone": re.sub(r"\D", "", phone)}),
+                       "application/json")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+class StandInServer:
+    """Локальный HTTP-сервер, имитирующий выдачу, карточки объявлений и get-dynamic-phone"""
+
+    def __init__(self, settings=None, host="127.0.0.1", port=0):
+        self.settings = settings or StandInSettings()
+        self.stats = StandInStats()
+        self._httpd = ThreadingHTTPServer((host, port), BaseHTTPRequestHandler)
+        self._httpd.daemon_threads = True
+        self.base_url = f"http://{host}:{self._httpd.server_port}"
+        self.listings = build_listings(self.settings, self.base_url)
+        listings_by_id = {}
+        for item in self.listings:
+            announcement_id = re.search(r"/(\d+)/", item["url"]).group(1)
+            listings_by_id.setdefault(announcement_id, item)
+        self._httpd.RequestHandlerClass = make_handler(self.settings, self.stats, listings_by_id, self.listings)
+        self._thread = None
+
+    @property
+    def api_url(self):
+        return f"{self.base_url}/get-dynamic-phone"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
@@ -2,8 +2,8 @@ import os
 import json
 import time
 import asyncio
-import queue
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types, F
@@ -28,23 +28,32 @@ import utils
 import parser_ads
 import phones_parser
 import config
-import cianparser
+import metrics
+import profiling
+import regions_io
+import regions_catalog
+from log_streamer import LogStreamer
+from event_bridge import EventBridge, EVENT_LOG, EVENT_PROGRESS, EVENT_FINISHED
 
 # Глобальные переменные для управления состоянием
 parsing_in_progress = False
-log_queue = queue.Queue()
-current_log_message = None
+log_chat_id = None  # Чат, в который стримятся логи текущего парсинга
+event_bridge = EventBridge()
 scheduler = AsyncIOScheduler(timezone=pytz.timezone('Europe/Moscow'))
 bot_task = None  # Для хранения задачи бота
 
 # Инициализация бота
 bot = Bot(token=os.getenv("TELEGRAM_BOT_TOKEN"))
 dp = Dispatcher()
+log_streamer = LogStreamer(bot)
 
 # Callback data для кнопок
 class AuthorTypeCallback(CallbackData, prefix="author"):
     type: str
 
+class RegionCallback(CallbackData, prefix="region"):
+    id: str
+
 # Состояния для FSM
 class RegionState(StatesGroup):
     waiting_region_name = State()
@@ -86,57 +95,158 @@ async def delete_file_after_delay(file_path: str, delay_seconds: int = 10):
     except Exception as e:
         print(f"❌ Ошибка при удалении файла {file_path}: {str(e)}")
 
-async def update_log_message(chat_id: int):
-    """Обновляет сообщение с логами в телеграме"""
-    global current_log_message, log_queue
-    
-    # Собираем все логи из очереди
-    logs = []
-    while not log_queue.empty():
-        logs.append(log_queue.get())
+async def update_log_message(chat_id: int, force: bool = False):
+    """Обновляет сообщение с логами в телеграме (с учетом лимита частоты правок)"""
+    await log_streamer.flush(chat_id, force=force)
+
+def log_callback(message: str):
+    """Callback для записи логов в буфер (вызывается из потока парсера)"""
+    log_streamer.push(message)
+    event_bridge.publish(EVENT_LOG, coalesce=True)
+
+# Прогресс по регионам для строки статуса (обновляется из потоков парсера)
+region_progress = {}
+region_progress_lock = threading.Lock()
+
+def progress_callback(current: int, total: int, success_count: int, region_name: str = None):
+    """Callback для передачи прогресса парсинга телефонов (вызывается из потока парсера)"""
+    text = f"📊 Прогресс: {current}/{total}, успешных: {success_count}"
+    with region_progress_lock:
+        region_progress[region_name] = f"[{region_name}] {text}" if region_name else text
+        status = "\n".join(region_progress.values())
+    log_streamer.set_status(status)
+    event_bridge.publish(EVENT_PROGRESS, coalesce=True)
+
+def make_region_callbacks(region_name, prefixed):
+    """Callback'и логов и прогресса для региона (с префиксом при параллельном запуске)"""
+    if not prefixed:
+        return log_callback, progress_callback
+    
+    def region_log(message: str):
+        log_callback(f"[{region_name}] {message}")
+    
+    def region_progress_callback(current: int, total: int, success_count: int):
+        progress_callback(current, total, success_count, region_name=region_name)
+    
+    return region_log, region_progress_callback
+
+def run_phone_parser(author_type, is_scheduled, profiler, region=None, log=log_callback, progress=progress_callback,
+                     session=None):
+    """Создает парсер телефонов и запускает его, замеряя этапы для профилировщика"""
+    region_id = region[1] if region else utils.get_region_id()
+    # Номера удаляем перед запуском, кроме случая, когда фильтр сужен и применяется
+    # локально: тогда они действительны, а выгрузку ограничивает сам парсер
+    clear_existing = not utils.is_filter_narrowed(region_id)
+    with profiler.stage("activation"):
+        # Передаем флаг очистки файлов и тип автора
+        parser = phones_parser.CianPhoneParser(
+            log_callback=log,
+            clear_existing=clear_existing,
+            author_type=author_type,
+            is_scheduled=is_scheduled,
+            progress_callback=progress,
+            region=region,
+            session=session
+        )
+    with profiler.stage("phones"):
+        return parser.parse()
+
+def run_region_pipeline(region, author_type, is_scheduled, profiler, log=log_callback, progress=progress_callback):
+    """Поиск объявлений (если нужно) и парсинг телефонов для одного региона"""
+    region_name, region_id = region
+    # Сессия API для застройщиков активируется в фоне, пока идет поиск объявлений:
+    # перехват ждет первое объявление застройщика из этого поиска
+    activation = phones_parser.ActivationUrls() if author_type == 'developer' else None
+    session = phones_parser.start_session(region_id, log, background=True, activation=activation) if activation else None
+    try:
+        return _run_region_stages(region, author_type, is_scheduled, profiler, log, progress, session, activation)
+    finally:
+        # Если до телефонов не дошло, останавливаем фоновый перехват
+        if session is not None:
+            activation.close()
+            session.pool.close()
+
+def _run_region_stages(region, author_type, is_scheduled, profiler, log, progress, session, activation=None):
+    """Этапы региона: поиск объявлений (если нужно) и телефоны через заранее запущенную сессию"""
+    region_name, region_id = region
+    region_file = utils.get_region_file(region_id)
+    
+    def run_phones():
+        if activation is not None:
+            # Поиск закончен или не нужен: перехват больше не ждет его и берет URL из файла регионов
+            activation.close()
+        return run_phone_parser(author_type, is_scheduled, profiler, region, log, progress, session)
+    
+    # Проверяем наличие файла с данными (читаем только заголовок файла)
+    if os.path.exists(region_file):
+        try:
+            listings_count = regions_io.read_header(region_file).get("count", 0)
+            
+            if listings_count > 0:
+                log(f"Найдено {listings_count} объявлений. Начинаем парсинг телефонов...")
+                return run_phones()
+                
+        except (json.JSONDecodeError, KeyError) as e:
+            log(f"Ошибка чтения файла регионов: {str(e)}. Будет выполнен перепарсинг.")
     
-    if not logs:
-        return
+    log("Файл с объявлениями отсутствует или пуст.")
     
-    log_text = "\n".join(logs)
+    if utils.is_parsing_in_progress(region_id):
+        log("Парсинг объявлений уже выполняется. Ожидание завершения...")
+        
+        while utils.is_parsing_in_progress(region_id):
+            time.sleep(30)
+            log("Ожидание...")
+        
+        log("Парсинг объявлений завершен! Начинаем парсинг телефонов...")
+        return run_phones()
+    
+    log("Запускаем парсинг объявлений...")
+    with profiler.stage("discovery"):
+        success, _ = parser_ads.parse_cian_ads(log_callback=log, region=region,
+                                               on_developer_url=activation.offer if activation else None)
+    if success:
+        log("Начинаем парсинг телефонов...")
+        return run_phones()
+    return None
+
+def run_regions_concurrently(regions, author_type, is_scheduled, profiler):
+    """Запускает регионы параллельно; запросы к хостам ограничены общим лимитом http_client"""
+    results = [None] * len(regions)
+    workers = max(1, min(len(regions), config.MAX_PARALLEL_REGIONS))
+    log_callback(f"🗺️ Регионов: {len(regions)}, параллельно: {workers}")
+    
+    def run_one(index, region):
+        log, progress = make_region_callbacks(region[0], prefixed=True)
+        try:
+            # Этапы отдельных регионов пересекаются во времени - замеряем только общий,
+            # а cProfile включаем в потоке региона: профиль основного потока видит лишь ожидание
+            with profiler.thread():
+                results[index] = run_region_pipeline(region, author_type, is_scheduled, profiling.NullProfiler(), log, progress)
+        except Exception as e:
+            log(f"❌ Ошибка при парсинге региона: {str(e)}")
     
-    try:
-        if current_log_message:
-            # Получаем текущий текст сообщения
-            current_text = current_log_message.text
-            
-            # Объединяем с новыми логами
-            new_text = f"{current_text}\n{log_text}"
-            
-            # Обрезаем до 4096 символов
-            if len(new_text) > 4096:
-                new_text = new_text[-4096:]
-            
-            # Редактируем существующее сообщение
-            await bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=current_log_message.message_id,
-                text=new_text
-            )
-        else:
-            # Создаем новое сообщение
-            new_text = log_text[-4096:] if len(log_text) > 4096 else log_text
-            message = await bot.send_message(chat_id, new_text)
-            current_log_message = message
-    except Exception as e:
-        print(f"Ошибка при обновлении логов: {e}")
-
-def log_callback(message: str):
-    """Callback для записи логов в очередь"""
-    log_queue.put(message)
+    with profiler.stage("regions"):
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="region") as executor:
+            for future in [executor.submit(run_one, index, region) for index, region in enumerate(regions)]:
+                future.result()
+    return [path for path in results if path]
 
-def run_parser(author_type=None, is_scheduled=False):
-    """Запускает парсер в отдельном потоке"""
+def run_parser(author_type=None, is_scheduled=False, profile=None, regions=None):
+    """Запускает парсер в отдельном потоке для всех выбранных регионов"""
     global parsing_in_progress
     
+    if profile is None:
+        profile = config.PROFILE_RUNS
+    profiler = profiling.create_profiler(profile, label=author_type or "all").start()
+    regions = regions or utils.get_regions()
+    with region_progress_lock:
+        region_progress.clear()
+    
+    result = None
+    report_path = None
     try:
         utils.ensure_output_dir()
-        region_file = utils.get_region_file()
         
         log_callback("\n" + "="*50)
         log_callback(f"CIAN Parser запущен: {datetime.now()}")
@@ -150,68 +260,36 @@ def run_parser(author_type=None, is_scheduled=False):
         }
         author_display = author_names.get(author_type, '👥 все типы')
         log_callback(f"🎯 Тип авторов: {author_display}")
+        log_callback(f"📍 Регионы: {', '.join(name for name, _ in regions)}")
         
         if is_scheduled:
             log_callback("⏰ АВТОМАТИЧЕСКИЙ ПАРСИНГ ПО РАСПИСАНИЮ")
+        if profile:
+            log_callback("🔬 Включено профилирование запуска")
             
         log_callback("="*50)
         
-        # Проверяем наличие файла с данными
-        if os.path.exists(region_file):
-            try:
-                with open(region_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                if "data" in data and len(data["data"]) > 0:
-                    log_callback(f"Найдено {len(data['data'])} объявлений. Начинаем парсинг телефонов...")
-                    # Передаем флаг очистки файлов и тип автора
-                    parser = phones_parser.CianPhoneParser(
-                        log_callback=log_callback,
-                        clear_existing=True,
-                        author_type=author_type,
-                        is_scheduled=is_scheduled
-                    )
-                    return parser.parse()
-                    
-            except (json.JSONDecodeError, KeyError) as e:
-                log_callback(f"Ошибка чтения файла регионов: {str(e)}. Будет выполнен перепарсинг.")
-        
-        log_callback("Файл с объявлениями отсутствует или пуст.")
-        
-        if utils.is_parsing_in_progress():
-            log_callback("Парсинг объявлений уже выполняется. Ожидание завершения...")
-            
-            while utils.is_parsing_in_progress():
-                time.sleep(30)
-                log_callback("Ожидание...")
-            
-            log_callback("Парсинг объявлений завершен! Начинаем парсинг телефонов...")
-            # Передаем флаг очистки файлов и тип автора
-            parser = phones_parser.CianPhoneParser(
-                log_callback=log_callback,
-                clear_existing=True,
-                author_type=author_type,
-                is_scheduled=is_scheduled
-            )
-            return parser.parse()
+        if len(regions) == 1:
+            result = run_region_pipeline(regions[0], author_type, is_scheduled, profiler)
         else:
-            log_callback("Запускаем парсинг объявлений...")
-            if parser_ads.parse_cian_ads(log_callback=log_callback):
-                log_callback("Начинаем парсинг телефонов...")
-                # Передаем флаг очистки файлов и тип автора
-                parser = phones_parser.CianPhoneParser(
-                    log_callback=log_callback,
-                    clear_existing=True,
-                    author_type=author_type,
-                    is_scheduled=is_scheduled
-                )
-                return parser.parse()
+            result = run_regions_concurrently(regions, author_type, is_scheduled, profiler)
+        return result
     
     except Exception as e:
         log_callback(f"❌ Критическая ошибка при парсинге: {str(e)}")
         return None
     finally:
         parsing_in_progress = False
+        metrics.export_textfile()
+        profiler.stop()
+        try:
+            report_path = profiler.write_report()
+            if report_path:
+                log_callback(f"🔬 Отчет профилирования сохранен: {report_path}")
+        except Exception as e:
+            log_callback(f"❌ Не удалось сохранить отчет профилирования: {str(e)}")
+        # Сообщаем циклу бота о завершении - результаты отправятся сразу
+        event_bridge.publish(EVENT_FINISHED, result=result, report=report_path, is_scheduled=is_scheduled)
 
 def create_author_type_keyboard():
     """Создает клавиатуру для выбора типа автора"""
@@ -243,6 +321,16 @@ def create_author_type_keyboard():
     ])
     return keyboard
 
+def create_region_suggestions_keyboard(regions):
+    """Создает клавиатуру с подсказками регионов (выбор одним нажатием)"""
+    names = [name for name, _ in regions]
+    return InlineKeyboardMarkup(inline_keyboard=[
+        # Одноименные регионы различаем по ID
+        [InlineKeyboardButton(text=f"📍 {name} (ID: {region_id})" if names.count(name) > 1 else f"📍 {name}",
+                              callback_data=RegionCallback(id=str(region_id)).pack())]
+        for name, region_id in regions
+    ])
+
 def create_main_keyboard():
     """Создает главную клавиатуру меню"""
     return ReplyKeyboardMarkup(
@@ -253,24 +341,6 @@ def create_main_keyboard():
         resize_keyboard=True
     )
 
-def generate_regions_file():
-    """Генерирует файл со списком доступных регионов"""
-    regions = cianparser.list_locations()
-    
-    # Сортируем регионы по алфавиту
-    regions.sort(key=lambda x: x[0].lower())
-    
-    # Создаем временный файл
-    filename = "available_regions.txt"
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write("Список доступных регионов для парсинга:\n")
-        f.write("=" * 50 + "\n\n")
-        
-        for region in regions:
-            f.write(f"• {region[0]} (ID: {region[1]})\n")
-    
-    return filename
-
 def create_rooms_keyboard(selected_rooms):
     """Создает клавиатуру для выбора комнат"""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[])
@@ -483,25 +553,103 @@ async def parse_command(message: types.Message):
     if not await check_admin_access(message.from_user.id, message=message):
         return
         
-    global parsing_in_progress, current_log_message
+    global parsing_in_progress, log_chat_id
     
     if parsing_in_progress:
         await message.answer("⚠️ Парсинг уже запущен! Дождитесь завершения.")
         return
     
     # Сбрасываем состояние логов
-    current_log_message = None
-    while not log_queue.empty():
-        log_queue.get()
+    log_streamer.reset()
+    log_chat_id = message.chat.id
     
     parsing_in_progress = True
     log_callback("⏳ Подготовка к парсингу застройщиков...")
     
     # Запускаем парсинг застройщиков в отдельном потоке
     threading.Thread(target=run_parser, args=(config.DEFAULT_TYPE,), daemon=True).start()
+
+@dp.message(Command("parse_profile"))
+async def parse_profile_command(message: types.Message):
+    """Обработчик команды /parse_profile - парсинг застройщиков с профилированием"""
+    # Проверка доступа
+    if not await check_admin_access(message.from_user.id, message=message):
+        return
+        
+    global parsing_in_progress, log_chat_id
     
-    # Запускаем задачу для периодического обновления логов
-    asyncio.create_task(log_updater(message.chat.id))
+    if parsing_in_progress:
+        await message.answer("⚠️ Парсинг уже запущен! Дождитесь завершения.")
+        return
+    
+    # Сбрасываем состояние логов
+    log_streamer.reset()
+    log_chat_id = message.chat.id
+    
+    parsing_in_progress = True
+    log_callback("⏳ Подготовка к парсингу застройщиков с профилированием...")
+    
+    threading.Thread(
+        target=run_parser,
+        args=(config.DEFAULT_TYPE,),
+        kwargs={'profile': True},
+        daemon=True
+    ).start()
+
+@dp.message(Command("regions"))
+async def regions_command(message: types.Message):
+    """Обработчик команды /regions - список регионов для параллельного парсинга"""
+    # Проверка доступа
+    if not await check_admin_access(message.from_user.id, message=message):
+        return
+    
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        current = "\n".join(f"• {name} (ID: {region_id})" for name, region_id in utils.get_regions())
+        await message.answer(
+            f"🗺️ <b>Регионы для парсинга:</b>\n{current}\n\n"
+            "Чтобы изменить список, отправьте названия через запятую:\n"
+            "<code>/regions Тюмень, Екатеринбург, Казань</code>\n\n"
+            "Регионы парсятся одновременно с общим лимитом запросов.",
+            parse_mode="HTML"
+        )
+        return
+    
+    catalog = regions_catalog.get_catalog()
+    regions = []
+    not_found = []
+    for name in args[1].split(","):
+        name = name.strip()
+        if not name:
+            continue
+        # Регион можно указать и по ID - для одноименных населенных пунктов
+        found = catalog.find(name) or catalog.find_by_id(name)
+        if found is None:
+            same_name = catalog.find_all(name)
+            if same_name:
+                variants = ", ".join(f"{region_name} (ID: {region_id})" for region_name, region_id in same_name)
+                not_found.append(f"• {name} (несколько регионов: {variants} - укажите ID)")
+                continue
+            suggestions = catalog.suggest(name, limit=1)
+            hint = f" (возможно, {suggestions[0][0]})" if suggestions else ""
+            not_found.append(f"• {name}{hint}")
+        elif found not in regions:
+            regions.append(found)
+    
+    if not_found or not regions:
+        await message.answer(
+            "❌ <b>Регионы не найдены:</b>\n" + ("\n".join(not_found) or "• список пуст") +
+            "\n\nИсправьте названия и отправьте команду еще раз.",
+            parse_mode="HTML"
+        )
+        return
+    
+    utils.set_regions(regions)
+    await message.answer(
+        "✅ <b>Регионы сохранены:</b>\n" + "\n".join(f"• {name} (ID: {region_id})" for name, region_id in regions) +
+        "\n\nДанные парсинга обновлены под новые настройки.",
+        parse_mode="HTML"
+    )
 
 @dp.message(F.text == "⚙️ Настройки парсинга")
 async def parsing_settings(message: types.Message):
@@ -512,6 +660,7 @@ async def parsing_settings(message: types.Message):
         
     current_region = utils.get_region_name()
     region_id = utils.get_region_id()
+    current_regions = utils.get_regions()
     current_rooms = utils.get_rooms()
     current_min_floor = utils.get_min_floor()
     current_max_floor = utils.get_max_floor()
@@ -534,6 +683,11 @@ async def parsing_settings(message: types.Message):
         except ValueError:
             created_at_info = f"• <b>Дата создания:</b> {region_info['created_at']}\n"
     
+    # Дополнительные регионы (/regions)
+    regions_info = ""
+    if len(current_regions) > 1:
+        regions_info = f"• <b>Все регионы ({len(current_regions)}):</b> {', '.join(name for name, _ in current_regions)}\n"
+    
     # Форматируем этажи
     min_floor_text = "не задано" if not current_min_floor else ", ".join(map(str, current_min_floor))
     max_floor_text = "не задано" if not current_max_floor else ", ".join(map(str, current_max_floor))
@@ -576,6 +730,7 @@ async def parsing_settings(message: types.Message):
         f"⚙️ <b>Текущие настройки парсинга:</b>\n"
         f"• <b>Регион:</b> {current_region}\n"
         f"• <b>ID региона:</b> {region_id}\n"
+        f"{regions_info}"
         f"• <b>Комнаты:</b> {', '.join(map(str, current_rooms))}\n"
         f"• <b>Мин. этаж:</b> {min_floor_text}\n"
         f"• <b>Макс. этаж:</b> {max_floor_text}\n"
@@ -810,8 +965,8 @@ async def send_regions_list(message: types.Message):
         return
         
     try:
-        # Генерируем файл со списком регионов
-        regions_file = generate_regions_file()
+        # Файл со списком регионов готовится один раз при старте
+        regions_file = await asyncio.to_thread(regions_catalog.get_regions_file)
         file = FSInputFile(regions_file)
         
         # Отправляем файл
@@ -821,9 +976,7 @@ async def send_regions_list(message: types.Message):
                     "Используйте точное название региона при вводе.",
             parse_mode="HTML"
         )
-        
-        # Удаляем файл через 30 секунд
-        asyncio.create_task(delete_file_after_delay(regions_file, 30))
+
         
         # Предлагаем ввести регион
         await message.answer(
@@ -1083,7 +1236,7 @@ async def min_floor_range_selected(callback: types.CallbackQuery, state: FSMCont
     data = callback.data.split("_")
     if data[2] == "all":
         await state.update_data(range_start=0, range_end=0, range_name="Все этажи")
-        utils.set_min_floor([])
+        utils.set_min_floor([], apply=False)
         await callback.answer("Минимальный этаж: без ограничений")
         await state.set_state(MaxFloorState.selecting_range)
         await callback.message.answer(
@@ -1124,7 +1277,7 @@ async def min_floor_selected(callback: types.CallbackQuery, state: FSMContext):
     
     if action == "select":  # Выбрать все
         new_floors = list(range(state_data['range_start'], state_data['range_end'] + 1))
-        utils.set_min_floor(new_floors)
+        utils.set_min_floor(new_floors, apply=False)
         await callback.answer("Все этажи в диапазоне выбраны!") 
     elif action == "save":  # Сохранить
         # Сохраняем минимальные этажи
@@ -1153,7 +1306,7 @@ async def min_floor_selected(callback: types.CallbackQuery, state: FSMContext):
             current_floors.remove(floor)
         else:
             current_floors.append(floor)
-        utils.set_min_floor(current_floors)
+        utils.set_min_floor(current_floors, apply=False)
     
     # Обновляем клавиатуру
     await callback.message.edit_reply_markup(
@@ -1179,7 +1332,7 @@ async def max_floor_range_selected(callback: types.CallbackQuery, state: FSMCont
     
     if data[2] == "all":
         await state.update_data(range_start=0, range_end=0, range_name="Все этажи")
-        utils.set_max_floor([])
+        utils.set_max_floor([], apply=False)
         await callback.answer("Максимальный этаж: без ограничений")
         await save_floors_settings(callback.message, state)
         return
@@ -1223,7 +1376,7 @@ async def max_floor_selected(callback: types.CallbackQuery, state: FSMContext):
             f for f in range(state_data['range_start'], state_data['range_end'] + 1) 
             if f >= min_value_for_max
         ]
-        utils.set_max_floor(new_floors)
+        utils.set_max_floor(new_floors, apply=False)
         await callback.answer("Все этажи в диапазоне выбраны!")
     elif action == "save":  # Сохранить
         await save_floors_settings(callback.message, state)
@@ -1246,7 +1399,7 @@ async def max_floor_selected(callback: types.CallbackQuery, state: FSMContext):
             current_floors.remove(floor)
         else:
             current_floors.append(floor)
-        utils.set_max_floor(current_floors)
+        utils.set_max_floor(current_floors, apply=False)
     
     # Обновляем клавиатуру
     await callback.message.edit_reply_markup(
@@ -1261,6 +1414,8 @@ async def max_floor_selected(callback: types.CallbackQuery, state: FSMContext):
 
 async def save_floors_settings(message: types.Message, state: FSMContext):
     """Сохранение настроек этажей и завершение"""
+    # Этажи выбирались по одному без пересчета данных - применяем итоговый фильтр один раз
+    utils.apply_filter_change()
     min_floors = utils.get_min_floor()
     max_floors = utils.get_max_floor()
     
@@ -1272,7 +1427,7 @@ async def save_floors_settings(message: types.Message, state: FSMContext):
         f"✅ Настройки этажей сохранены:\n"
         f"• Минимальный этаж: {min_text}\n"
         f"• Максимальный этаж: {max_text}\n\n"
-        "Старые данные парсинга удалены.",
+        "Данные парсинга обновлены под новые настройки.",
         reply_markup=ReplyKeyboardMarkup(
             keyboard=[[KeyboardButton(text="Назад в настройки")]],
             resize_keyboard=True
@@ -1293,44 +1448,24 @@ async def process_region_name(message: types.Message, state: FSMContext):
         return
         
     region_name = message.text.strip()
-    locations = cianparser.list_locations()
+    catalog = regions_catalog.get_catalog()
     
-    # Ищем точное совпадение
-    found = None
-    for loc in locations:
-        if loc[0].lower() == region_name.lower():
-            found = loc
-            break
+    # Ищем точное совпадение (без учета регистра)
+    found = catalog.find(region_name)
     
     if found:
-        region_id = found[1]
-        utils.set_region(region_name, region_id)
-        await state.clear()
-        
-        await message.answer(
-            f"✅ <b>Регион изменен</b>\n"
-            f"• <b>Новый регион:</b> {region_name}\n"
-            f"• <b>ID региона:</b> {region_id}\n\n"
-            f"Теперь все парсинги будут выполняться для этого региона.",
-            reply_markup=create_main_keyboard(),
-            parse_mode="HTML"
-        )
+        region_name, region_id = found
+        await apply_region(message, state, region_name, region_id)
     else:
-        # Попробуем найти похожие
-        similar = []
-        for loc in locations:
-            if region_name.lower() in loc[0].lower():
-                similar.append(loc[0])
-                if len(similar) >= 5:  # Ограничим 5 вариантами
-                    break
+        # Подсказки с учетом опечаток - выбор кнопкой
+        similar = catalog.suggest(region_name, limit=5)  # Ограничим 5 вариантами
         
         if similar:
-            suggestions = "\n".join([f"• {name}" for name in similar])
             await message.answer(
-                f"❌ <b>Регион не найден</b>\n\n"
-                f"Возможно вы имели в виду:\n"
-                f"{suggestions}\n\n"
-                "Пожалуйста, введите название точно:",
+                "❌ <b>Регион не найден</b>\n\n"
+                "Возможно вы имели в виду один из вариантов ниже.\n"
+                "Нажмите на нужный регион или введите название точно:",
+                reply_markup=create_region_suggestions_keyboard(similar),
                 parse_mode="HTML"
             )
         else:
@@ -1338,6 +1473,37 @@ async def process_region_name(message: types.Message, state: FSMContext):
                 "❌ Регион не найден. Пожалуйста, введите название точно:"
             )
 
+async def apply_region(message: types.Message, state: FSMContext, region_name, region_id):
+    """Сохраняет выбранный регион и сообщает об этом"""
+    utils.set_region(region_name, region_id)
+    await state.clear()
+    
+    await message.answer(
+        f"✅ <b>Регион изменен</b>\n"
+        f"• <b>Новый регион:</b> {region_name}\n"
+        f"• <b>ID региона:</b> {region_id}\n\n"
+        f"Теперь все парсинги будут выполняться для этого региона.",
+        reply_markup=create_main_keyboard(),
+        parse_mode="HTML"
+    )
+
+@dp.callback_query(RegionCallback.filter())
+async def handle_region_suggestion(callback: types.CallbackQuery, callback_data: RegionCallback, state: FSMContext):
+    """Обработчик выбора региона из подсказок"""
+    # Проверка доступа
+    if not await check_admin_access(callback.from_user.id, callback=callback):
+        return
+    
+    found = regions_catalog.get_catalog().find_by_id(callback_data.id)
+    if not found:
+        await callback.answer("❌ Регион не найден", show_alert=True)
+        return
+    
+    await callback.answer()
+    region_name, region_id = found
+    await callback.message.edit_text(f"📍 Выбран регион: {region_name}")
+    await apply_region(callback.message, state, region_name, region_id)
+
 @dp.message(F.text.endswith("Назад в меню"))
 async def back_to_menu(message: types.Message, state: FSMContext):
     """Обработчик кнопки возврата в меню"""
@@ -1364,6 +1530,8 @@ async def back_to_settings(message: types.Message, state: FSMContext):
 @dp.callback_query(AuthorTypeCallback.filter())
 async def handle_author_type_selection(callback: types.CallbackQuery, callback_data: AuthorTypeCallback):
     """Обработчик выбора типа автора"""
+    global parsing_in_progress, log_chat_id
+    
     # Проверка доступа
     if not await check_admin_access(callback.from_user.id, callback=callback):
         return
@@ -1391,10 +1559,8 @@ async def handle_author_type_selection(callback: types.CallbackQuery, callback_d
     author_display = author_names.get(callback_data.type, callback_data.type)
     
     # Сбрасываем состояние логов
-    global current_log_message
-    current_log_message = None
-    while not log_queue.empty():
-        log_queue.get()
+    log_streamer.reset()
+    log_chat_id = callback.message.chat.id
     
     parsing_in_progress = True
     log_callback(f"⏳ Подготовка к парсингу: {author_display}...")
@@ -1407,9 +1573,6 @@ async def handle_author_type_selection(callback: types.CallbackQuery, callback_d
     
     # Запускаем парсинг выбранного типа в отдельном потоке
     threading.Thread(target=run_parser, args=(callback_data.type,), daemon=True).start()
-    
-    # Запускаем задачу для периодического обновления логов
-    asyncio.create_task(log_updater(callback.message.chat.id))
 
 def schedule_daily_parse():
     """Настраивает ежедневный парсинг по расписанию"""
@@ -1434,7 +1597,7 @@ def schedule_daily_parse():
 
 def run_scheduled_parse():
     """Запуск парсинга по расписанию"""
-    global parsing_in_progress
+    global parsing_in_progress, log_chat_id
     
     if parsing_in_progress:
         print("⏳ Пропуск автоматического парсинга: уже выполняется другой парсинг")
@@ -1449,10 +1612,8 @@ def run_scheduled_parse():
     parsing_in_progress = True
     
     # Сбрасываем состояние логов
-    global current_log_message
-    current_log_message = None
-    while not log_queue.empty():
-        log_queue.get()
+    log_streamer.reset()
+    log_chat_id = int(admin_id)
     
     # Получаем выбранные типы авторов
     author_types = utils.get_author_types()
@@ -1468,42 +1629,64 @@ def run_scheduled_parse():
             daemon=True
         ).start()
 
-async def log_updater(chat_id: int):
-    """Периодически обновляет сообщение с логами"""
-    global parsing_in_progress
-    
-    while parsing_in_progress or not log_queue.empty():
-        await update_log_message(chat_id)
-        await asyncio.sleep(2)
-    
-    # Финальное обновление
-    await update_log_message(chat_id)
-    
-    # Отправляем результат только если парсинг завершен
-    if not parsing_in_progress:
-        await send_parse_results(chat_id)
+async def process_events():
+    """Обрабатывает события из потоков парсера: логи, прогресс и завершение"""
+    while True:
+        # Ждем событие без таймаута, если отправлять нечего - пустых пробуждений нет
+        has_pending = log_chat_id is not None and log_streamer.has_pending()
+        timeout = log_streamer.seconds_until_ready() if has_pending else None
+        event = await event_bridge.get(timeout)
+        
+        if log_chat_id is None:
+            continue
+        
+        try:
+            if event is None or event["type"] in (EVENT_LOG, EVENT_PROGRESS):
+                await update_log_message(log_chat_id)
+            elif event["type"] == EVENT_FINISHED:
+                # Финальное обновление и отправка результатов сразу после завершения
+                await update_log_message(log_chat_id, force=True)
+                await send_parse_results(log_chat_id, event.get("result"), event.get("report"))
+        except Exception as e:
+            print(f"❌ Ошибка обработки события {event}: {str(e)}")
+
+async def send_profile_report(chat_id: int, report_path: str):
+    """Отправляет отчет профилирования вместе с результатами"""
+    try:
+        await bot.send_document(
+            chat_id=chat_id,
+            document=FSInputFile(report_path),
+            caption="🔬 Отчет профилирования: горячие функции, выделения памяти и пики по этапам"
+        )
+        asyncio.create_task(delete_file_after_delay(report_path, delay_seconds=10))
+    except Exception as e:
+        await bot.send_message(chat_id, f"❌ Не удалось отправить отчет профилирования: {str(e)}")
 
-async def send_parse_results(chat_id: int):
-    """Отправляет результаты парсинга администратору"""
+async def send_parse_results(chat_id: int, file_path=None, report_path: str = None):
+    """Отправляет результаты парсинга администратору (один файл или список файлов по регионам)"""
+    file_paths = file_path if isinstance(file_path, list) else [file_path]
+    file_paths = [path for path in file_paths if path and os.path.exists(path)]
     try:
-        # Ищем последний созданный файл с номерами
-        output_dir = "output"
-        phone_files = [f for f in os.listdir(output_dir) if f.startswith("phones_") and f.endswith(".txt")]
+        if not file_paths:
+            # Ищем последний созданный файл с номерами
+            output_dir = config.OUTPUT_DIR
+            phone_files = [f for f in os.listdir(output_dir) if f.startswith("phones_") and f.endswith(".txt")]
+            if phone_files:
+                # Сортируем по времени создания и берем самый новый
+                latest_file = max(phone_files, key=lambda f: os.path.getctime(os.path.join(output_dir, f)))
+                file_paths = [os.path.join(output_dir, latest_file)]
         
-        if phone_files:
-            # Сортируем по времени создания и берем самый новый
-            latest_file = max(phone_files, key=lambda f: os.path.getctime(os.path.join(output_dir, f)))
-            file_path = os.path.join(output_dir, latest_file)
-            
-            file = FSInputFile(file_path)
-            await bot.send_document(
-                chat_id=chat_id,
-                document=file,
-                caption="📄 Результат автоматического парсинга"
-            )
-            
-            # Запускаем автоудаление файла через 10 секунд
-            asyncio.create_task(delete_file_after_delay(file_path, delay_seconds=10))
+        if file_paths:
+            for path in file_paths:
+                file = FSInputFile(path)
+                await bot.send_document(
+                    chat_id=chat_id,
+                    document=file,
+                    caption="📄 Результат автоматического парсинга"
+                )
+                
+                # Запускаем автоудаление файла через 10 секунд
+                asyncio.create_task(delete_file_after_delay(path, delay_seconds=10))
         else:
             await bot.send_message(
                 chat_id, 
@@ -1512,11 +1695,26 @@ async def send_parse_results(chat_id: int):
             )
     except Exception as e:
         await bot.send_message(chat_id, f"❌ Не удалось отправить результаты: {str(e)}")
+    
+    if report_path and os.path.exists(report_path):
+        await send_profile_report(chat_id, report_path)
 
 async def main():
     """Основная функция запуска бота"""
     global bot_task
     
+    # HTTP-эндпоинт с метриками парсинга
+    if config.METRICS_PORT:
+        metrics.start_http_server(config.METRICS_PORT, host=config.METRICS_HOST)
+    
+    # Справочник регионов и файл со списком загружаются один раз
+    catalog = await asyncio.to_thread(regions_catalog.warm_up)
+    print(f"🗺️ Загружено регионов: {len(catalog)}")
+    
+    # Мост для событий из потоков парсера в цикл бота
+    event_bridge.attach()
+    asyncio.create_task(process_events())
+    
     # Настраиваем автоматический парсинг при запуске
     schedule_daily_parse()
     scheduler.start()
@@ -1524,22 +1722,14 @@ async def main():
     # Запускаем бота в фоновой задаче
     bot_task = asyncio.create_task(dp.start_polling(bot))
     
-    # Бесконечный цикл для проверки состояния парсинга
     while True:
         try:
-            # Если идет автоматический парсинг, обновляем логи
-            if parsing_in_progress:
-                admin_id = os.getenv("TELEGRAM_ADMIN_ID")
-                if admin_id:
-                    await log_updater(int(admin_id))
-            
-            # Проверяем каждые 10 секунд
-            await asyncio.sleep(10)
+            await bot_task
+            break  # Поллинг остановлен штатно
         except Exception as e:
             print(f"❌ Ошибка в основном цикле: {str(e)}")
-            # Перезапускаем задачу бота при необходимости
-            if bot_task.done():
-                bot_task = asyncio.create_task(dp.start_polling(bot))
+            # Перезапускаем задачу бота
+            bot_task = asyncio.create_task(dp.start_polling(bot))
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,126 @@
+import re
+from contextlib import contextmanager
+import config
+import utils
+from playwright.sync_api import sync_playwright
+
+# Поля, которые берем из перехваченного запроса к API
+HEADER_FIELDS = {"cookie": "Cookie", "referer": "Referer", "origin": "Origin"}
+PAYLOAD_FIELDS = ("blockId", "platformType", "pageType", "placeType", "refererUrl", "analyticClientId", "utm")
+
+CONTACTS_BUTTON = '[data-testid="contacts-button"]'
+PHONE_SELECTOR = '[data-testid="PhoneLink"], .phone-number'
+
+def _is_api_call(request):
+    return request.url == config.API_URL and request.method == "POST"
+
+def _block_heavy(route, request):
+    """В облегченном режиме отбрасывает все, что не нужно для кнопки контактов и запроса к API"""
+    if request.resource_type in config.BROWSER_BLOCKED_RESOURCES or \
+            any(host in request.url for host in config.BROWSER_BLOCKED_HOSTS):
+        route.abort()
+    else:
+        route.continue_()
+
+@contextmanager
+def _open_page(url):
+    """Запускает браузер и открывает объявление (до DOMContentLoaded, без ожидания картинок и скриптов аналитики)"""
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=True)
+        try:
+            page = browser.new_context().new_page()
+            if config.BROWSER_LEAN:
+                page.route("**/*", _block_heavy)
+            page.goto(url, wait_until="domcontentloaded", timeout=config.BROWSER_NAV_TIMEOUT * 1000)
+            yield page
+        finally:
+            browser.close()
+
+def _click_contacts(page, log):
+    """Нажимает кнопку контактов, как только она появилась; False - кнопки нет"""
+    try:
+        page.wait_for_selector(CONTACTS_BUTTON, state="visible", timeout=config.BROWSER_EVENT_TIMEOUT * 1000)
+        page.click(CONTACTS_BUTTON)
+        return True
+    except Exception as e:
+        # Кнопка могла не стать "видимой" без стилей - кликаем из скрипта страницы
+        try:
+            clicked = page.evaluate(f'''() => {{
+                const btn = document.querySelector('{CONTACTS_BUTTON}');
+                if (btn) btn.click();
+                return !!btn;
+            }}''')
+        except Exception:
+            clicked = False
+        if not clicked:
+            log(f"❌ Ошибка при клике на кнопку: {str(e)}")
+        return clicked
+
+def harvest_identity(url, log=print):
+    """Открывает объявление в браузере и перехватывает запрос к API номеров.
+
+    Возвращает (заголовки, поля payload) из перехваченного запроса
+    или None, если запрос перехватить не удалось. Браузер закрывается
+    сразу после того, как запрос к API отправлен.
+    """
+    intercepted_headers = None
+    intercepted_payload = None
+
+    try:
+        with _open_page(url) as page:
+            with page.expect_request(_is_api_call, timeout=config.BROWSER_EVENT_TIMEOUT * 1000) as api_request:
+                if not _click_contacts(page, log):
+                    # Запроса к API без кнопки не будет - не ждем таймаут
+                    raise RuntimeError("кнопка контактов не найдена")
+                log("✅ Кнопка контактов нажата")
+            request = api_request.value
+            # all_headers() - вместе с cookie, которые браузер добавляет при отправке
+            intercepted_headers = request.all_headers()
+            intercepted_payload = request.post_data_json
+            log(f"📡 Перехвачен запрос на API: {request.url}")
+    except Exception as e:
+        log(f"❌ Ошибка при активации через браузер: {str(e)}")
+
+    if not (intercepted_headers and intercepted_payload):
+        return None
+    headers = {name: intercepted_headers[key] for key, name in HEADER_FIELDS.items() if intercepted_headers.get(key)}
+    payload = {key: intercepted_payload[key] for key in PAYLOAD_FIELDS if key in intercepted_payload}
+    return headers, payload
+
+def _phone_result(phone_text, log, source):
+    # Очищаем номер от лишних символов
+    phone_text = re.sub(r'[^\d+]', '', phone_text)
+    log(f"📞 Извлечен номер {source}: {phone_text}")
+    return {
+        "phone": utils.format_phone(phone_text),
+        "notFormattedPhone": phone_text
+    }
+
+def fetch_phone(url, log=print):
+    """Получает номер через Playwright: из ответа API, который страница получает по кнопке контактов.
+
+    Если ответ API не пришел или в нем нет номера, номер берется
+    из страницы (без дополнительного ожидания).
+    """
+    try:
+        with _open_page(url) as page:
+            phone = None
+            try:
+                with page.expect_response(lambda r: _is_api_call(r.request),
+                                          timeout=config.BROWSER_EVENT_TIMEOUT * 1000) as api_response:
+                    if not _click_contacts(page, log):
+                        raise RuntimeError("кнопка контактов не найдена")
+                data = api_response.value.json()
+                phone = data.get("phone") if isinstance(data, dict) else None
+            except Exception as e:
+                log(f"⏰ Ответ API на странице не получен: {str(e)}")
+            if phone:
+                return _phone_result(phone, log, "из ответа API на странице")
+
+            phone_element = page.query_selector(PHONE_SELECTOR)
+            if phone_element:
+                return _phone_result(phone_element.inner_text(), log, "со страницы")
+    except Exception as e:
+        log(f"❌ Ошибка при получении номера через браузер: {str(e)}")
+
+    return None
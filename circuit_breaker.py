@@ -0,0 +1,153 @@
+import time
+import threading
+from collections import deque
+import config
+import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_NAMES = {
+    CLOSED: "закрыт (API работает)",
+    OPEN: "открыт (API недоступен)",
+    HALF_OPEN: "полуоткрыт (пробные запросы)",
+}
+
+class CircuitBreaker:
+    """Автомат защиты для внешнего API: closed -> open -> half_open -> closed.
+
+    В состоянии closed считается доля ошибок по последним window вызовам
+    (не старше window_seconds). Если она превысила failure_rate, автомат
+    открывается и open_seconds не пропускает запросы. Затем пропускает
+    по одному пробному запросу: probes успехов подряд закрывают автомат,
+    любая ошибка снова открывает.
+    """
+
+    def __init__(self, name, window=20, window_seconds=60, min_calls=5, failure_rate=0.5, open_seconds=30,
+                 probes=2):
+        self.name = name
+        self.window = window
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = CLOSED
+        self._outcomes = deque()  # (время, ошибка)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_successes = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        """callback(сообщение) вызывается при каждой смене состояния"""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def _transition(self, state, reason):
+        # Вызывается под self._lock; сообщения рассылаются после выхода из него
+        previous, self.state = self.state, state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state != CLOSED:
+            self._outcomes.clear()
+        self._probe_in_flight = False
+        self._probe_successes = 0
+        metrics.breaker_transitions.inc(breaker=self.name, state=state)
+        message = f"🔌 Автомат {self.name}: {STATE_NAMES[previous]} -> {STATE_NAMES[state]} ({reason})"
+        return message, list(self._listeners)
+
+    @staticmethod
+    def _notify(event):
+        if event is None:
+            return
+        message, listeners = event
+        for listener in listeners:
+            listener(message)
+
+    def allow(self):
+        """Можно ли отправить запрос сейчас (в half_open - только один пробный одновременно)"""
+        event = None
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                event = self._transition(HALF_OPEN, f"прошло {self.open_seconds:g} сек")
+            if self.state == CLOSED:
+                allowed = True
+            elif self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                allowed = True
+            else:
+                allowed = False
+        self._notify(event)
+        return allowed
+
+    def _trim(self, now):
+        while self._outcomes and (len(self._outcomes) > self.window or
+                                  now - self._outcomes[0][0] > self.window_seconds):
+            self._outcomes.popleft()
+
+    def record_success(self):
+        event = None
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                self._probe_successes += 1
+                if self._probe_successes >= self.probes:
+                    event = self._transition(CLOSED, f"{self.probes} пробных запросов успешны")
+            elif self.state == CLOSED:
+                now = time.monotonic()
+                self._outcomes.append((now, False))
+                self._trim(now)
+        self._notify(event)
+
+    def record_failure(self):
+        event = None
+        with self._lock:
+            if self.state == HALF_OPEN:
+                event = self._transition(OPEN, "пробный запрос не удался")
+            elif self.state == CLOSED:
+                now = time.monotonic()
+                self._outcomes.append((now, True))
+                self._trim(now)
+                failures = sum(1 for _, failed in self._outcomes if failed)
+                calls = len(self._outcomes)
+                if calls >= self.min_calls and failures / calls >= self.failure_rate:
+                    event = self._transition(OPEN, f"ошибок {failures} из {calls} последних запросов")
+        self._notify(event)
+
+    def seconds_until_probe(self):
+        """Сколько осталось до пробных запросов (0 - запросы уже можно отправлять)"""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name):
+    """Общий для всех регионов автомат по имени (например, API номеров)"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(
+                name,
+                window=config.BREAKER_WINDOW,
+                min_calls=config.BREAKER_MIN_CALLS,
+                failure_rate=config.BREAKER_FAILURE_RATE,
+                open_seconds=config.BREAKER_OPEN_SECONDS,
+                probes=config.BREAKER_PROBES,
+            )
+        return breaker
+
+def reset():
+    """Сбрасывает все автоматы (будут созданы заново из настроек)"""
+    with _breakers_lock:
+        _breakers.clear()
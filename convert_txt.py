@@ -1,17 +1,15 @@
-import json
 from datetime import datetime
-from .config import REGIONS_FILE, CODES_FILE
+from config import REGIONS_FILE, CODES_FILE
+from utils import dedupe_urls
+from regions_io import iter_listings
 
 def extract_urls_to_txt():
     """Извлекает URL из JSON и сохраняет в текстовый файл"""
     print(f"[{datetime.now()}] Извлечение URL из {REGIONS_FILE}...")
     
     try:
-        with open(REGIONS_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        urls = [item['url'] for item in data['data']]
-        unique_urls = list(set(urls))  # Убираем дубли
+        urls = [item['url'] for item in iter_listings(REGIONS_FILE) if item.get('url')]
+        unique_urls = [url for _, url in dedupe_urls(urls)]  # Убираем дубли с сохранением порядка
         
         with open(CODES_FILE, 'w', encoding='utf-8') as f:
             f.write("\n".join(unique_urls))
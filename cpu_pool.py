@@ -0,0 +1,55 @@
+"""Пул процессов для CPU-задач разбора страниц.
+
+BeautifulSoup и регулярные выражения по большим страницам держат GIL:
+пока они работают, сетевые потоки и обработчики бота (aiogram) стоят.
+Такие задачи выполняются в отдельных процессах, вызывающий поток только
+ждет результат. Функции задач должны быть объявлены на уровне модуля,
+а аргументы и результат - сериализуемыми (pickle).
+"""
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import config
+import metrics
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # forkserver: процессы порождаются из чистого однопоточного сервера,
+                # а не копией процесса бота с его потоками и блокировками
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                _executor = ProcessPoolExecutor(max_workers=config.CPU_WORKERS,
+                                                mp_context=multiprocessing.get_context(method))
+    return _executor
+
+def run(fn, *args):
+    """Выполняет fn(*args) в пуле процессов и возвращает результат.
+
+    Если пул отключен (CIAN_CPU_WORKERS=0) или сломан (процесс
+    завершился аварийно), задача выполняется в текущем потоке.
+    """
+    task = fn.__name__
+    if config.CPU_WORKERS > 0:
+        try:
+            result = _get_executor().submit(fn, *args).result()
+            metrics.cpu_tasks.inc(task=task, mode="process")
+            return result
+        except BrokenProcessPool:
+            print("⚠️ Пул процессов разбора недоступен, пересоздаем; задача выполняется в текущем потоке")
+            shutdown()
+    metrics.cpu_tasks.inc(task=task, mode="inline")
+    return fn(*args)
+
+def shutdown():
+    """Останавливает пул (следующая задача создаст его заново)"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+
+# Типы событий, которые рабочие потоки публикуют в цикл бота
+EVENT_LOG = "log"
+EVENT_PROGRESS = "progress"
+EVENT_FINISHED = "finished"
+
+class EventBridge:
+    """Передает события из рабочих потоков в asyncio-очередь бота через call_soon_threadsafe"""
+
+    def __init__(self):
+        self.loop = None
+        self.queue = None
+        self._lock = threading.Lock()
+        self._coalesced = set()
+
+    def attach(self, loop=None):
+        """Привязывает мост к циклу событий бота (вызывать из этого цикла)"""
+        self.loop = loop or asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def publish(self, event_type, coalesce=False, **payload):
+        """Публикует событие из любого потока.
+
+        Если coalesce=True, пока событие этого типа ждет обработки в очереди,
+        новые такие же события не добавляются - очередь остается ограниченной.
+        """
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return False
+
+        if coalesce:
+            with self._lock:
+                if event_type in self._coalesced:
+                    return True
+                self._coalesced.add(event_type)
+
+        event = {"type": event_type, **payload}
+        try:
+            loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            # Цикл уже остановлен
+            return False
+        return True
+
+    async def get(self, timeout=None):
+        """Ждет следующее событие; возвращает None по таймауту"""
+        try:
+            if timeout is None:
+                event = await self.queue.get()
+            else:
+                event = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+        with self._lock:
+            self._coalesced.discard(event["type"])
+        return event
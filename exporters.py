@@ -0,0 +1,151 @@
+import csv
+import gzip
+import os
+
+# Колонки выгрузки номеров (одна строка на объявление)
+COLUMNS = ("announcement_id", "phone", "source", "siteBlockId", "author_type", "region")
+
+EXPORT_FORMATS = ("txt", "csv", "xlsx", "parquet")
+
+class BaseExporter:
+    """Потоковый экспортер: строки пишутся по мере получения результатов"""
+    extension = None
+
+    def __init__(self, path_base, use_gzip=False):
+        self.use_gzip = use_gzip
+        self.path = f"{path_base}.{self.extension}"
+        self.rows_written = 0
+
+    def write(self, row):
+        """Записывает одну строку (словарь с ключами из COLUMNS)"""
+        self._write_values([row.get(column) for column in COLUMNS])
+        self.rows_written += 1
+
+    def _write_values(self, values):
+        raise NotImplementedError
+
+    def close(self):
+        """Завершает запись и возвращает путь к готовому файлу"""
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+class CsvExporter(BaseExporter):
+    """CSV (UTF-8 с BOM для Excel/CRM), опционально сжатый gzip на лету"""
+    extension = "csv"
+
+    def __init__(self, path_base, use_gzip=False):
+        super().__init__(path_base, use_gzip)
+        if use_gzip:
+            self.path += ".gz"
+            self._file = gzip.open(self.path, 'wt', encoding='utf-8-sig', newline='')
+        else:
+            self._file = open(self.path, 'w', encoding='utf-8-sig', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+
+    def _write_values(self, values):
+        self._writer.writerow(["" if value is None else value for value in values])
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        return self.path
+
+class XlsxExporter(BaseExporter):
+    """XLSX в режиме write_only (openpyxl) - строки не держатся в памяти"""
+    extension = "xlsx"
+
+    def __init__(self, path_base, use_gzip=False):
+        # XLSX уже является zip-архивом, дополнительное сжатие не применяем
+        super().__init__(path_base, use_gzip=False)
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise RuntimeError("Для экспорта в XLSX установите пакет openpyxl")
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet("phones")
+        self._sheet.append(list(COLUMNS))
+        self._closed = False
+
+    def _write_values(self, values):
+        self._sheet.append(values)
+
+    def close(self):
+        if not self._closed:
+            self._workbook.save(self.path)
+            self._closed = True
+        return self.path
+
+class ParquetExporter(BaseExporter):
+    """Parquet (pyarrow), строки пишутся row group'ами фиксированного размера"""
+    extension = "parquet"
+
+    def __init__(self, path_base, use_gzip=False, batch_size=500):
+        super().__init__(path_base, use_gzip)
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Для экспорта в Parquet установите пакет pyarrow")
+        self._pa = pa
+        self._schema = pa.schema([
+            ("announcement_id", pa.string()),
+            ("phone", pa.string()),
+            ("source", pa.string()),
+            ("siteBlockId", pa.int64()),
+            ("author_type", pa.string()),
+            ("region", pa.string()),
+        ])
+        # Внутреннее сжатие Parquet вместо внешнего gzip
+        self._writer = pq.ParquetWriter(self.path, self._schema, compression="gzip" if use_gzip else "snappy")
+        self._batch_size = batch_size
+        self._batch = []
+        self._closed = False
+
+    def _write_values(self, values):
+        self._batch.append(values)
+        if len(self._batch) >= self._batch_size:
+            self._flush_batch()
+
+    def _flush_batch(self):
+        if not self._batch:
+            return
+        columns = list(zip(*self._batch))
+        arrays = []
+        for field, column in zip(self._schema, columns):
+            if field.type == self._pa.int64():
+                column = [int(value) if value not in (None, "") else None for value in column]
+            else:
+                column = [str(value) if value is not None else None for value in column]
+            arrays.append(self._pa.array(column, type=field.type))
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self._schema))
+        self._batch = []
+
+    def close(self):
+        if not self._closed:
+            self._flush_batch()
+            self._writer.close()
+            self._closed = True
+        return self.path
+
+_EXPORTERS = {
+    "csv": CsvExporter,
+    "xlsx": XlsxExporter,
+    "parquet": ParquetExporter,
+}
+
+def create_exporter(export_format, path_base, use_gzip=False):
+    """Создает потоковый экспортер для формата или None для текстового отчета (txt)"""
+    export_format = (export_format or "txt").lower()
+    if export_format == "txt":
+        return None
+    if export_format not in _EXPORTERS:
+        raise ValueError(f"Неизвестный формат экспорта: {export_format}. Доступны: {', '.join(EXPORT_FORMATS)}")
+    os.makedirs(os.path.dirname(path_base) or ".", exist_ok=True)
+    return _EXPORTERS[export_format](path_base, use_gzip=use_gzip)
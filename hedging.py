@@ -0,0 +1,124 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import config
+import metrics
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=config.HEDGE_WORKERS, thread_name_prefix="hedge")
+    return _executor
+
+def _never_superseded():
+    return False
+
+class _Race:
+    """Какая из копий запроса ответила первой: ответы остальных не учитываются"""
+
+    def __init__(self):
+        self._claimed = False
+        self._lock = threading.Lock()
+
+    def superseded(self):
+        with self._lock:
+            if self._claimed:
+                return True
+            self._claimed = True
+            return False
+
+class Hedger:
+    """Хеджирование запросов: если ответа нет дольше текущего p95 этапа, отправляется дубль.
+
+    Побеждает первый успешный ответ, второй дорабатывает в фоне и
+    отбрасывается, не попадая в статистику ответов и прокси. Дубль идет
+    через тот же http_client, то есть через общий лимит запросов и пул
+    прокси. Доля дублей ограничена budget от всех вызовов, чтобы хвост
+    задержек не покупался удвоением трафика.
+    """
+
+    def __init__(self, stage, quantile=0.95, min_samples=20, budget=0.1, min_delay=0.05):
+        self.stage = stage
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.budget = budget
+        self.min_delay = min_delay
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Через сколько секунд отправлять дубль (None - замеров этапа пока мало)"""
+        if metrics.stage_duration.count_matching(stage=self.stage) < self.min_samples:
+            return None
+        return max(self.min_delay, metrics.stage_duration.quantile_matching(self.quantile, stage=self.stage))
+
+    def _take_budget(self):
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    def _return_budget(self):
+        with self._lock:
+            self.hedges -= 1
+
+    def _record(self, outcome):
+        metrics.hedged_calls.inc(stage=self.stage, outcome=outcome)
+        if outcome == "hedge_won":
+            with self._lock:
+                self.hedge_wins += 1
+
+    def call(self, request, reserve=None):
+        """Выполняет request с хеджированием и возвращает первый успешный результат.
+
+        request(superseded) получает функцию, которую вызывает по получении
+        ответа: True - ответ другой копии уже принят, этот не нужно учитывать.
+        reserve() - перед отправкой дубля берет его долю лимита (например,
+        токен идентичности); False - лимит исчерпан, дубль не отправляется.
+        """
+        with self._lock:
+            self.calls += 1
+        delay = self.delay()
+        if delay is None:
+            self._record("not_hedged")
+            return request(_never_superseded)
+
+        executor = _get_executor()
+        race = _Race()
+        primary = executor.submit(request, race.superseded)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_budget():
+            self._record("not_hedged")
+            return primary.result()
+        if reserve is not None and not reserve():
+            self._return_budget()
+            self._record("no_token")
+            return primary.result()
+
+        hedge = executor.submit(request, race.superseded)
+        done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        winner = primary if primary in done else hedge
+        other = hedge if winner is primary else primary
+        if winner.exception() is not None:
+            # Первый ответ - ошибка: ждем второй, при его ошибке отдаем первую
+            try:
+                result = other.result()
+            except Exception:
+                raise winner.exception()
+            winner = other
+        else:
+            result = winner.result()
+        self._record("hedge_won" if winner is hedge else "primary_won")
+        return result
+
+    def summary(self):
+        """(вызовов, дублей, побед дубля) для итогового лога"""
+        with self._lock:
+            return self.calls, self.hedges, self.hedge_wins
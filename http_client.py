@@ -0,0 +1,204 @@
+import time
+import threading
+from urllib.parse import urlparse
+import requests
+import config
+import metrics
+import proxy_pool
+import response_classifier
+from rate_limit import TokenBucket
+from single_flight import SingleFlight
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
+
+_buckets = {}
+_sessions = {}
+_blocks = {}  # (хост, исходящий адрес) -> [блокировок подряд, пауза до (monotonic)]
+_lock = threading.Lock()
+
+def _get_bucket(host, egress=None):
+    if config.HOST_RATE <= 0:
+        return None
+    with _lock:
+        bucket = _buckets.get((host, egress))
+        if bucket is None:
+            bucket = _buckets[(host, egress)] = TokenBucket(config.HOST_RATE, config.HOST_BURST)
+        return bucket
+
+def throttle(url, proxy=None):
+    """Ждет своей очереди в общем для всех регионов лимите запросов к хосту.
+
+    Лимит считается на каждый исходящий адрес: через N прокси к хосту
+    можно отправить в N раз больше запросов.
+    """
+    host = urlparse(url).hostname or ""
+    egress = proxy.url if proxy else None
+    waited = _wait_block(host, egress)
+    bucket = _get_bucket(host, egress)
+    if bucket is not None:
+        waited += bucket.acquire()
+    if waited:
+        metrics.rate_limit_wait.inc(waited, host=host)
+    return waited
+
+def _wait_block(host, egress):
+    """Ждет окончания паузы после блокировки этого адреса сайтом"""
+    with _lock:
+        state = _blocks.get((host, egress))
+        pause = state[1] - time.monotonic() if state else 0
+    if pause <= 0:
+        return 0.0
+    time.sleep(pause)
+    return pause
+
+def _register_block(host, egress, verdict):
+    """Пауза для адреса после блокировки: растет с каждой блокировкой подряд или берется из Retry-After"""
+    with _lock:
+        state = _blocks.setdefault((host, egress), [0, 0.0])
+        state[0] += 1
+        pause = verdict.retry_after or min(config.BLOCK_MAX_BACKOFF, config.BLOCK_BACKOFF * 2 ** (state[0] - 1))
+        state[1] = time.monotonic() + pause
+    return pause
+
+def _clear_block(host, egress):
+    with _lock:
+        _blocks.pop((host, egress), None)
+
+def get_session(region=None):
+    """Сессия requests для региона: свои cookies и keep-alive соединения"""
+    key = str(region or "default")
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = requests.Session()
+            session.headers.update({'User-Agent': USER_AGENT})
+        return session
+
+def drop_session(region=None):
+    """Закрывает сессию региона: следующий запрос начнется с чистыми cookies"""
+    with _lock:
+        session = _sessions.pop(str(region or "default"), None)
+    if session is not None:
+        session.close()
+
+def proxies_enabled():
+    return proxy_pool.get_pool() is not None
+
+def request(method, url, region=None, classify=response_classifier.classify_status, superseded=None, **kwargs):
+    """Запрос через сессию региона: общий лимит на хост и (если настроены) прокси из пула.
+
+    Ответ классифицируется (response.verdict): при блокировке или капче
+    прокси уходит на паузу бана, а без прокси пауза ставится на хост,
+    и сессия региона сбрасывается, чтобы сменить cookies. 429 - не бан:
+    адрес только ждет (не меньше Retry-After), сессия сохраняется.
+
+    superseded() - для копий хеджированного запроса: True, если ответ
+    другой копии уже принят; такой ответ не учитывается в статистике.
+    """
+    pool = proxy_pool.get_pool()
+    proxy = pool.acquire() if pool else None
+    throttle(url, proxy)
+    if proxy is not None:
+        kwargs["proxies"] = {"http": proxy.url, "https": proxy.url}
+    started = time.perf_counter()
+    try:
+        response = get_session(region).request(method, url, **kwargs)
+    except requests.RequestException:
+        if proxy is not None:
+            pool.report_failure(proxy)
+        raise
+    latency = time.perf_counter() - started
+    
+    verdict = response.verdict = classify(response)
+    if superseded is not None and superseded():
+        return response
+    metrics.response_verdicts.inc(verdict=verdict.kind)
+    host = urlparse(url).hostname or ""
+    if verdict.kind == response_classifier.RATE_LIMITED:
+        if proxy is not None:
+            pool.report_failure(proxy, latency, retry_after=verdict.retry_after)
+        else:
+            _register_block(host, None, verdict)
+    elif verdict.is_block:
+        if proxy is not None:
+            pool.report_failure(proxy, latency, banned=True)
+        else:
+            _register_block(host, None, verdict)
+        drop_session(region)
+    else:
+        if proxy is not None:
+            if verdict.kind == response_classifier.ERROR:
+                pool.report_failure(proxy, latency)
+            else:
+                pool.report_success(proxy, latency)
+        else:
+            _clear_block(host, None)
+    return response
+
+def _fetch_page(url, region=None, **kwargs):
+    attempts = 0
+    while True:
+        response = request("GET", url, region=region, classify=response_classifier.classify_listing, **kwargs)
+        if not response.verdict.is_block or attempts >= config.BLOCK_RETRIES:
+            return response
+        attempts += 1
+        metrics.retries.inc(stage="blocked_page")
+
+_parsed_lock = threading.Lock()
+_page_flights = SingleFlight(on_shared=lambda key: metrics.coalesced_requests.inc(kind="page"))
+
+def get_page(url, region=None, **kwargs):
+    """Загружает страницу объявления с проверкой на блокировку, капчу и снятие.
+
+    При блокировке повторяет запрос (после паузы или через другой прокси)
+    до BLOCK_RETRIES раз. Возвращает ответ с вердиктом в response.verdict,
+    ошибки HTTP не выбрасывает - решение принимает вызывающий код.
+
+    Одновременные запросы одной страницы (обогащение и этап телефонов,
+    пересекающиеся запуски) объединяются в один сетевой запрос с общим ответом -
+    только в пределах региона и с теми же параметрами запроса: у другого
+    региона своя сессия (cookies), а ответ получен с параметрами первого вызова.
+    """
+    options = tuple(sorted((name, repr(value)) for name, value in kwargs.items()))
+    response, _ = _page_flights.do(("GET", url, str(region), options),
+                                   lambda: _fetch_page(url, region=region, **kwargs))
+    return response
+
+def parse_once(response, parser):
+    """parser(response), вычисленный один раз на ответ: объединенные запросы разбирают страницу один раз"""
+    with _parsed_lock:
+        cache = response.__dict__.setdefault("parsed", {})
+        if parser in cache:
+            metrics.coalesced_requests.inc(kind="parse")
+            return cache[parser]
+    # Разбор - вне блокировки: в редкой гонке страница разберется дважды с тем же результатом
+    result = parser(response)
+    with _parsed_lock:
+        return cache.setdefault(parser, result)
+
+def get(url, region=None, **kwargs):
+    return request("GET", url, region=region, **kwargs)
+
+def post(url, region=None, **kwargs):
+    return request("POST", url, region=region, **kwargs)
+
+def proxy_report():
+    """Состояние прокси пула (пустой список, если прокси не настроены)"""
+    pool = proxy_pool.get_pool()
+    return pool.snapshot() if pool else []
+
+def close_sessions():
+    """Закрывает все сессии (например, по окончании запуска)"""
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+def reset():
+    """Закрывает сессии и сбрасывает лимиты (после изменения настроек лимита)"""
+    close_sessions()
+    with _lock:
+        _buckets.clear()
+        _blocks.clear()
+    proxy_pool.reset_pool()
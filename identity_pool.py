@@ -0,0 +1,242 @@
+import time
+import queue
+import threading
+import config
+import metrics
+from rate_limit import TokenBucket
+
+class Identity:
+    """Набор данных для API номеров (cookie, analyticClientId, utm и т.п.) со своим лимитом и здоровьем"""
+
+    def __init__(self, index, headers, payload, harvested=False, rate=0, burst=1):
+        self.index = index
+        self.headers = headers
+        self.payload = payload
+        self.harvested = harvested  # False - значения по умолчанию из config
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.ready = True
+        self.uses = 0
+        self.requests = 0
+        self.failures = 0
+        self.rejections = 0
+        self.harvests = 0
+        self.consecutive_failures = 0
+        self.harvested_at = time.monotonic()
+
+    @property
+    def label(self):
+        return f"#{self.index}"
+
+    def update(self, headers, payload, harvested):
+        self.headers = headers
+        self.payload = payload
+        self.harvested = harvested
+        self.uses = 0
+        self.consecutive_failures = 0
+        self.harvested_at = time.monotonic()
+
+    def as_dict(self):
+        return {
+            "identity": self.label,
+            "harvested": self.harvested,
+            "ready": self.ready,
+            "requests": self.requests,
+            "failures": self.failures,
+            "rejections": self.rejections,
+            "harvests": self.harvests,
+        }
+
+class IdentityPool:
+    """Пул независимо полученных через браузер идентичностей для запросов к API.
+
+    Первая идентичность получается сразу (или тоже в фоне, если пул
+    запущен заранее), остальные и все повторные - в фоновом потоке. Отклоненная сервером (401/403), исчерпавшая лимит
+    использований или сбоящая подряд идентичность выводится из ротации
+    и перехватывается заново, пока запросы идут через остальные.
+    """
+
+    def __init__(self, size, harvest=None, rate=0, burst=1, max_uses=0, max_failures=3, wait_timeout=120,
+                 log=print):
+        self.size = max(1, size) if harvest else 1
+        self.harvest = harvest  # harvest(index) -> (headers, payload) или None
+        self.rate = rate
+        self.burst = burst
+        self.max_uses = max_uses
+        self.max_failures = max_failures
+        self.wait_timeout = wait_timeout
+        self.log = log
+        self.identities = []
+        self._next = 0
+        self._condition = threading.Condition()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._closed = False
+
+    def __len__(self):
+        return len(self.identities)
+
+    def _harvest(self, index):
+        """Возвращает (headers, payload, harvested): при неудаче - значения по умолчанию"""
+        if self.harvest is not None:
+            try:
+                result = self.harvest(index)
+            except Exception as e:
+                self.log(f"❌ Ошибка получения идентичности #{index}: {str(e)}")
+                result = None
+            if result:
+                metrics.identity_harvests.inc(status="success")
+                headers, payload = result
+                return dict(config.HEADERS, **headers), dict(config.PAYLOAD_TEMPLATE, **payload), True
+            metrics.identity_harvests.inc(status="failure")
+        return config.HEADERS.copy(), config.PAYLOAD_TEMPLATE.copy(), False
+
+    def start(self, background=False):
+        """Получает первую идентичность сразу, остальные ставит в очередь фонового потока.
+
+        background=True - первая тоже перехватывается в фоне: start()
+        возвращается сразу, а acquire() ждет первую готовую идентичность.
+        """
+        if background and self.harvest is not None:
+            for index in range(self.size):
+                self._add_pending(index)
+            return self
+        headers, payload, harvested = self._harvest(0)
+        if not harvested and self.harvest is not None:
+            self.log("⚠️ Не удалось перехватить данные, используем значения по умолчанию")
+        first = Identity(0, headers, payload, harvested, self.rate, self.burst)
+        first.harvests = int(harvested)
+        self.identities.append(first)
+        for index in range(1, self.size):
+            self._add_pending(index)
+        return self
+
+    def _add_pending(self, index):
+        """Добавляет идентичность вне ротации и ставит ее на перехват в фоне"""
+        identity = Identity(index, config.HEADERS.copy(), config.PAYLOAD_TEMPLATE.copy(), False,
+                            self.rate, self.burst)
+        identity.ready = False
+        with self._condition:
+            self.identities.append(identity)
+        self._schedule(identity)
+
+    def _schedule(self, identity):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run_worker, name="identity-harvester", daemon=True)
+            self._worker.start()
+        self._queue.put(identity)
+
+    def _run_worker(self):
+        while True:
+            identity = self._queue.get()
+            if identity is None or self._closed:
+                return
+            headers, payload, harvested = self._harvest(identity.index)
+            with self._condition:
+                if harvested or not any(other.ready for other in self.identities):
+                    identity.update(headers, payload, harvested)
+                    identity.harvests += int(harvested)
+                    identity.ready = True
+                    self.log(f"🔑 Идентичность {identity.label} {'обновлена' if harvested else 'без перехвата'}")
+                else:
+                    # Перехват не удался, а рабочие идентичности есть - пробуем позже
+                    self.log(f"⚠️ Идентичность {identity.label} не получена, повтор позже")
+                self._condition.notify_all()
+            if not identity.ready and not self._closed:
+                time.sleep(config.IDENTITY_RETRY_DELAY)
+                self._queue.put(identity)
+
+    def acquire(self):
+        """Выбирает идентичность по кругу среди готовых, с учетом лимита каждой"""
+        deadline = time.monotonic() + self.wait_timeout
+        waiting = False
+        while True:
+            with self._condition:
+                ready = [identity for identity in self.identities if identity.ready]
+                if not ready and time.monotonic() < deadline:
+                    # Все идентичности перехватываются - ждем первую готовую
+                    if not waiting:
+                        waiting = True
+                        self.log("⏳ Нет готовых идентичностей для API, ждем перехват...")
+                    self._condition.wait(min(1.0, deadline - time.monotonic()))
+                    continue
+                if not ready:
+                    # Дольше ждать нельзя - используем любую, пусть и устаревшую
+                    ready = self.identities
+
+                shortest_wait = None
+                for offset in range(len(ready)):
+                    identity = ready[(self._next + offset) % len(ready)]
+                    wait = identity.bucket.try_acquire() if identity.bucket else 0.0
+                    if not wait:
+                        self._next = (self._next + offset + 1) % len(ready)
+                        identity.uses += 1
+                        identity.requests += 1
+                        return identity
+                    shortest_wait = wait if shortest_wait is None else min(shortest_wait, wait)
+            time.sleep(shortest_wait)
+
+    def report_success(self, identity):
+        with self._condition:
+            identity.consecutive_failures = 0
+            exhausted = self.max_uses and identity.uses >= self.max_uses
+        metrics.identity_requests.inc(identity=identity.label, status="success")
+        if exhausted:
+            self._retire(identity, "исчерпан лимит запросов")
+
+    def report_failure(self, identity, rejected=False):
+        """Учитывает сбой; отклонение сервером или несколько сбоев подряд - повод перехватить заново"""
+        with self._condition:
+            identity.failures += 1
+            identity.consecutive_failures += 1
+            if rejected:
+                identity.rejections += 1
+            retire = rejected or identity.consecutive_failures >= self.max_failures
+        metrics.identity_requests.inc(identity=identity.label, status="rejected" if rejected else "failure")
+        if retire:
+            self._retire(identity, "отклонена сервером" if rejected else f"{identity.consecutive_failures} сбоев подряд")
+
+    def _retire(self, identity, reason):
+        """Выводит идентичность из ротации и ставит в очередь на повторный перехват"""
+        if self.harvest is None:
+            return
+        with self._condition:
+            if not identity.ready:
+                return
+            identity.ready = False
+        self.log(f"🔄 Идентичность {identity.label}: {reason}, перехватываем заново в фоне")
+        self._schedule(identity)
+
+    def refresh_all(self):
+        """Перехватывает заново все идентичности в ротации: первую сразу, остальные в фоне.
+
+        Возвращает True, если первая идентичность получена через браузер.
+        Идентичности, которые уже перехватываются в фоне, не трогает.
+        """
+        if self.harvest is None:
+            return False
+        with self._condition:
+            active = [identity for identity in self.identities if identity.ready]
+            for identity in active:
+                identity.ready = False
+        if not active:
+            return False
+        first, rest = active[0], active[1:]
+        headers, payload, harvested = self._harvest(first.index)
+        with self._condition:
+            first.update(headers, payload, harvested)
+            first.harvests += int(harvested)
+            first.ready = True
+            self._condition.notify_all()
+        for identity in rest:
+            self._schedule(identity)
+        return harvested
+
+    def snapshot(self):
+        with self._condition:
+            return [identity.as_dict() for identity in self.identities]
+
+    def close(self):
+        """Останавливает фоновый поток (текущий перехват дорабатывает сам)"""
+        self._closed = True
+        if self._worker is not None:
+            self._queue.put(None)
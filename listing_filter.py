@@ -0,0 +1,88 @@
+"""Локальный фильтр объявлений по комнатам, этажам и цене.
+
+Файл регионов хранит выдачу поиска вместе с фильтром, с которым она
+получена (поля rooms, min_floor, max_floor, min_price, max_price в
+заголовке). Если новые настройки уже этого фильтра, все нужные
+объявления уже есть в файле: их достаточно отобрать локально, без
+повторного поиска и обогащения. Повторный поиск нужен, только если
+фильтр стал шире сохраненного.
+"""
+# Значение поля, которое cianparser не смог разобрать
+UNKNOWN_VALUES = (None, -1, "")
+
+def _bound(values, pick):
+    """Граница этажа из настроек: в боте этажи выбираются списком, берем самую мягкую"""
+    if isinstance(values, (list, tuple)):
+        return pick(values) if values else None
+    return values if values not in UNKNOWN_VALUES else None
+
+class ListingFilter:
+    """Фильтр объявлений; None в любом поле - без ограничения.
+
+    Объявления с неразобранным значением поля проходят фильтр: они
+    уже прошли фильтр сайта при поиске.
+    """
+    __slots__ = ("rooms", "min_floor", "max_floor", "min_price", "max_price")
+
+    def __init__(self, rooms=None, min_floor=None, max_floor=None, min_price=None, max_price=None):
+        self.rooms = frozenset(rooms) if rooms else None
+        self.min_floor = _bound(min_floor, min)
+        self.max_floor = _bound(max_floor, max)
+        self.min_price = min_price or None
+        self.max_price = max_price or None
+
+    @classmethod
+    def from_header(cls, header):
+        """Фильтр, с которым получен файл регионов; None - в заголовке его нет (старый файл)"""
+        if "rooms" not in header:
+            return None
+        rooms = header.get("rooms")
+        return cls(None if rooms == "all" else rooms, header.get("min_floor"), header.get("max_floor"),
+                   header.get("min_price"), header.get("max_price"))
+
+    @property
+    def is_empty(self):
+        return all(getattr(self, name) is None for name in self.__slots__)
+
+    def is_within(self, other):
+        """True, если все объявления под этим фильтром проходят и фильтр other (этот фильтр не шире)"""
+        if other.rooms is not None and (self.rooms is None or not self.rooms <= other.rooms):
+            return False
+        for low, high in (("min_floor", "max_floor"), ("min_price", "max_price")):
+            other_low, other_high = getattr(other, low), getattr(other, high)
+            own_low, own_high = getattr(self, low), getattr(self, high)
+            if other_low is not None and (own_low is None or own_low < other_low):
+                return False
+            if other_high is not None and (own_high is None or own_high > other_high):
+                return False
+        return True
+
+    def matches(self, item):
+        """Проходит ли объявление (словарь из файла регионов или records.Listing)"""
+        if self.rooms is not None:
+            rooms = item.get("rooms_count")
+            if rooms not in UNKNOWN_VALUES and rooms not in self.rooms:
+                return False
+        floor = item.get("floor")
+        if floor not in UNKNOWN_VALUES:
+            if self.min_floor is not None and floor < self.min_floor:
+                return False
+            if self.max_floor is not None and floor > self.max_floor:
+                return False
+        price = item.get("price")
+        if price not in UNKNOWN_VALUES:
+            if self.min_price is not None and price < self.min_price:
+                return False
+            if self.max_price is not None and price > self.max_price:
+                return False
+        return True
+
+    def apply(self, items):
+        """Отбирает подходящие объявления из потока (генератор, файл целиком не загружается)"""
+        if self.is_empty:
+            return iter(items)
+        return (item for item in items if self.matches(item))
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__ if getattr(self, name) is not None)
+        return f"ListingFilter({fields})"
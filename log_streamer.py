@@ -0,0 +1,141 @@
+import time
+import threading
+from collections import deque
+from aiogram.exceptions import TelegramRetryAfter
+import config
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+class LogStreamer:
+    """Буферизует логи парсера и стримит их в одно сообщение Telegram с ограничением частоты правок"""
+
+    def __init__(self, bot, max_lines=config.LOG_BUFFER_LINES, min_edit_interval=config.LOG_EDIT_INTERVAL,
+                 message_limit=TELEGRAM_MESSAGE_LIMIT):
+        self.bot = bot
+        self.min_edit_interval = min_edit_interval
+        self.message_limit = message_limit
+        self._lock = threading.Lock()
+        # Кольцевой буфер: при перегрузке вытесняются самые старые строки
+        self._pending = deque(maxlen=max_lines)
+        self._dropped_unreported = 0
+        self.dropped_total = 0
+        self.message_id = None
+        self.message_text = ""
+        self._rendered_text = ""
+        self.status = None
+        self._status_dirty = False
+        self._next_edit_at = 0.0
+
+    def reset(self):
+        """Сбрасывает буфер и начинает новое сообщение с логами"""
+        with self._lock:
+            self._pending.clear()
+            self._dropped_unreported = 0
+            self.dropped_total = 0
+        self.message_id = None
+        self.message_text = ""
+        self._rendered_text = ""
+        self.status = None
+        self._status_dirty = False
+        self._next_edit_at = 0.0
+
+    def push(self, line):
+        """Добавляет строку в буфер (потокобезопасно, O(1))"""
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self._dropped_unreported += 1
+                self.dropped_total += 1
+            self._pending.append(line)
+
+    def set_status(self, status):
+        """Задает строку статуса (прогресс), которая выводится последней строкой сообщения"""
+        if status != self.status:
+            self.status = status
+            self._status_dirty = True
+
+    def has_pending(self):
+        """Есть ли строки или статус, ещё не отправленные в Telegram"""
+        with self._lock:
+            return bool(self._pending) or self._dropped_unreported > 0 or self._status_dirty
+
+    def seconds_until_ready(self):
+        """Сколько секунд осталось до следующей разрешённой правки сообщения"""
+        return max(0.0, self._next_edit_at - time.monotonic())
+
+    def _take_pending(self):
+        with self._lock:
+            lines = list(self._pending)
+            self._pending.clear()
+            dropped = self._dropped_unreported
+            self._dropped_unreported = 0
+        if dropped:
+            lines.insert(0, f"⚠️ Пропущено {dropped} строк логов из-за перегрузки")
+        return lines
+
+    def _return_pending(self, lines):
+        """Возвращает неотправленные строки в начало буфера (с учётом его размера)"""
+        with self._lock:
+            free = self._pending.maxlen - len(self._pending)
+            keep = lines[-free:] if free > 0 else []
+            lost = len(lines) - len(keep)
+            self._pending.extendleft(reversed(keep))
+            self._dropped_unreported += lost
+            self.dropped_total += lost
+
+    async def flush(self, chat_id, force=False):
+        """Отправляет накопленные строки, если позволяет лимит частоты правок"""
+        if not force and self.seconds_until_ready() > 0:
+            return False
+
+        lines = self._take_pending()
+        status_dirty = self._status_dirty
+        if not lines and not status_dirty:
+            return False
+        self._status_dirty = False
+
+        status_suffix = f"\n{self.status}" if self.status else ""
+        body_limit = self.message_limit - len(status_suffix)
+
+        chunk = "\n".join(lines)
+        if len(chunk) > body_limit:
+            chunk = chunk[-body_limit:]
+
+        if not chunk:
+            new_text = self.message_text
+        else:
+            new_text = f"{self.message_text}\n{chunk}" if self.message_text else chunk
+        message_id = self.message_id
+        if len(new_text) > body_limit:
+            # Сообщение заполнено - продолжаем логи в новом сообщении
+            message_id = None
+            new_text = chunk
+
+        rendered = (new_text + status_suffix).strip("\n")
+        # Не трогаем Telegram, если текст не изменился
+        if not rendered or (message_id is not None and rendered == self._rendered_text):
+            return False
+
+        try:
+            if message_id is None:
+                message = await self.bot.send_message(chat_id, rendered)
+                self.message_id = message.message_id
+            else:
+                await self.bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=rendered
+                )
+            self.message_text = new_text
+            self._rendered_text = rendered
+            self._next_edit_at = time.monotonic() + self.min_edit_interval
+            return True
+        except TelegramRetryAfter as e:
+            # Flood control: откладываем правку и возвращаем строки в буфер
+            self._next_edit_at = time.monotonic() + e.retry_after
+            self._return_pending(lines)
+            self._status_dirty = self._status_dirty or status_dirty
+            print(f"⏳ Telegram flood control, повтор через {e.retry_after} сек")
+        except Exception as e:
+            self._next_edit_at = time.monotonic() + self.min_edit_interval
+            print(f"Ошибка при обновлении логов: {e}")
+        return False
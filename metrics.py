@@ -0,0 +1,344 @@
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config
+
+# Границы бакетов гистограмм задержек (сек)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1, 2.5, 5, 7.5, 10, 15, 30, 60)
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for key, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+class Counter:
+    """Монотонный счетчик с метками"""
+    kind = "counter"
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name) or "") for name in self.label_names)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def total(self):
+        """Сумма по всем наборам меток"""
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = []
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+class Histogram:
+    """Гистограмма с фиксированными бакетами и метками"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name) or "") for name in self.label_names)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state["count"] if state else 0
+
+    def quantile(self, q, **labels):
+        """Оценка квантиля по бакетам (линейная интерполяция), None если данных нет"""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            if not state or not state["count"]:
+                return None
+            cumulative = list(state["buckets"])
+            total = state["count"]
+        return self._estimate(q, cumulative, total)
+
+    def quantile_matching(self, q, **labels):
+        """Квантиль по всем сериям, у которых совпадают указанные метки (остальные - любые)"""
+        cumulative = [0] * len(self.buckets)
+        total = 0
+        with self._lock:
+            for key, state in self._values.items():
+                values = dict(zip(self.label_names, key))
+                if any(values.get(name) != str(value) for name, value in labels.items()):
+                    continue
+                for i, bucket_count in enumerate(state["buckets"]):
+                    cumulative[i] += bucket_count
+                total += state["count"]
+        if not total:
+            return None
+        return self._estimate(q, cumulative, total)
+
+    def count_matching(self, **labels):
+        """Количество наблюдений по всем сериям с совпадающими метками"""
+        total = 0
+        with self._lock:
+            for key, state in self._values.items():
+                values = dict(zip(self.label_names, key))
+                if all(values.get(name) == str(value) for name, value in labels.items()):
+                    total += state["count"]
+        return total
+
+    def _estimate(self, q, cumulative, total):
+        rank = q * total
+        lower_bound, lower_count = 0.0, 0
+        for bound, bucket_count in zip(self.buckets, cumulative):
+            if bucket_count >= rank:
+                if bucket_count == lower_count:
+                    return bound
+                return lower_bound + (bound - lower_bound) * (rank - lower_count) / (bucket_count - lower_count)
+            lower_bound, lower_count = bound, bucket_count
+        return self.buckets[-1]
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]})
+                           for key, v in self._values.items())
+        lines = []
+        for key, state in items:
+            for bound, bucket_count in zip(self.buckets, state["buckets"]):
+                labels = _format_labels(self.label_names, key, ("le", bound))
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.label_names, key, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {state['count']}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {state['sum']}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+class MetricsRegistry:
+    """Реестр метрик с выводом в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Атомарно записывает метрики в файл (для node_exporter textfile collector)"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+REGISTRY = MetricsRegistry()
+
+STAGE_LABELS = ("stage", "author_type", "region")
+
+stage_duration = REGISTRY.histogram(
+    "cian_stage_duration_seconds",
+    "Длительность этапов парсинга",
+    STAGE_LABELS
+)
+stage_results = REGISTRY.counter(
+    "cian_stage_results_total",
+    "Успешные и неуспешные выполнения этапов парсинга",
+    STAGE_LABELS + ("status",)
+)
+retries = REGISTRY.counter(
+    "cian_retries_total",
+    "Повторные попытки запросов",
+    STAGE_LABELS
+)
+browser_fallbacks = REGISTRY.counter(
+    "cian_browser_fallbacks_total",
+    "Переходы на получение номера через браузер",
+    ("author_type", "region")
+)
+bytes_downloaded = REGISTRY.counter(
+    "cian_bytes_downloaded_total",
+    "Объем загруженных данных (байт)",
+    STAGE_LABELS
+)
+cache_hits = REGISTRY.counter(
+    "cian_cache_hits_total",
+    "Объявления, пропущенные благодаря уже сохраненным данным",
+    ("author_type", "region")
+)
+listings_discovered = REGISTRY.counter(
+    "cian_listings_discovered_total",
+    "Найдено объявлений на этапе поиска",
+    ("region",)
+)
+rate_limit_wait = REGISTRY.counter(
+    "cian_rate_limit_wait_seconds_total",
+    "Время ожидания общего лимита запросов к хосту (сек)",
+    ("host",)
+)
+proxy_requests = REGISTRY.counter(
+    "cian_proxy_requests_total",
+    "Запросы через прокси по результату (success, failure, ban)",
+    ("proxy", "status")
+)
+response_verdicts = REGISTRY.counter(
+    "cian_response_verdicts_total",
+    "Ответы сайта по вердикту классификатора (ok, blocked, captcha, rate_limited, removed, ...)",
+    ("verdict",)
+)
+coalesced_requests = REGISTRY.counter(
+    "cian_coalesced_requests_total",
+    "Запросы, получившие результат одновременного такого же запроса (page - загрузка, parse - разбор)",
+    ("kind",)
+)
+cpu_tasks = REGISTRY.counter(
+    "cian_cpu_tasks_total",
+    "CPU-задачи разбора по месту выполнения (process - пул процессов, inline - текущий поток)",
+    ("task", "mode")
+)
+identity_requests = REGISTRY.counter(
+    "cian_identity_requests_total",
+    "Запросы к API номеров по идентичности и результату (success, failure, rejected)",
+    ("identity", "status")
+)
+identity_harvests = REGISTRY.counter(
+    "cian_identity_harvests_total",
+    "Перехваты идентичности через браузер (success, failure)",
+    ("status",)
+)
+hedged_calls = REGISTRY.counter(
+    "cian_hedged_calls_total",
+    "Вызовы с хеджированием по итогу (not_hedged, no_token, primary_won, hedge_won)",
+    ("stage", "outcome")
+)
+breaker_transitions = REGISTRY.counter(
+    "cian_breaker_transitions_total",
+    "Переходы автомата защиты по новому состоянию (closed, open, half_open)",
+    ("breaker", "state")
+)
+deferred_items = REGISTRY.counter(
+    "cian_deferred_items_total",
+    "Объявления, отложенные при недоступном API, по итогу (api, browser, failed)",
+    ("result",)
+)
+session_refreshes = REGISTRY.counter(
+    "cian_session_refreshes_total",
+    "Обновления сессии API после массовых отказов (success, failure)",
+    ("status",)
+)
+
+class StageTimer:
+    """Контекстный менеджер: замеряет этап и считает успех/ошибку (исключение = ошибка)"""
+
+    def __init__(self, stage, author_type=None, region=None):
+        self.labels = {"stage": stage, "author_type": author_type, "region": region}
+        self.failed = False
+        self.started = None
+
+    def fail(self):
+        """Помечает этап как неуспешный без выброса исключения"""
+        self.failed = True
+
+    def add_bytes(self, amount):
+        bytes_downloaded.inc(amount, **self.labels)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        stage_duration.observe(time.perf_counter() - self.started, **self.labels)
+        status = "failure" if (exc_type is not None or self.failed) else "success"
+        stage_results.inc(status=status, **self.labels)
+        return False
+
+def track(stage, author_type=None, region=None):
+    """Создает таймер этапа с метками типа автора и региона"""
+    return StageTimer(stage, author_type=author_type, region=region)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Не засоряем вывод логами каждого запроса
+        pass
+
+def start_http_server(port, host="127.0.0.1"):
+    """Запускает HTTP-эндпоинт /metrics в фоновом потоке"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📈 Метрики доступны на http://{host}:{server.server_port}/metrics")
+    return server
+
+def export_textfile():
+    """Записывает метрики в файл, если задан METRICS_TEXTFILE"""
+    if config.METRICS_TEXTFILE:
+        try:
+            REGISTRY.write_textfile(config.METRICS_TEXTFILE)
+        except OSError as e:
+            print(f"❌ Ошибка записи метрик в {config.METRICS_TEXTFILE}: {str(e)}")
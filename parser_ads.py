@@ -1,11 +1,13 @@
 import cianparser
-import json
 from datetime import datetime
 import utils
-import requests
-import re
+import http_client
 import time
-from bs4 import BeautifulSoup
+import cpu_pool
+import metrics
+import config
+import regions_io
+from records import Listing, AuthorType
 
 def _log(log_callback, message):
     if log_callback:
@@ -13,76 +15,91 @@ def _log(log_callback, message):
     else:
         print(message)
 
-def get_block_id_and_phone(url, author_type, log_callback=None):
+def get_block_id_and_phone(url, author_type, log_callback=None, region=None):
     """Извлекает blockId и/или телефон из HTML страницы объявления в зависимости от типа автора"""
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
-        html_content = response.text
-        
-        block_id = None
-        phone = None
-        
-        # ЛОГИКА В ЗАВИСИМОСТИ ОТ ТИПА АВТОРА
-        if author_type == 'developer':
-            # ДЛЯ ЗАСТРОЙЩИКОВ: ищем ТОЛЬКО siteBlockId
-            match = re.search(r'"siteBlockId":\s*(\d+)', html_content)
-            if match:
-                block_id = match.group(1)
-                msg = f"✅ Найден siteBlockId для застройщика: {block_id} для {url}"
-                _log(log_callback, msg)
-            else:
-                msg = f"❌ siteBlockId НЕ найден для застройщика на странице {url}"
-                _log(log_callback, msg)
-        else:
-            # ДЛЯ ОСТАЛЬНЫХ: ищем ТОЛЬКО offerPhone
-            offer_match = re.search(r'"offerPhone":\s*"([^"]+)"', html_content)
-            if offer_match:
-                phone = offer_match.group(1)
-                msg = f"✅ Найден готовый номер offerPhone: {phone} для {url}"
-                _log(log_callback, msg)
-            else:
-                # Если offerPhone не найден, пытаемся извлечь его напрямую из HTML
-                soup = BeautifulSoup(html_content, 'html.parser')
-                phone_element = soup.select_one('[data-testid="PhoneLink"], .phone-number')
-                if phone_element:
-                    phone = phone_element.get_text(strip=True)
-                    # Очищаем номер от лишних символов
-                    phone = re.sub(r'[^\d+]', '', phone)
-                    msg = f"✅ Найден прямой телефон из HTML: {phone} для {url}"
+    with metrics.track("listing_enrichment", author_type, region) as enrichment:
+        try:
+            headers = {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
+            }
+            with metrics.track("html_fetch", author_type, region) as fetch:
+                response = http_client.get_page(url, region=region, headers=headers, timeout=15)
+                fetch.add_bytes(len(response.content))
+                verdict = response.verdict
+                if verdict.is_gone or verdict.is_block:
+                    # Снятое объявление или блокировка - не путаем с отсутствием данных на странице
+                    fetch.fail()
+                    enrichment.fail()
+                    emoji = "🚫" if verdict.is_gone else "🛑"
+                    _log(log_callback, f"{emoji} Страница недоступна ({verdict.reason}): {url}")
+                    return None, None
+                response.raise_for_status()
+            # Разбор общий с одновременными запросами той же страницы
+            fields = http_client.parse_once(response, utils.extract_offer_fields)
+        
+            block_id = None
+            phone = None
+        
+            # ЛОГИКА В ЗАВИСИМОСТИ ОТ ТИПА АВТОРА
+            if author_type == 'developer':
+                # ДЛЯ ЗАСТРОЙЩИКОВ: ищем ТОЛЬКО siteBlockId
+                if fields["siteBlockId"] is not None:
+                    block_id = str(fields["siteBlockId"])
+                    msg = f"✅ Найден siteBlockId для застройщика: {block_id} для {url}"
                     _log(log_callback, msg)
                 else:
-                    msg = f"❌ offerPhone НЕ найден для НЕ-застройщика на странице {url}"
+                    msg = f"❌ siteBlockId НЕ найден для застройщика на странице {url}"
+                    _log(log_callback, msg)
+            else:
+                # ДЛЯ ОСТАЛЬНЫХ: ищем ТОЛЬКО offerPhone
+                if fields["offerPhone"]:
+                    phone = fields["offerPhone"]
+                    msg = f"✅ Найден готовый номер offerPhone: {phone} для {url}"
                     _log(log_callback, msg)
+                else:
+                    # Если offerPhone не найден, пытаемся извлечь его напрямую из HTML
+                    # (разбор BeautifulSoup - в пуле процессов, не в сетевом потоке)
+                    phone = cpu_pool.run(utils.extract_phone_from_html, response.content)
+                    if phone:
+                        msg = f"✅ Найден прямой телефон из HTML: {phone} для {url}"
+                        _log(log_callback, msg)
+                    else:
+                        msg = f"❌ offerPhone НЕ найден для НЕ-застройщика на странице {url}"
+                        _log(log_callback, msg)
         
-        return block_id, phone
+            if block_id is None and phone is None:
+                enrichment.fail()
+            return block_id, phone
     
-    except Exception as e:
-        msg = f"❌ Ошибка при получении данных: {str(e)}"
-        _log(log_callback, msg)
-        return None, None
+        except Exception as e:
+            enrichment.fail()
+            msg = f"❌ Ошибка при получении данных: {str(e)}"
+            _log(log_callback, msg)
+            return None, None
+
+def parse_cian_ads(log_callback=None, region=None, on_developer_url=None):
+    """Парсит объявления с CIAN и сохраняет в regions_{ID}.json.
 
-def parse_cian_ads(log_callback=None):
-    """Парсит объявления с CIAN и сохраняет в regions.json"""
+    region - пара (название, ID); по умолчанию основной регион из настроек.
+    on_developer_url(url) - вызывается для объявлений застройщиков сразу
+    после поиска, до обогащения (для фоновой активации API номеров).
+    """
     log_message = f"[{datetime.now()}] Начало парсинга объявлений..."
     _log(log_callback, log_message)
     utils.ensure_output_dir()
     
+    # Получаем регион из настроек
+    region_name, region_id = region or (utils.get_region_name(), utils.get_region_id())
+    
     try:
         # Проверяем возраст файла региона
-        if utils.should_refresh_region_file():
+        if utils.should_refresh_region_file(region_id):
             _log(log_callback, "⚠️ Данные региона устарели (>1 дня). Удаляем и обновляем...")
-            utils.remove_region_file()
+            utils.remove_region_file(region_id)
         
         # Создаем lock-файл
-        utils.start_parsing()
+        utils.start_parsing(region_id)
         
-        # Получаем регион из настроек
-        region_name = utils.get_region_name()
-        region_id = utils.get_region_id()
         rooms = utils.get_rooms()
         min_floor = utils.get_min_floor()
         max_floor = utils.get_max_floor()
@@ -103,6 +120,16 @@ def parse_cian_ads(log_callback=None):
         if max_price:
             _log(log_callback, f"💰 Макс. цена: {max_price:,} ₽".replace(",", " "))
         
+        # Обогащаются только объявления под текущими настройками (при обычном поиске - все)
+        enrich_filter = None
+        if config.DISCOVERY_SUPERSET:
+            # Поиск без фильтров: настройки применяются локально (listing_filter),
+            # и их смена не требует повторного поиска
+            enrich_filter = utils.get_listing_filter()
+            _log(log_callback, "🗂️ Поиск всех объявлений региона, комнаты, этажи и цена отбираются локально")
+            rooms = "all"
+            min_floor = max_floor = min_price = max_price = None
+        
         # Формируем дополнительные настройки
         additional_settings = {
             "start_page": 1,
@@ -119,40 +146,60 @@ def parse_cian_ads(log_callback=None):
             additional_settings["max_price"] = max_price
         
         # Парсим данные
-        parser = cianparser.CianParser(location=region_name)
-        print(rooms , 'rooms')
-        data = parser.get_flats(deal_type="sale", rooms=tuple(rooms), additional_settings=additional_settings)
+        with metrics.track("discovery", region=region_id):
+            parser = cianparser.CianParser(location=region_name)
+            print(rooms , 'rooms')
+            data = parser.get_flats(deal_type="sale", rooms=rooms if rooms == "all" else tuple(rooms),
+                                    additional_settings=additional_settings)
+        metrics.listings_discovered.inc(len(data), region=region_id)
         
-        # Проверяем и корректируем URL
-        for item in data:
-            if 'url' in item and not item['url'].startswith('http'):
-                item['url'] = f"https://www.cian.ru{item['url']}"
+        # Компактные записи вместо словарей: исходные dict сразу освобождаются
+        data = [Listing.from_dict(item) for item in data]
+        
+        # Канонизируем URL и удаляем дубли до обогащения объявлений
+        total_found = len(data)
+        data = utils.dedupe_listings(data)
+        if len(data) < total_found:
+            _log(log_callback, f"♻️ Удалено дублей объявлений: {total_found - len(data)}")
         
-        # Получаем blockId и телефон для ВСЕХ объявлений В ЗАВИСИМОСТИ ОТ ТИПА АВТОРА
+        if on_developer_url:
+            # Фоновый перехват идентичностей ждет объявление застройщика из этого поиска
+            for item in data:
+                if item.url and item.author_type == AuthorType.DEVELOPER:
+                    on_developer_url(item.url)
+        
+        # Получаем blockId и телефон для объявлений В ЗАВИСИМОСТИ ОТ ТИПА АВТОРА.
+        # При поиске без фильтров - только под текущими настройками: остальные
+        # объявления нужны лишь для смены настроек без повторного поиска, а их
+        # страницы загрузит этап телефонов, если они попадут под фильтр
+        skipped = 0
         for item in data:
-            url = item.get('url')
-            author_type = item.get('author_type')
-            
-            if url and author_type:
-                block_id, phone = get_block_id_and_phone(url, author_type, log_callback)
+            if enrich_filter is not None and not enrich_filter.matches(item):
+                skipped += 1
+                item.block_id = None
+                item.direct_phone = None
+            elif item.url and item.author_type != AuthorType.UNKNOWN:
+                block_id, phone = get_block_id_and_phone(item.url, item.author_type.label, log_callback, region=region_id)
                 
-                if author_type == 'developer':
+                if item.author_type == AuthorType.DEVELOPER:
                     # Для застройщиков сохраняем blockId, phone остается None
-                    item['blockId'] = block_id
-                    item['directPhone'] = None
+                    item.block_id = block_id
+                    item.direct_phone = None
                 else:
                     # Для остальных сохраняем phone, blockId остается None
-                    item['blockId'] = None
-                    item['directPhone'] = phone
+                    item.block_id = None
+                    item.direct_phone = phone
                 
                 # Задержка, чтобы не нагружать сервер
-                time.sleep(1.5)
+                time.sleep(config.ENRICH_DELAY)
             else:
-                item['blockId'] = None
-                item['directPhone'] = None
+                item.block_id = None
+                item.direct_phone = None
+        if skipped:
+            _log(log_callback, f"⏭️ Без обогащения (вне текущих настроек): {skipped} объявлений")
         
-        # Формируем данные для сохранения с метаданными
-        result_data = {
+        # Формируем метаданные для сохранения
+        header = {
             "created_at": datetime.utcnow().isoformat() + "Z",
             "region": {
                 "name": region_name,
@@ -163,13 +210,12 @@ def parse_cian_ads(log_callback=None):
             "max_floor": max_floor,
             "min_price": min_price,
             "max_price": max_price,
-            "data": data
+            "count": len(data)
         }
         
-        # Сохраняем ВСЕ данные
-        region_file = utils.get_region_file()
-        with open(region_file, 'w', encoding='utf-8') as f:
-            json.dump(result_data, f, ensure_ascii=False, indent=2)
+        # Сохраняем ВСЕ данные (объявления пишутся по одному)
+        region_file = utils.get_region_file(region_id)
+        regions_io.write_regions_file(region_file, header, data)
         
         # Считаем статистику по типам авторов
         author_stats = {}
@@ -177,17 +223,17 @@ def parse_cian_ads(log_callback=None):
         block_ids_found = 0
         
         for item in data:
-            author_type = item.get('author_type', 'unknown')
+            author_type = item.author_type.label
             if author_type not in author_stats:
                 author_stats[author_type] = {'total': 0, 'with_phone': 0, 'with_blockid': 0}
             
             author_stats[author_type]['total'] += 1
             
-            if item.get('directPhone'):
+            if item.direct_phone:
                 author_stats[author_type]['with_phone'] += 1
                 phones_found += 1
             
-            if item.get('blockId'):
+            if item.block_id:
                 author_stats[author_type]['with_blockid'] += 1
                 block_ids_found += 1
         
@@ -213,4 +259,4 @@ def parse_cian_ads(log_callback=None):
         return False, 0
     finally:
         # Всегда удаляем lock-файл
-        utils.finish_parsing()
\ No newline at end of file
+        utils.finish_parsing(region_id)
\ No newline at end of file
@@ -0,0 +1,140 @@
+"""Нормализованные номера (E.164) и обратный индекс номер -> объявления.
+
+Застройщики используют одни и те же номера коллтрекинга в сотнях
+объявлений. Индекс собирается по ходу запуска: для каждого номера -
+объявления, siteBlockId и время первой/последней встречи. По нему
+строится выгрузка без повторов и находится уже известный номер ЖК
+(siteBlockId) без повторного запроса к API.
+"""
+import re
+from datetime import datetime
+from functools import lru_cache
+
+NON_DIGITS = re.compile(r'\D')
+
+@lru_cache(maxsize=65536)
+def normalize(phone):
+    """Номер в формате E.164 (+79123456789) или None, если это не номер.
+
+    Российские номера: 8XXXXXXXXXX, 7XXXXXXXXXX и 10 цифр без кода
+    страны приводятся к +7. Остальные - "+" и цифры (11-15 цифр).
+    """
+    if not phone:
+        return None
+    digits = NON_DIGITS.sub('', phone)
+    if len(digits) == 11 and digits[0] in "78":
+        return "+7" + digits[1:]
+    if len(digits) == 10 and digits[0] == "9":
+        return "+7" + digits
+    if 11 <= len(digits) <= 15 and phone.lstrip().startswith("+"):
+        return "+" + digits
+    return None
+
+def display(e164):
+    """Читаемый вид: +7 (XXX) XXX-XX-XX для российских номеров, иначе E.164 как есть"""
+    if e164.startswith("+7") and len(e164) == 12:
+        return f"+7 ({e164[2:5]}) {e164[5:8]}-{e164[8:10]}-{e164[10:12]}"
+    return e164
+
+class PhoneEntry:
+    """Один номер и все объявления, в которых он встретился"""
+    __slots__ = ("e164", "announcements", "site_block_ids", "first_seen", "last_seen")
+
+    def __init__(self, e164, seen):
+        self.e164 = e164
+        self.announcements = {}  # ID -> None: упорядоченное множество
+        self.site_block_ids = set()
+        self.first_seen = seen
+        self.last_seen = seen
+
+    @property
+    def display(self):
+        return display(self.e164)
+
+    def to_dict(self):
+        return {
+            "phone": self.display,
+            "e164": self.e164,
+            "announcements": list(self.announcements),
+            "siteBlockIds": sorted(self.site_block_ids),
+            "firstSeen": self.first_seen.isoformat(timespec="seconds"),
+            "lastSeen": self.last_seen.isoformat(timespec="seconds"),
+        }
+
+    def __repr__(self):
+        return f"PhoneEntry({self.e164!r}, объявлений={len(self.announcements)})"
+
+class PhoneIndex:
+    """Обратный индекс номер -> объявления, пополняется по мере получения результатов"""
+
+    def __init__(self):
+        self._entries = {}          # E.164 -> PhoneEntry
+        self._by_announcement = {}  # ID -> E.164
+        self._by_site_block = {}    # siteBlockId -> E.164 (последний полученный номер ЖК)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, phone):
+        return normalize(phone) in self._entries
+
+    def add(self, announcement_id, phone, site_block_id=None, seen=None, reusable=True):
+        """Учитывает номер объявления; возвращает PhoneEntry или None, если номер не распознан.
+
+        Повторный вызов для того же объявления с другим номером переносит
+        объявление в запись нового номера. reusable=False - номер не отдается
+        по siteBlockId (for_site_block): например, результат прошлого запуска,
+        номер коллтрекинга в котором мог уже смениться.
+        """
+        e164 = normalize(phone)
+        if e164 is None:
+            return None
+        seen = seen or datetime.now()
+        previous = self._by_announcement.get(announcement_id)
+        if previous is not None and previous != e164:
+            self._discard(announcement_id, previous)
+
+        entry = self._entries.get(e164)
+        if entry is None:
+            entry = self._entries[e164] = PhoneEntry(e164, seen)
+        entry.announcements[announcement_id] = None
+        entry.last_seen = max(entry.last_seen, seen)
+        entry.first_seen = min(entry.first_seen, seen)
+        self._by_announcement[announcement_id] = e164
+        if site_block_id is not None:
+            entry.site_block_ids.add(site_block_id)
+            if reusable:
+                self._by_site_block[site_block_id] = e164
+        return entry
+
+    def _discard(self, announcement_id, e164):
+        entry = self._entries.get(e164)
+        if entry is None:
+            return
+        entry.announcements.pop(announcement_id, None)
+        if not entry.announcements:
+            del self._entries[e164]
+            for site_block_id in entry.site_block_ids:
+                if self._by_site_block.get(site_block_id) == e164:
+                    del self._by_site_block[site_block_id]
+
+    def get(self, phone):
+        """Запись по номеру в любом формате (None, если номер не встречался)"""
+        return self._entries.get(normalize(phone))
+
+    def for_announcement(self, announcement_id):
+        e164 = self._by_announcement.get(announcement_id)
+        return self._entries.get(e164) if e164 else None
+
+    def for_site_block(self, site_block_id):
+        """Номер ЖК (siteBlockId), добавленный с reusable=True, или None"""
+        e164 = self._by_site_block.get(site_block_id)
+        return self._entries.get(e164) if e164 else None
+
+    def entries(self):
+        """Записи по убыванию числа объявлений (самые "общие" номера первыми)"""
+        return sorted(self._entries.values(), key=lambda entry: (-len(entry.announcements), entry.e164))
+
+    def duplicates(self):
+        """Сколько объявлений приходится на уже встречавшиеся номера"""
+        return len(self._by_announcement) - len(self._entries)
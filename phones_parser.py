@@ -1,24 +1,146 @@
 import json
 import time
 import os
-import requests
+import threading
+import http_client
 import re
 from datetime import datetime
 from requests.exceptions import RequestException
 import utils
 import config
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+import metrics
+import exporters
+import serialization
+import browser
+import circuit_breaker
+import response_classifier
+from hedging import Hedger
+from collections import deque
+from records import PhoneResult, Source
+from phone_index import PhoneIndex
+from identity_pool import IdentityPool
+from session_manager import SessionManager
+
+# Результат fetch_phone_with_retry, когда автомат защиты API разомкнут и объявление отложено
+API_DEFERRED = object()
+# Объявление для активации, если в файле регионов еще нет застройщиков
+DEFAULT_ACTIVATION_URL = "https://tyumen.cian.ru/sale/flat/307997699/"
+
+class ActivationUrls:
+    """URL застройщиков для перехвата идентичностей из поиска объявлений этого запуска.
+
+    Фоновый перехват начинается раньше, чем поиск запишет файл регионов:
+    поиск передает объявления застройщиков через offer(), а перехват ждет
+    первое из них. После close() (поиск закончен или не нужен) перехват
+    берет URL из файла регионов и только потом - DEFAULT_ACTIVATION_URL.
+    """
+
+    def __init__(self):
+        self.urls = []
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def offer(self, url):
+        with self._condition:
+            self.urls.append(url)
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def wait(self, timeout):
+        """URL из поиска, как только есть хотя бы один; пустой список - поиск закончен без них или timeout"""
+        with self._condition:
+            self._condition.wait_for(lambda: self.urls or self._closed, timeout)
+            return list(self.urls)
+
+def start_session(region_id=None, log=print, background=False, activation=None):
+    """Создает пул идентичностей и сессию API номеров (только для застройщиков).
+
+    background=True - перехват через браузер идет в фоне, функция
+    возвращается сразу: так активацию можно запустить в начале запуска,
+    параллельно с поиском объявлений, а первый запрос к API подождет ее,
+    только если она еще не закончилась. activation (ActivationUrls) -
+    объявления застройщиков из идущего поиска: перехват ждет первое из них.
+    Сессию принимает CianPhoneParser(session=...).
+    """
+    if activation is None:
+        # Поиск не идет - сразу берем URL из файла регионов
+        activation = ActivationUrls()
+        activation.close()
+    file_urls = []
+    announced = []
+    
+    def harvest(index):
+        # URL застройщиков берем в момент перехвата: при активации в фоне
+        # поиск объявлений может закончиться позже первого перехвата
+        urls = activation.wait(config.ACTIVATION_URL_WAIT)
+        if not urls:
+            if not file_urls:
+                file_urls.extend(utils.extract_urls_from_regions(author_type='developer', region_id=region_id))
+            urls = file_urls
+        if not urls:
+            if index == 0:
+                log(f"❌ Нет URL застройщиков, используем дефолтный URL: {DEFAULT_ACTIVATION_URL}")
+            return browser.harvest_identity(DEFAULT_ACTIVATION_URL, log)
+        if not announced:
+            announced.append(urls[0])
+            log(f"✅ Используем URL застройщиков для активации, первый: {urls[0]}")
+        # Каждая идентичность перехватывается на своем объявлении
+        return browser.harvest_identity(urls[index % len(urls)], log)
+    
+    if config.BROWSER_ENABLED:
+        log(f"🌐 Запуск браузера для активации парсера (идентичностей: {config.IDENTITY_POOL_SIZE})...")
+    else:
+        log("⚠️ Браузер отключен (CIAN_BROWSER_ENABLED=0), используем значения по умолчанию")
+    
+    pool = IdentityPool(
+        config.IDENTITY_POOL_SIZE,
+        harvest if config.BROWSER_ENABLED else None,
+        rate=config.IDENTITY_RATE,
+        burst=config.IDENTITY_BURST,
+        max_uses=config.IDENTITY_MAX_USES,
+        log=log
+    ).start(background=background)
+    return SessionManager(
+        pool,
+        reject_threshold=config.SESSION_REJECT_THRESHOLD,
+        max_refreshes=config.SESSION_MAX_REFRESHES,
+        log=log
+    )
 
 class CianPhoneParser:
-    def __init__(self, max_phones=None, log_callback=None, clear_existing=False, author_type=config.DEFAULT_TYPE, is_scheduled=False):
+    def __init__(self, max_phones=None, log_callback=None, clear_existing=False, author_type=config.DEFAULT_TYPE, is_scheduled=False, progress_callback=None,
+                 export_format=config.EXPORT_FORMAT, export_gzip=config.EXPORT_GZIP, region=None, session=None):
         utils.ensure_output_dir()
         self.parsed_data = {}
+        self._filtered_out = {}  # Сохраненные номера объявлений вне текущего фильтра: в файле номеров, но не в выгрузке
+        self.phone_index = PhoneIndex()  # Номер (E.164) -> объявления, siteBlockId, время встречи
+        self._unsaved = []  # ID результатов, еще не дописанных в файл номеров
+        self._phones_file_synced = False  # Файл номеров в JSONL и совпадает с parsed_data
         self.max_phones = max_phones
         self.log_callback = log_callback
-        self.current_headers = config.HEADERS.copy()
-        self.current_payload_template = config.PAYLOAD_TEMPLATE.copy()
+        self.progress_callback = progress_callback
+        self.export_format = export_format
+        self.export_gzip = export_gzip
+        self.exporter = None
+        self.identity_pool = None  # Пул идентичностей для API (только для застройщиков)
+        self.session = None  # Общая сессия API поверх пула: обновляется при массовых отказах
+        self.breaker = circuit_breaker.get_breaker("api_phones")  # Общий для всех регионов
+        self._deferred = deque()  # (ID, URL, siteBlockId), отложенные до восстановления API
+        # Дубль запроса к API, если ответа нет дольше p95 (опционально, CIAN_HEDGE=1)
+        self.hedger = Hedger(
+            "api_call",
+            quantile=config.HEDGE_QUANTILE,
+            min_samples=config.HEDGE_MIN_SAMPLES,
+            budget=config.HEDGE_BUDGET
+        ) if config.HEDGE_ENABLED else None
         self.author_type = author_type
         self.is_scheduled = is_scheduled
+        # Регион (название, ID): по умолчанию основной регион из настроек
+        self.region_name, self.region_id = region or (utils.get_region_name(), utils.get_region_id())
         
         # Очистка старых файлов при необходимости
         if clear_existing:
@@ -54,98 +176,29 @@ class CianPhoneParser:
         # Выполняем активацию через браузер ТОЛЬКО для застройщиков
         if self.author_type == 'developer':
             self._log("🔧 Тип 'developer' - используем браузер + API")
-            self._activate_browser()
+            self._activate_browser(session)
         else:
             self._log("🔧 Тип НЕ 'developer' - используем только HTML парсинг")
 
-    def _activate_browser(self):
-        """Активирует парсер через браузер ТОЛЬКО для застройщиков"""
-        self._log("🌐 Запуск браузера для активации парсера...")
-        
-        # Получаем список URL застройщиков для активации
-        urls = utils.extract_urls_from_regions(author_type='developer')
-        if not urls:
-            url = "https://tyumen.cian.ru/sale/flat/307997699/"  # дефолтный URL
-            self._log(f"❌ Нет URL застройщиков, используем дефолтный URL: {url}")
-        else:
-            url = urls[0]
-            self._log(f"✅ Используем первый URL застройщика для активации: {url}")
-        
-        intercepted_headers = None
-        intercepted_payload = None
-        
-        try:
-            with sync_playwright() as p:
-                browser = p.chromium.launch(headless=True)
-                context = browser.new_context()
-                page = context.new_page()
-                
-                # Перехватываем запросы к API
-                def handle_request(route, request):
-                    nonlocal intercepted_headers, intercepted_payload
-                    if request.url == config.API_URL and request.method == "POST":
-                        intercepted_headers = dict(request.headers)
-                        intercepted_payload = request.post_data_json
-                        self._log(f"📡 Перехвачен запрос на API: {request.url}")
-                    route.continue_()
-                
-                page.route("**/*", handle_request)
-                
-                # Переходим на страницу объявления
-                page.goto(url, wait_until="domcontentloaded", timeout=60000)
-                
-                # Кликаем кнопку контактов
-                try:
-                    page.wait_for_selector('[data-testid="contacts-button"]', state="visible", timeout=15000)
-                    page.click('[data-testid="contacts-button"]')
-                    self._log("✅ Кнопка контактов нажата")
-                except Exception as e:
-                    self._log(f"❌ Ошибка при клике на кнопку: {str(e)}")
-                
-                # Ждем появления номера
-                try:
-                    page.wait_for_selector('[data-testid="PhoneLink"], .phone-number', state="attached", timeout=10000)
-                    self._log("📞 Номер телефона появился на странице")
-                except:
-                    self._log("⏰ Таймаут ожидания номера телефона")
-                
-                # Дополнительное время для перехвата
-                page.wait_for_timeout(5000)
-                browser.close()
-        
-        except Exception as e:
-            self._log(f"❌ Ошибка при активации через браузер: {str(e)}")
-        
-        # Обновляем данные на основе перехваченных значений
-        if intercepted_headers and intercepted_payload:
-            self._log("🔄 Обновляем заголовки и payload на основе перехваченных данных")
-            
-            # Обновляем заголовки
-            self.current_headers.update({
-                "Cookie": intercepted_headers.get("cookie", self.current_headers.get("Cookie", "")),
-                "Referer": intercepted_headers.get("referer", self.current_headers.get("Referer", "")),
-                "Origin": intercepted_headers.get("origin", self.current_headers.get("Origin", ""))
-            })
-            
-            # Обновляем payload
-            self.current_payload_template.update({
-                "blockId": intercepted_payload.get("blockId", self.current_payload_template.get("blockId", 0)),
-                "platformType": intercepted_payload.get("platformType", self.current_payload_template.get("platformType", "")),
-                "pageType": intercepted_payload.get("pageType", self.current_payload_template.get("pageType", "")),
-                "placeType": intercepted_payload.get("placeType", self.current_payload_template.get("placeType", "")),
-                "refererUrl": intercepted_payload.get("refererUrl", self.current_payload_template.get("refererUrl", "")),
-                "utm": intercepted_payload.get("utm", self.current_payload_template.get("utm", ""))
-            })
-            
+    def _activate_browser(self, session=None):
+        """Подключает сессию API: заранее запущенную или создает новую (ТОЛЬКО для застройщиков)"""
+        if session is not None:
+            self._log("🔑 Сессия API активируется с начала запуска, первый запрос дождется ее при необходимости")
+            self.session = session
+            self.identity_pool = session.pool
+            return
+        self.session = start_session(self.region_id, self._log)
+        self.identity_pool = self.session.pool
+        if self.identity_pool.identities[0].harvested:
             self._log("✅ Данные успешно обновлены")
-        else:
-            self._log("⚠️ Не удалось перехватить данные, используем значения по умолчанию")
+            if len(self.identity_pool) > 1:
+                self._log(f"🔑 Еще {len(self.identity_pool) - 1} идентичностей перехватываются в фоне")
 
     def _clear_existing_files(self):
         """Удаляет существующие файлы данных, чтобы начать парсинг заново"""
         files_to_remove = [
-            utils.get_phones_file(),  # data.json
-            "output/phones.txt"       # файл экспорта
+            utils.get_phones_file(self.region_id),  # data_{ID}.json
+            os.path.join(config.OUTPUT_DIR, "phones.txt")  # файл экспорта
         ]
         
         for file_path in files_to_remove:
@@ -162,28 +215,82 @@ class CianPhoneParser:
         else:
             print(message)
     
+    def _report_progress(self, current, total, success_count):
+        """Передает прогресс обработки во внешний callback (если задан)"""
+        if self.progress_callback:
+            self.progress_callback(current, total, success_count)
+    
     def extract_domain(self, url):
         """Извлекает региональный поддомен из URL"""
         match = re.search(r'https?://([a-z]+)\.cian\.ru', url)
         return match.group(1) if match else "www"
     
     def load_existing_data(self):
-        phones_file = utils.get_phones_file()
+        phones_file = utils.get_phones_file(self.region_id)
         try:
             if os.path.exists(phones_file):
-                with open(phones_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.parsed_data = data.get("data", {})
+                if serialization.is_jsonl(phones_file):
+                    # Журнал результатов: последняя запись по ID побеждает
+                    for row in serialization.iter_jsonl(phones_file, skip_broken=True):
+                        self.parsed_data[row.pop("id")] = PhoneResult.from_dict(row)
+                    # Оборванную последнюю строку не дописываем - файл будет переписан целиком
+                    self._phones_file_synced = serialization.ends_with_newline(phones_file)
+                else:
+                    # Старый формат: JSON с отступами, при первом сохранении будет переписан
+                    with open(phones_file, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                        self.parsed_data = {aid: PhoneResult.from_dict(entry) for aid, entry in data.get("data", {}).items()}
+                for aid, entry in self.parsed_data.items():
+                    # Номера прошлых запусков не переиспользуются по siteBlockId: коллтрекинг мог смениться
+                    self._index_result(aid, entry, reusable=False)
                 self._log(f"📂 Загружено {len(self.parsed_data)} существующих номеров")
             else:
                 self._log("📂 Файл с номерами не найден, начинаем с чистого листа")
-        except (FileNotFoundError, json.JSONDecodeError):
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
             self._log("❌ Файл с номерами не найден или поврежден, начинаем с чистого листа")
             self.parsed_data = {}
     
+    def _track(self, stage):
+        """Таймер этапа с метками типа автора и региона"""
+        return metrics.track(stage, author_type=self.author_type, region=self.region_id)
+    
+    def _phone_rows(self, aids):
+        for aid in aids:
+            entry = self.parsed_data[aid] if aid in self.parsed_data else self._filtered_out[aid]
+            yield dict(entry.to_dict(), id=aid)
+    
+    def _scope_to_work_items(self, work_items):
+        """Оставляет в parsed_data (и выгрузке) только объявления под текущим фильтром.
+
+        Номера остальных объявлений (фильтр сужен после их получения)
+        остаются в файле номеров и снова пригодятся, если фильтр расширят
+        в пределах сохраненного поиска.
+        """
+        wanted = {aid for aid, _ in work_items}
+        outside = [aid for aid in self.parsed_data if aid not in wanted]
+        if not outside:
+            return
+        for aid in outside:
+            self._filtered_out[aid] = self.parsed_data.pop(aid)
+        self.phone_index = PhoneIndex()
+        for aid, entry in self.parsed_data.items():
+            self._index_result(aid, entry, reusable=False)
+        self._log(f"🔎 Вне текущего фильтра: {len(outside)} сохраненных номеров, в выгрузку не попадут")
+    
     def save_data(self):
-        with open(utils.get_phones_file(), 'w', encoding='utf-8') as f:
-            json.dump({"data": self.parsed_data}, f, ensure_ascii=False, indent=2)
+        phones_file = utils.get_phones_file(self.region_id)
+        with self._track("save_data"):
+            if config.INTERNAL_FORMAT != "jsonl":
+                with open(phones_file, 'w', encoding='utf-8') as f:
+                    results = {**self._filtered_out, **self.parsed_data}
+                    json.dump({"data": {aid: entry.to_dict() for aid, entry in results.items()}}, f, ensure_ascii=False, indent=2)
+            elif self._phones_file_synced and os.path.exists(phones_file):
+                # Дописываем только новые результаты
+                serialization.append_jsonl(phones_file, self._phone_rows(self._unsaved))
+            else:
+                serialization.write_jsonl(phones_file, {"kind": "phones"}, self._phone_rows([*self._filtered_out, *self.parsed_data]))
+                self._phones_file_synced = True
+            self._unsaved = []
         self._log(f"💾 [{datetime.now()}] Сохранено {len(self.parsed_data)} номеров")
 
     def parse_html_for_data(self, url):
@@ -192,15 +299,26 @@ class CianPhoneParser:
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
             }
-            response = requests.get(url, headers=headers, timeout=15)
-            response.raise_for_status()
-            html_content = response.text
+            with self._track("html_fetch") as fetch:
+                response = http_client.get_page(url, region=self.region_id, headers=headers, timeout=15)
+                fetch.add_bytes(len(response.content))
+                verdict = response.verdict
+                if verdict.is_gone:
+                    self._log(f"🚫 Объявление снято ({verdict.reason}): {url}")
+                    return {"type": "removed"}
+                if verdict.is_block:
+                    # Не считаем объявление неудачным: его обработает следующий запуск
+                    fetch.fail()
+                    self._log(f"🛑 Страница не получена ({verdict.reason}), объявление отложено до следующего запуска: {url}")
+                    return {"type": "blocked"}
+                response.raise_for_status()
+            # Разбор общий с одновременными запросами той же страницы
+            fields = http_client.parse_once(response, utils.extract_offer_fields)
             
             if self.author_type == 'developer':
                 # Для застройщиков ищем siteBlockId
-                site_block_match = re.search(r'"siteBlockId":\s*(\d+)', html_content)
-                if site_block_match:
-                    site_block_id = int(site_block_match.group(1))
+                site_block_id = fields["siteBlockId"]
+                if site_block_id is not None:
                     self._log(f"🏗️ Найден siteBlockId в HTML: {site_block_id}")
                     return {
                         "siteBlockId": site_block_id,
@@ -211,9 +329,8 @@ class CianPhoneParser:
                 return None
             else:
                 # Для остальных типов ищем offerPhone
-                offer_match = re.search(r'"offerPhone":\s*"([^"]+)"', html_content)
-                if offer_match:
-                    phone = offer_match.group(1)
+                phone = fields["offerPhone"]
+                if phone:
                     formatted_phone = utils.format_phone(phone)
                     self._log(f"📞 Найден offerPhone в HTML: {formatted_phone}")
                     return {
@@ -229,14 +346,13 @@ class CianPhoneParser:
             self._log(f"❌ Ошибка при парсинге HTML: {str(e)}")
             return None
     
-    def fetch_phone_with_retry(self, announcement_id, url, site_block_id=None):
-        """Получает телефонный номер через API с повторными попытками (ТОЛЬКО для застройщиков)"""
-        domain = self.extract_domain(url)
-        location_url = f"https://tyumen.cian.ru/sale/flat/{announcement_id}/"
-        
-        headers = utils.sanitize_payload(self.current_headers)
-        payload = self.current_payload_template.copy()
-        payload = utils.sanitize_payload(payload)
+    def _build_api_request(self, identity, domain, location_url, announcement_id, site_block_id=None):
+        """Заголовки и payload запроса к API на основе данных идентичности"""
+        headers = utils.sanitize_payload(identity.headers)
+        # Origin/Referer - поддомен самого объявления, а не региона по умолчанию
+        headers["Origin"] = f"https://{domain}.cian.ru"
+        headers["Referer"] = f"https://{domain}.cian.ru/"
+        payload = utils.sanitize_payload(identity.payload)
         
         # Используем siteBlockId как blockId для API запроса
         if site_block_id is not None:
@@ -247,92 +363,198 @@ class CianPhoneParser:
             "announcementId": int(announcement_id),
             "locationUrl": location_url,
         })
+        return headers, payload
+    
+    def fetch_phone_with_retry(self, announcement_id, url, site_block_id=None):
+        """Получает телефонный номер через API с повторными попытками (ТОЛЬКО для застройщиков)"""
+        domain = self.extract_domain(url)
+        location_url = f"https://{domain}.cian.ru/sale/flat/{announcement_id}/"
         
         attempts = 0
         max_attempts = 6
         
         while attempts < max_attempts:
-            try:
-                response = requests.post(
+            if not self.breaker.allow():
+                # API недоступен - не ждем таймаутов, объявление обработаем позже
+                self._log(f"🔌 API недоступен, ID {announcement_id} отложен до восстановления")
+                return API_DEFERRED
+            if attempts > 0:
+                metrics.retries.inc(stage="api_call", author_type=self.author_type, region=self.region_id)
+            # Каждая попытка - через следующую готовую идентичность пула
+            identity = self.session.acquire()
+            refreshed = False
+            headers, payload = self._build_api_request(identity, domain, location_url, announcement_id, site_block_id)
+            response = None
+            def send(superseded=None):
+                return http_client.post(
                     config.API_URL,
+                    region=self.region_id,
+                    classify=response_classifier.classify_api,
+                    superseded=superseded,
                     headers=headers,
                     json=payload,
                     timeout=15
                 )
-                response.raise_for_status()
-                data = response.json()
-                
-                if "phone" in data and data["phone"]:
-                    # Форматируем телефон перед возвратом
-                    data["phone"] = utils.format_phone(data["phone"])
-                    return data
-                else:
-                    self._log(f"⚠️ Попытка {attempts+1}/{max_attempts}: Пустой ответ для ID {announcement_id}")
+            def reserve_hedge():
+                # Дубль - такой же запрос от этой идентичности: берем токен из ее лимита
+                return identity.bucket is None or not identity.bucket.try_acquire()
             
-            except RequestException as e:
-                self._log(f"❌ Попытка {attempts+1}/{max_attempts}: Ошибка запроса для ID {announcement_id}: {str(e)}")
-            except json.JSONDecodeError:
-                self._log(f"❌ Попытка {attempts+1}/{max_attempts}: Невалидный JSON для ID {announcement_id}")
+            with self._track("api_call") as api_call:
+                try:
+                    response = self.hedger.call(send, reserve_hedge) if self.hedger else send()
+                    api_call.add_bytes(len(response.content))
+                    if response.status_code < 500:
+                        # API отвечает - для автомата защиты это успех, даже если номера нет
+                        self.breaker.record_success()
+                    if response.status_code in (401, 403):
+                        # Сервер не принимает данные этой идентичности - она уйдет на повторный перехват
+                        api_call.fail()
+                        refreshed = self.session.report_failure(identity, announcement_id, rejected=True)
+                        self._log(f"🔒 Попытка {attempts+1}/{max_attempts}: API отклонил идентичность {identity.label} "
+                                  f"(HTTP {response.status_code}) для ID {announcement_id}")
+                    else:
+                        response.raise_for_status()
+                        data = response.json()
+                        
+                        if "phone" in data and data["phone"]:
+                            self.session.report_success(identity)
+                            # Форматируем телефон перед возвратом
+                            data["phone"] = utils.format_phone(data["phone"])
+                            return data
+                        else:
+                            api_call.fail()
+                            refreshed = self.session.report_failure(identity, announcement_id, empty=True)
+                            self._log(f"⚠️ Попытка {attempts+1}/{max_attempts}: Пустой ответ для ID {announcement_id}")
+                
+                except RequestException as e:
+                    api_call.fail()
+                    if response is None or response.status_code >= 500:
+                        self.breaker.record_failure()
+                    self.session.report_failure(identity)
+                    self._log(f"❌ Попытка {attempts+1}/{max_attempts}: Ошибка запроса для ID {announcement_id}: {str(e)}")
+                except json.JSONDecodeError:
+                    api_call.fail()
+                    self.breaker.record_failure()
+                    self.session.report_failure(identity)
+                    self._log(f"❌ Попытка {attempts+1}/{max_attempts}: Невалидный JSON для ID {announcement_id}")
             
+            if refreshed:
+                # Сессия обновлена - попытка со старыми данными не в счет
+                continue
             attempts += 1
             if attempts < max_attempts:
-                time.sleep(2)
+                time.sleep(config.API_RETRY_DELAY)
         
         # Если все попытки не удались, пробуем получить номер через браузер
+        if not config.BROWSER_ENABLED:
+            self._log(f"❌ Все {max_attempts} попыток API не удались для ID {announcement_id}, браузер отключен")
+            return None
         self._log(f"🌐 Все {max_attempts} попыток API не удались. Пробуем Playwright для ID {announcement_id}")
-        try:
-            with sync_playwright() as p:
-                browser = p.chromium.launch(headless=True)
-                context = browser.new_context()
-                page = context.new_page()
-                
-                # Переходим на страницу объявления
-                page.goto(url, wait_until="domcontentloaded", timeout=60000)
-                
-                # Кликаем кнопку контактов
-                try:
-                    page.wait_for_selector('[data-testid="contacts-button"]', state="visible", timeout=10000)
-                    page.click('[data-testid="contacts-button"]')
-                except:
-                    try:
-                        page.evaluate('''() => {
-                            const btn = document.querySelector('[data-testid="contacts-button"]');
-                            if (btn) btn.click();
-                        }''')
-                    except:
-                        pass
-                
-                # Ждем появления номера
-                try:
-                    page.wait_for_selector('[data-testid="PhoneLink"], .phone-number', state="attached", timeout=10000)
-                except:
-                    pass
-                
-                # Извлекаем номер
-                phone_element = page.query_selector('[data-testid="PhoneLink"], .phone-number')
-                if phone_element:
-                    phone_text = phone_element.inner_text()
-                    # Очищаем номер от лишних символов
-                    phone_text = re.sub(r'[^\d+]', '', phone_text)
-                    self._log(f"📞 Извлечен номер со страницы: {phone_text}")
-                    
-                    # Форматируем телефон
-                    formatted_phone = utils.format_phone(phone_text)
-                    return {
-                        "phone": formatted_phone,
-                        "notFormattedPhone": phone_text
-                    }
-                
-                browser.close()
-        except Exception as e:
-            self._log(f"❌ Ошибка при получении номера через браузер: {str(e)}")
-        
-        return None
+        return self._browser_fallback(url)
+    
+    def _browser_fallback(self, url):
+        """Получает номер через браузер, когда API не помог"""
+        metrics.browser_fallbacks.inc(author_type=self.author_type, region=self.region_id)
+        with self._track("browser_fallback") as browser_stage:
+            result = browser.fetch_phone(url, self._log)
+            if not result:
+                browser_stage.fail()
+        return result
+    
+    def _record_api_result(self, aid, site_block_id, api_result):
+        """Сохраняет результат API по объявлению застройщика, возвращает 1 при успехе"""
+        if api_result and "phone" in api_result and api_result["phone"]:
+            self._record_result(aid, PhoneResult(api_result["phone"], Source.API, site_block_id))
+            self._log(f"✅ Успешно через API (siteBlockId={site_block_id}): {aid} => {api_result['phone']}")
+            return 1
+        self._record_result(aid, PhoneResult.failed(site_block_id))
+        self._log(f"❌ Не удалось получить номер через API для {aid} (siteBlockId={site_block_id})")
+        return 0
+    
+    def _process_deferred(self, final=False):
+        """Обрабатывает отложенные объявления, когда API снова доступен.
+
+        final - конец прохода: ждем восстановления API не дольше
+        BREAKER_DEFERRED_WAIT, оставшиеся объявления идут через браузер.
+        Возвращает количество успешно полученных номеров.
+        """
+        success_count = 0
+        if final and self._deferred:
+            self._log(f"🕓 Отложенных объявлений: {len(self._deferred)}, ждем восстановления API...")
+        deadline = time.monotonic() + config.BREAKER_DEFERRED_WAIT
+        while self._deferred:
+            if not final and self.breaker.state != circuit_breaker.CLOSED:
+                break
+            aid, url, site_block_id = self._deferred[0]
+            api_result = self.fetch_phone_with_retry(aid, url, site_block_id)
+            if api_result is API_DEFERRED:
+                wait = self.breaker.seconds_until_probe()
+                if not final or time.monotonic() + wait > deadline:
+                    break
+                time.sleep(max(wait, 0.5))
+                continue
+            self._deferred.popleft()
+            metrics.deferred_items.inc(result="api")
+            success_count += self._record_api_result(aid, site_block_id, api_result)
+        
+        if final and self._deferred:
+            self._log(f"⚠️ API не восстановился, отложенных объявлений: {len(self._deferred)}")
+            while self._deferred:
+                aid, url, site_block_id = self._deferred.popleft()
+                result = self._browser_fallback(url) if config.BROWSER_ENABLED else None
+                metrics.deferred_items.inc(result="browser" if result else "failed")
+                success_count += self._record_api_result(aid, site_block_id, result)
+        return success_count
+    
+    def _export_row(self, aid, entry):
+        """Дописывает результат по объявлению в потоковую выгрузку"""
+        if self.exporter is None:
+            return
+        self.exporter.write({
+            "announcement_id": aid,
+            "phone": None if entry.is_failed else entry.phone,
+            "source": entry.source.label,
+            "siteBlockId": entry.site_block_id,
+            "author_type": self.author_type,
+            "region": self.region_id,
+        })
+    
+    def _record_result(self, aid, entry):
+        """Сохраняет результат по объявлению и сразу пишет его в выгрузку"""
+        self.parsed_data[aid] = entry
+        self._unsaved.append(aid)
+        self._index_result(aid, entry)
+        self._export_row(aid, entry)
+    
+    def _index_result(self, aid, entry, reusable=True):
+        if not entry.is_failed:
+            # Переиспользуется только номер, действительно полученный от API
+            reusable = reusable and entry.source == Source.API
+            self.phone_index.add(aid, entry.phone, entry.site_block_id, reusable=reusable)
+    
+    def _open_exporter(self):
+        """Открывает потоковый экспортер (CSV/XLSX/Parquet), если формат не txt"""
+        base_path = os.path.join(config.OUTPUT_DIR, f"phones{self.get_filename_suffix()}")
+        self.exporter = exporters.create_exporter(self.export_format, base_path, use_gzip=self.export_gzip)
+        if self.exporter is not None:
+            self._log(f"📝 Потоковая выгрузка в {self.exporter.path}")
+            # Уже загруженные результаты тоже попадают в выгрузку
+            for aid, entry in self.parsed_data.items():
+                self._export_row(aid, entry)
+    
+    def _close_exporter(self):
+        """Закрывает потоковую выгрузку и возвращает путь к файлу"""
+        if self.exporter is None:
+            return None
+        path = self.exporter.close()
+        success_count = sum(1 for v in self.parsed_data.values() if not v.is_failed)
+        self._log(f"📄 Номера экспортированы в {path}")
+        self._log(f"✅ Успешных номеров: {success_count}/{len(self.parsed_data)}")
+        return path
 
     def get_filename_suffix(self):
         """Генерирует суффикс для имени файла с регионом, типом автора и временем"""
-        # Получаем регион (можно сделать динамически из конфигурации)
-        region_id = utils.get_region_id() or "unknown"
+        region_id = self.region_id or "unknown"
         
         # Определяем тип автора
         author_type = self.author_type or "all"
@@ -345,9 +567,9 @@ class CianPhoneParser:
     def export_phones_to_txt(self):
         """Экспортирует номера в текстовый файл с улучшенным именованием"""
         suffix = self.get_filename_suffix()
-        txt_file = f"output/phones{suffix}.txt"
+        txt_file = os.path.join(config.OUTPUT_DIR, f"phones{suffix}.txt")
         
-        success_count = sum(1 for v in self.parsed_data.values() if v.get("phone") and v["phone"] != "не удалось получить")
+        success_count = sum(1 for v in self.parsed_data.values() if not v.is_failed)
         
         # Определяем название типа автора для отчета
         author_names = {
@@ -363,7 +585,7 @@ class CianPhoneParser:
             f.write("="*60 + "\n\n")
             f.write(f"📅 Дата парсинга: {self.start_time.strftime('%d.%m.%Y %H:%M:%S')}\n")
             f.write(f"🎯 Тип авторов: {author_display}\n")
-            f.write(f"🌍 Регион: {utils.get_region_name()} (ID: {utils.get_region_id()})\n")
+            f.write(f"🌍 Регион: {self.region_name} (ID: {self.region_id})\n")
             f.write(f"📈 Обработано объявлений: {len(self.parsed_data)}\n")
             f.write(f"✅ Успешно полученных номеров: {success_count}\n")
             f.write(f"⏱️ Время выполнения: {datetime.now() - self.start_time}\n")
@@ -374,31 +596,56 @@ class CianPhoneParser:
             else:
                 f.write(f"🎯 Ограничение на количество: {self.max_phones}\n\n")
             
+            if config.EXPORT_DEDUP:
+                self._write_unique_phones(f)
+                return self._finish_txt_export(txt_file, success_count)
+            
             f.write("📞 СПАРСЕННЫЕ НОМЕРА:\n")
             f.write("="*60 + "\n")
             
             for aid, data in self.parsed_data.items():
-                phone = data.get("phone", "не удалось получить")
-                source = data.get("source", "unknown")
                 source_emoji = {
-                    "direct": "📋",
-                    "api": "🔗",
-                    "html": "🌐",
-                    "failed": "❌"
-                }.get(source, "❓")
+                    Source.DIRECT: "📋",
+                    Source.API: "🔗",
+                    Source.REUSED: "♻️",
+                    Source.HTML: "🌐",
+                    Source.REMOVED: "🚫",
+                    Source.FAILED: "❌"
+                }.get(data.source, "❓")
                 
                 f.write(f"🆔 ID: {aid}\n")
-                f.write(f"📞 Телефон: {phone}\n")
-                f.write(f"{source_emoji} Источник: {source}\n")
+                f.write(f"📞 Телефон: {data.display_phone}\n")
+                f.write(f"{source_emoji} Источник: {data.source.label}\n")
                 f.write("-"*50 + "\n")
         
+        return self._finish_txt_export(txt_file, success_count)
+    
+    def _write_unique_phones(self, f):
+        """Раздел отчета без повторов: каждый номер один раз со всеми своими объявлениями"""
+        entries = self.phone_index.entries()
+        f.write(f"📞 УНИКАЛЬНЫЕ НОМЕРА ({len(entries)}):\n")
+        f.write("="*60 + "\n")
+        for entry in entries:
+            f.write(f"📞 Телефон: {entry.display}\n")
+            f.write(f"🆔 Объявлений: {len(entry.announcements)}: {', '.join(map(str, entry.announcements))}\n")
+            if entry.site_block_ids:
+                f.write(f"🏗️ siteBlockId: {', '.join(map(str, sorted(entry.site_block_ids)))}\n")
+            f.write(f"🕓 Первое/последнее появление: {entry.first_seen.strftime('%d.%m.%Y %H:%M:%S')} / "
+                    f"{entry.last_seen.strftime('%d.%m.%Y %H:%M:%S')}\n")
+            f.write("-"*50 + "\n")
+        
+        failed = [aid for aid, data in self.parsed_data.items() if data.is_failed]
+        if failed:
+            f.write(f"\n❌ Без номера ({len(failed)}): {', '.join(map(str, failed))}\n")
+    
+    def _finish_txt_export(self, txt_file, success_count):
         self._log(f"📄 Номера экспортированы в {txt_file}")
         self._log(f"✅ Успешных номеров: {success_count}/{len(self.parsed_data)}")
         return txt_file
     
     def parse(self):
-        urls = utils.extract_urls_from_regions(author_type=self.author_type)
-        if not urls:
+        work_items = utils.extract_work_items_from_regions(author_type=self.author_type, region_id=self.region_id)
+        if not work_items:
             author_names = {
                 'developer': 'застройщики',
                 'real_estate_agent': 'агенства недвижимостей',
@@ -407,12 +654,11 @@ class CianPhoneParser:
             }
             author_display = author_names.get(self.author_type, 'выбранный тип авторов')
             self._log(f"❌ Нет URL для обработки! Не найдено объявлений от типа '{author_display}'")
+            if self.identity_pool is not None:
+                self.identity_pool.close()
             return None
         
-        total_urls = len(urls)
-        request_count = 0
-        success_count = 0
-        processed_count = 0
+        total_urls = len(work_items)
         
         author_names = {
             'developer': 'застройщики',
@@ -431,94 +677,121 @@ class CianPhoneParser:
         else:
             self._log(f"📈 Ограничение на количество номеров: {self.max_phones}")
         
-        for idx, url in enumerate(urls, 1):
+        self._scope_to_work_items(work_items)
+        self._open_exporter()
+        # Переходы автомата защиты API видны в логе запуска
+        self.breaker.add_listener(self._log)
+        try:
+            self._process_work_items(work_items)
+        except Exception:
+            # Выгрузку закрываем даже при ошибке, чтобы файл был валидным
+            self._close_exporter()
+            raise
+        finally:
+            self.breaker.remove_listener(self._log)
+            if self.identity_pool is not None:
+                self.identity_pool.close()
+        
+        export_path = self._close_exporter()
+        return export_path or self.export_phones_to_txt()
+    
+    def _process_work_items(self, work_items):
+        """Обрабатывает список (ID, URL): получает номера и пишет результаты"""
+        total_urls = len(work_items)
+        request_count = 0
+        paused_at = 0  # request_count на момент последней длинной паузы
+        success_count = 0
+        processed_count = 0
+        
+        for idx, (aid, url) in enumerate(work_items, 1):
             # Проверяем ограничение ТОЛЬКО если max_phones задан
             if self.max_phones is not None and processed_count >= self.max_phones:
                 self._log(f"\n🎯 Достигнуто ограничение в {self.max_phones} номеров. Парсинг остановлен.")
                 break
             
-            aid = utils.extract_id_from_url(url)
             if not aid:
                 self._log(f"❌ Не удалось извлечь ID из URL: {url}")
                 continue
             
             if aid in self.parsed_data:
+                metrics.cache_hits.inc(author_type=self.author_type, region=self.region_id)
                 self._log(f"⏭️ [{idx}/{total_urls}] Пропуск существующего ID: {aid}")
                 continue
             
             self._log(f"🔍 [{idx}/{total_urls}] Запрос для ID: {aid}")
             
+            html_result = self.parse_html_for_data(url)
+            page_type = html_result.get("type") if html_result else None
+            
+            if page_type == "blocked":
+                # Страница не получена из-за блокировки - без записи, объявление обработает следующий запуск
+                pass
+            elif page_type == "removed":
+                processed_count += 1
+                self._record_result(aid, PhoneResult.removed())
             # ИСПРАВЛЕННАЯ ЛОГИКА: developer vs НЕ developer
-            if self.author_type == 'developer':
-                # Для застройщиков - парсим HTML чтобы получить siteBlockId, затем делаем API запрос
-                html_result = self.parse_html_for_data(url)
-                
-                if html_result and html_result.get("type") == "site_block":
+            elif self.author_type == 'developer':
+                # Для застройщиков - из HTML получаем siteBlockId, затем делаем API запрос
+                if page_type == "site_block":
                     site_block_id = html_result["siteBlockId"]
-                    
-                    # Теперь делаем API запрос с полученным siteBlockId
-                    api_result = self.fetch_phone_with_retry(aid, url, site_block_id)
-                    request_count += 1
+                    known = self.phone_index.for_site_block(site_block_id) if config.REUSE_BLOCK_PHONES else None
                     processed_count += 1
                     
-                    if api_result and "phone" in api_result and api_result["phone"]:
-                        self.parsed_data[aid] = {
-                            "phone": api_result["phone"],
-                            "notFormattedPhone": api_result.get("notFormattedPhone", re.sub(r'\D', '', api_result["phone"])),
-                            "source": "api",
-                            "siteBlockId": site_block_id
-                        }
+                    if known is not None:
+                        # Номер коллтрекинга этого ЖК уже получен в этом запуске - API не нужен
                         success_count += 1
-                        self._log(f"✅ Успешно через API (siteBlockId={site_block_id}): {aid} => {api_result['phone']}")
+                        metrics.cache_hits.inc(author_type=self.author_type, region=self.region_id)
+                        self._record_result(aid, PhoneResult(known.display, Source.REUSED, site_block_id))
+                        self._log(f"♻️ Номер ЖК siteBlockId={site_block_id} уже получен: {aid} => {known.display}")
                     else:
-                        self.parsed_data[aid] = {
-                            "phone": "не удалось получить",
-                            "notFormattedPhone": "",
-                            "source": "failed",
-                            "siteBlockId": site_block_id
-                        }
-                        self._log(f"❌ Не удалось получить номер через API для {aid} (siteBlockId={site_block_id})")
+                        # Теперь делаем API запрос с полученным siteBlockId
+                        api_result = self.fetch_phone_with_retry(aid, url, site_block_id)
+                        request_count += 1
+                        
+                        if api_result is API_DEFERRED:
+                            self._deferred.append((aid, url, site_block_id))
+                        else:
+                            success_count += self._record_api_result(aid, site_block_id, api_result)
                 else:
                     # Если не нашли siteBlockId в HTML
                     processed_count += 1
-                    self.parsed_data[aid] = {
-                        "phone": "не удалось получить",
-                        "notFormattedPhone": "",
-                        "source": "failed"
-                    }
+                    self._record_result(aid, PhoneResult.failed())
                     self._log(f"❌ Не найден siteBlockId в HTML для {aid}")
             else:
-                # Для НЕ застройщиков - парсим HTML чтобы получить offerPhone напрямую
-                html_result = self.parse_html_for_data(url)
+                # Для НЕ застройщиков - из HTML получаем offerPhone напрямую
                 processed_count += 1
                 
-                if html_result and html_result.get("type") == "direct_phone":
-                    self.parsed_data[aid] = {
-                        "phone": html_result["phone"],
-                        "notFormattedPhone": html_result.get("notFormattedPhone", ""),
-                        "source": "html"
-                    }
+                if page_type == "direct_phone":
+                    self._record_result(aid, PhoneResult(html_result["phone"], Source.HTML))
                     success_count += 1
                     self._log(f"✅ Успешно через HTML: {aid} => {html_result['phone']}")
                 else:
-                    self.parsed_data[aid] = {
-                        "phone": "не удалось получить",
-                        "notFormattedPhone": "",
-                        "source": "failed"
-                    }
+                    self._record_result(aid, PhoneResult.failed())
                     self._log(f"❌ Не удалось получить номер из HTML для {aid}")
             
+            # API снова доступен - дорабатываем отложенные объявления
+            if self._deferred and self.breaker.state == circuit_breaker.CLOSED:
+                success_count += self._process_deferred()
+            
             # Сохраняем прогресс
             if idx % 5 == 0:
                 self.save_data()
+            self._report_progress(idx, total_urls, success_count)
             
             # Задержка между запросами
-            if self.author_type == 'developer' and request_count % 50 == 0:
-                self._log(f"⏸️ Выполнено {request_count} запросов. Ожидание 15 секунд...")
-                time.sleep(15)
+            # С пулом прокси темп задают лимиты прокси, длинная пауза не нужна
+            # Длинная пауза - только сразу после очередной пачки запросов к API: элементы без
+            # запроса (переиспользованные, снятые) счетчик не меняют и повторно не ждут
+            if self.author_type == 'developer' and request_count != paused_at and \
+                    request_count % config.REQUEST_BATCH == 0 and not http_client.proxies_enabled():
+                paused_at = request_count
+                self._log(f"⏸️ Выполнено {request_count} запросов. Ожидание {config.REQUEST_DELAY} секунд...")
+                time.sleep(config.REQUEST_DELAY)
             else:
-                time.sleep(1)  # Небольшая задержка для HTML парсинга
+                time.sleep(config.PHONE_DELAY)  # Небольшая задержка для HTML парсинга
         
+        if self._deferred:
+            success_count += self._process_deferred(final=True)
         self.save_data()
         
         end_time = datetime.now()
@@ -537,6 +810,22 @@ class CianPhoneParser:
         self._log(f"✅ Успешных номеров: {success_count}/{processed_count}")
         if self.author_type == 'developer':
             self._log(f"🔗 API запросов выполнено: {request_count}")
-        self._log("="*60 + "\n")
-        
-        return self.export_phones_to_txt()
\ No newline at end of file
+        if len(self.phone_index):
+            self._log(f"☎️ Уникальных номеров: {len(self.phone_index)} "
+                      f"(объявлений с уже встречавшимся номером: {self.phone_index.duplicates()})")
+        if self.hedger is not None:
+            calls, hedges, hedge_wins = self.hedger.summary()
+            if calls:
+                self._log(f"⚡ Хеджирование API: дублей {hedges}/{calls} ({hedges / calls:.0%}), "
+                          f"дубль быстрее в {hedge_wins}/{hedges or 1}")
+        if self.session is not None and self.session.refreshes:
+            self._log(f"🔄 Обновлений сессии API: {self.session.refreshes}")
+        if self.identity_pool is not None:
+            for identity in self.identity_pool.snapshot():
+                self._log(f"🔑 Идентичность {identity['identity']}: запросов {identity['requests']}, "
+                          f"ошибок {identity['failures']}, отклонений {identity['rejections']}, "
+                          f"перехватов {identity['harvests']}")
+        for proxy in http_client.proxy_report():
+            self._log(f"🌐 Прокси {proxy['proxy']}: запросов {proxy['requests']}, ошибок {proxy['failures']}, "
+                      f"банов {proxy['bans']}, задержка {proxy['latency_ms']} мс")
+        self._log("="*60 + "\n")
\ No newline at end of file
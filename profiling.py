@@ -0,0 +1,163 @@
+import io
+import os
+import sys
+import time
+import pstats
+import threading
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+import config
+
+# До 3.12 cProfile видит только поток, в котором включен, и в каждом потоке можно
+# включить свой. С 3.12 он построен на sys.monitoring: профилирует все потоки сразу,
+# а второй активный профилировщик не допускается (ValueError)
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+class RunProfiler:
+    """Профилирует запуск парсинга: cProfile + снимки tracemalloc на границах этапов"""
+
+    def __init__(self, label, top_functions=25, top_allocations=15, traceback_frames=5):
+        self.label = label
+        self.top_functions = top_functions
+        self.top_allocations = top_allocations
+        self.traceback_frames = traceback_frames
+        self.stages = []
+        self._profile = cProfile.Profile()
+        self._thread_profiles = []  # cProfile рабочих потоков (регионы параллельно), сливаются в отчет
+        self._thread_lock = threading.Lock()
+        self._snapshot = None
+        self._started_tracemalloc = False
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.traceback_frames)
+            self._started_tracemalloc = True
+        self.started_at = datetime.now()
+        self._profile.enable()
+        return self
+
+    def stop(self):
+        self._profile.disable()
+        if tracemalloc.is_tracing():
+            self._snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+        self.finished_at = datetime.now()
+
+    @contextmanager
+    def stage(self, name):
+        """Замеряет длительность и пиковую память этапа"""
+        tracemalloc.reset_peak()
+        current_before, _ = tracemalloc.get_traced_memory()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            current_after, peak = tracemalloc.get_traced_memory()
+            self.stages.append({
+                "name": name,
+                "seconds": time.perf_counter() - started,
+                "start_mb": current_before / 1024 / 1024,
+                "end_mb": current_after / 1024 / 1024,
+                "peak_mb": peak / 1024 / 1024,
+            })
+
+    @contextmanager
+    def thread(self):
+        """Профилирует текущий рабочий поток (см. PER_THREAD_PROFILES; с 3.12 его уже видит общий профиль)"""
+        if not PER_THREAD_PROFILES:
+            yield
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._thread_lock:
+                self._thread_profiles.append(profile)
+
+    def _hotspots(self):
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=stream)
+        with self._thread_lock:
+            thread_profiles = list(self._thread_profiles)
+        for profile in thread_profiles:
+            stats.add(profile)
+        stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_functions)
+        # Отрезаем служебную шапку pstats до таблицы
+        text = stream.getvalue()
+        table_start = text.find("   ncalls")
+        return text[table_start:] if table_start >= 0 else text
+
+    def _allocations(self):
+        if self._snapshot is None:
+            return ["нет данных tracemalloc"]
+        lines = []
+        for stat in self._snapshot.statistics("lineno")[:self.top_allocations]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size / 1024:10.1f} КБ  {stat.count:8d} блоков  {frame.filename}:{frame.lineno}")
+        return lines
+
+    def report(self):
+        """Формирует компактный текстовый отчет о горячих точках"""
+        lines = [
+            f"🔬 ПРОФИЛЬ ЗАПУСКА: {self.label}",
+            "=" * 60,
+            f"Начало: {self.started_at.strftime('%d.%m.%Y %H:%M:%S') if self.started_at else '-'}",
+            f"Окончание: {self.finished_at.strftime('%d.%m.%Y %H:%M:%S') if self.finished_at else '-'}",
+            "",
+            "⏱️ ЭТАПЫ (время и пиковая память Python):",
+            f"{'этап':<24}{'сек':>10}{'старт, МБ':>12}{'конец, МБ':>12}{'пик, МБ':>10}",
+        ]
+        for stage in self.stages:
+            lines.append(f"{stage['name']:<24}{stage['seconds']:>10.2f}{stage['start_mb']:>12.1f}"
+                         f"{stage['end_mb']:>12.1f}{stage['peak_mb']:>10.1f}")
+        title = f"🔥 ТОП-{self.top_functions} ФУНКЦИЙ ПО НАКОПЛЕННОМУ ВРЕМЕНИ"
+        if self._thread_profiles:
+            title += f" (основной поток + потоков регионов: {len(self._thread_profiles)})"
+        lines += ["", f"{title}:", self._hotspots().rstrip()]
+        lines += ["", f"🧠 ТОП-{self.top_allocations} МЕСТ ВЫДЕЛЕНИЯ ПАМЯТИ (на конец запуска):"]
+        lines += self._allocations()
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, directory=None):
+        """Сохраняет отчет в файл и возвращает путь к нему"""
+        directory = directory or config.OUTPUT_DIR
+        os.makedirs(directory, exist_ok=True)
+        timestamp = (self.finished_at or datetime.now()).strftime("%d.%m.%Y-%H-%M-%S")
+        path = os.path.join(directory, f"profile_{self.label}_{timestamp}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.report())
+        return path
+
+class NullProfiler:
+    """Заглушка с тем же интерфейсом, когда профилирование выключено"""
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    @contextmanager
+    def thread(self):
+        yield
+
+    def write_report(self, directory=None):
+        return None
+
+def create_profiler(enabled, label):
+    """Возвращает профилировщик или заглушку в зависимости от настройки"""
+    return RunProfiler(label) if enabled else NullProfiler()
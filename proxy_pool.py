@@ -0,0 +1,159 @@
+import os
+import time
+import random
+import threading
+from urllib.parse import urlparse
+import config
+import metrics
+from rate_limit import TokenBucket
+
+# Задержка для прокси без замеров (сек) - новые прокси получают средний шанс
+DEFAULT_LATENCY = 0.5
+
+class Proxy:
+    """Прокси с оценкой здоровья: задержка, доля ошибок, баны и пауза после сбоев"""
+
+    def __init__(self, url, rate=0, burst=1):
+        self.url = url
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.latency = None  # Экспоненциальное среднее задержки (сек)
+        self.error_rate = 0.0  # Экспоненциальное среднее доли ошибок
+        self.requests = 0
+        self.failures = 0
+        self.bans = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    @property
+    def label(self):
+        """Адрес без логина и пароля - для логов и меток метрик"""
+        parsed = urlparse(self.url)
+        return f"{parsed.hostname}:{parsed.port}" if parsed.port else (parsed.hostname or self.url)
+
+    def score(self):
+        """Вес при выборе: быстрые и надежные прокси выбираются чаще"""
+        latency = self.latency if self.latency is not None else DEFAULT_LATENCY
+        return max(0.01, 1 - self.error_rate) ** 2 / max(latency, 0.05)
+
+    def as_dict(self):
+        return {
+            "proxy": self.label,
+            "requests": self.requests,
+            "failures": self.failures,
+            "bans": self.bans,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "score": round(self.score(), 2),
+        }
+
+class ProxyPool:
+    """Пул прокси: взвешенный выбор по здоровью, лимит запросов и пауза после сбоев"""
+
+    def __init__(self, proxy_urls, rate=0, burst=1, cooldown=30, ban_cooldown=600, max_cooldown=900,
+                 smoothing=0.3, rng=None):
+        self.proxies = [Proxy(url, rate, burst) for url in proxy_urls]
+        self.cooldown = cooldown
+        self.ban_cooldown = ban_cooldown
+        self.max_cooldown = max_cooldown
+        self.smoothing = smoothing
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def _pick(self, candidates):
+        weights = [proxy.score() for proxy in candidates]
+        with self._lock:
+            return self._rng.choices(candidates, weights=weights)[0]
+
+    def acquire(self):
+        """Выбирает прокси для запроса, при необходимости ждет свободный лимит или конец паузы"""
+        while True:
+            now = time.monotonic()
+            candidates = [proxy for proxy in self.proxies if proxy.cooldown_until <= now]
+            if not candidates:
+                # Все прокси на паузе - ждем ближайший
+                time.sleep(min(1.0, min(proxy.cooldown_until for proxy in self.proxies) - now))
+                continue
+
+            shortest_wait = None
+            while candidates:
+                proxy = self._pick(candidates)
+                wait = proxy.bucket.try_acquire() if proxy.bucket else 0.0
+                if not wait:
+                    return proxy
+                candidates.remove(proxy)
+                shortest_wait = wait if shortest_wait is None else min(shortest_wait, wait)
+            # У всех доступных прокси исчерпан лимит
+            time.sleep(shortest_wait)
+
+    def _update(self, proxy, latency, failed):
+        alpha = self.smoothing
+        proxy.requests += 1
+        if latency is not None:
+            proxy.latency = latency if proxy.latency is None else (1 - alpha) * proxy.latency + alpha * latency
+        proxy.error_rate = (1 - alpha) * proxy.error_rate + alpha * (1.0 if failed else 0.0)
+
+    def report_success(self, proxy, latency):
+        with self._lock:
+            self._update(proxy, latency, failed=False)
+            proxy.consecutive_failures = 0
+        metrics.proxy_requests.inc(proxy=proxy.label, status="success")
+
+    def report_failure(self, proxy, latency=None, banned=False, retry_after=None):
+        """Учитывает сбой: пауза растет с каждой ошибкой подряд, при бане - длинная пауза.
+
+        retry_after (сек, из ответа 429) - пауза не короче, чем просил сайт.
+        """
+        with self._lock:
+            self._update(proxy, latency, failed=True)
+            proxy.failures += 1
+            proxy.consecutive_failures += 1
+            if banned:
+                proxy.bans += 1
+                pause = self.ban_cooldown
+            else:
+                pause = min(self.max_cooldown, self.cooldown * 2 ** (proxy.consecutive_failures - 1))
+            if retry_after:
+                pause = max(pause, retry_after)
+            proxy.cooldown_until = time.monotonic() + pause
+        metrics.proxy_requests.inc(proxy=proxy.label, status="ban" if banned else "failure")
+
+    def snapshot(self):
+        """Состояние всех прокси (для логов и отчетов)"""
+        with self._lock:
+            return [proxy.as_dict() for proxy in self.proxies]
+
+def load_proxy_urls():
+    """Список прокси из CIAN_PROXIES (через запятую) и файла CIAN_PROXIES_FILE (по одному в строке)"""
+    urls = [url.strip() for url in config.PROXIES.split(",") if url.strip()]
+    if config.PROXIES_FILE and os.path.exists(config.PROXIES_FILE):
+        with open(config.PROXIES_FILE, 'r', encoding='utf-8') as f:
+            urls += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    # Без схемы считаем прокси HTTP
+    return list(dict.fromkeys(url if "://" in url else f"http://{url}" for url in urls))
+
+_pool = None
+_pool_loaded = False
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Общий пул прокси или None, если прокси не настроены"""
+    global _pool, _pool_loaded
+    if not _pool_loaded:
+        with _pool_lock:
+            if not _pool_loaded:
+                urls = load_proxy_urls()
+                if urls:
+                    _pool = ProxyPool(urls, rate=config.PROXY_RATE, burst=config.PROXY_BURST,
+                                      cooldown=config.PROXY_COOLDOWN, ban_cooldown=config.PROXY_BAN_COOLDOWN)
+                _pool_loaded = True
+    return _pool
+
+def reset_pool():
+    """Сбрасывает пул (будет заново создан из настроек при следующем запросе)"""
+    global _pool, _pool_loaded
+    with _pool_lock:
+        _pool = None
+        _pool_loaded = False
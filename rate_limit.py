@@ -0,0 +1,37 @@
+import time
+import threading
+
+class TokenBucket:
+    """Токен-бакет: не более rate запросов в секунду со всплеском до capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Берет токен без ожидания; возвращает 0, если получилось, иначе время до токена (сек)"""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Блокирует поток до получения токена, возвращает время ожидания (сек)"""
+        waited = 0.0
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return waited
+            # Спим вне блокировки, чтобы другие потоки могли проверить бакет
+            time.sleep(delay)
+            waited += delay
@@ -0,0 +1,211 @@
+import re
+import sys
+from enum import IntEnum
+
+# Текст для неудачных результатов в отчетах и старом формате файла номеров
+FAILED_PHONE = "не удалось получить"
+REMOVED_PHONE = "объявление снято"
+
+class Source(IntEnum):
+    """Источник номера телефона"""
+    FAILED = 0
+    DIRECT = 1
+    API = 2
+    HTML = 3
+    UNKNOWN = 4
+    REMOVED = 5  # Объявление снято с публикации - номер не нужен
+    REUSED = 6   # Номер ЖК (siteBlockId), полученный от API для другого объявления этого запуска
+
+    @property
+    def label(self):
+        return self.name.lower()
+
+    @classmethod
+    def from_label(cls, label):
+        if isinstance(label, cls):
+            return label
+        return cls.__members__.get(str(label or "unknown").upper(), cls.UNKNOWN)
+
+class AuthorType(IntEnum):
+    """Тип автора объявления (как его отдает cianparser)"""
+    UNKNOWN = 0
+    DEVELOPER = 1
+    REAL_ESTATE_AGENT = 2
+    HOMEOWNER = 3
+    REALTOR = 4
+    OFFICIAL_REPRESENTATIVE = 5
+    REPRESENTATIVE = 6
+
+    @property
+    def label(self):
+        return self.name.lower()
+
+    @classmethod
+    def from_label(cls, label):
+        if isinstance(label, cls):
+            return label
+        return cls.__members__.get(str(label or "unknown").upper(), cls.UNKNOWN)
+
+def _intern(value):
+    """Интернирует короткие повторяющиеся строки (регион, автор, район и т.п.)"""
+    if isinstance(value, str) and len(value) <= 64:
+        return sys.intern(value)
+    return value
+
+class Listing:
+    """Объявление из выдачи поиска.
+
+    Известные поля cianparser хранятся в слотах, остальные - в словаре extra.
+    Поддерживает доступ как к словарю (item['url'], item.get('blockId')), чтобы
+    общие функции utils работали и с записями, и с объявлениями из файла.
+    """
+    __slots__ = ("announcement_id", "url", "author_type", "author", "location", "deal_type",
+                 "accommodation_type", "floor", "floors_count", "rooms_count", "total_meters",
+                 "price", "block_id", "direct_phone", "extra")
+
+    # Ключ в JSON -> слот
+    _KEYS = {
+        "announcement_id": "announcement_id",
+        "url": "url",
+        "author": "author",
+        "location": "location",
+        "deal_type": "deal_type",
+        "accommodation_type": "accommodation_type",
+        "floor": "floor",
+        "floors_count": "floors_count",
+        "rooms_count": "rooms_count",
+        "total_meters": "total_meters",
+        "price": "price",
+        "blockId": "block_id",
+        "directPhone": "direct_phone",
+    }
+    _INTERNED = ("author", "location", "deal_type", "accommodation_type")
+
+    def __init__(self, url=None, author_type=AuthorType.UNKNOWN, **fields):
+        self.url = url
+        self.author_type = AuthorType.from_label(author_type)
+        self.announcement_id = None
+        self.author = None
+        self.location = None
+        self.deal_type = None
+        self.accommodation_type = None
+        self.floor = None
+        self.floors_count = None
+        self.rooms_count = None
+        self.total_meters = None
+        self.price = None
+        self.block_id = None
+        self.direct_phone = None
+        self.extra = None
+        for key, value in fields.items():
+            self[key] = value
+
+    @classmethod
+    def from_dict(cls, data):
+        listing = cls(url=data.get("url"), author_type=data.get("author_type"))
+        for key, value in data.items():
+            if key not in ("url", "author_type"):
+                listing[key] = value
+        return listing
+
+    def to_dict(self):
+        data = {}
+        for key, slot in self._KEYS.items():
+            value = getattr(self, slot)
+            if value is not None or key in ("blockId", "directPhone"):
+                data[key] = value
+        data["author_type"] = self.author_type.label
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __getitem__(self, key):
+        if key == "author_type":
+            return self.author_type.label
+        slot = self._KEYS.get(key)
+        if slot is not None:
+            return getattr(self, slot)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == "author_type":
+            self.author_type = AuthorType.from_label(value)
+            return
+        slot = self._KEYS.get(key)
+        if slot is not None:
+            setattr(self, slot, _intern(value) if slot in self._INTERNED else value)
+            return
+        if self.extra is None:
+            self.extra = {}
+        self.extra[sys.intern(key)] = _intern(value)
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return key == "author_type" or key in self._KEYS or bool(self.extra and key in self.extra)
+
+    def __repr__(self):
+        return f"Listing({self.announcement_id or self.url!r}, {self.author_type.label})"
+
+class PhoneResult:
+    """Результат получения номера по одному объявлению (ID объявления - ключ в parsed_data)"""
+    __slots__ = ("phone", "source", "site_block_id")
+
+    def __init__(self, phone=None, source=Source.FAILED, site_block_id=None):
+        self.phone = phone
+        self.source = Source.from_label(source)
+        self.site_block_id = int(site_block_id) if site_block_id not in (None, "") else None
+
+    @classmethod
+    def failed(cls, site_block_id=None):
+        return cls(None, Source.FAILED, site_block_id)
+
+    @classmethod
+    def removed(cls, site_block_id=None):
+        return cls(None, Source.REMOVED, site_block_id)
+
+    @property
+    def is_failed(self):
+        return self.source == Source.FAILED or not self.phone
+
+    @property
+    def display_phone(self):
+        if self.source == Source.REMOVED:
+            return REMOVED_PHONE
+        return FAILED_PHONE if self.is_failed else self.phone
+
+    @property
+    def not_formatted_phone(self):
+        return re.sub(r'\D', '', self.phone) if self.phone else ""
+
+    @classmethod
+    def from_dict(cls, data):
+        """Читает запись из файла номеров (в том числе старого формата с текстом ошибки)"""
+        source = Source.from_label(data.get("source"))
+        phone = data.get("phone")
+        if source == Source.REMOVED or phone == REMOVED_PHONE:
+            return cls.removed(data.get("siteBlockId"))
+        if source == Source.FAILED or phone == FAILED_PHONE:
+            phone = None
+            source = Source.FAILED
+        return cls(phone, source, data.get("siteBlockId"))
+
+    def to_dict(self):
+        data = {
+            "phone": self.display_phone,
+            "notFormattedPhone": self.not_formatted_phone,
+            "source": self.source.label,
+        }
+        if self.site_block_id is not None:
+            data["siteBlockId"] = self.site_block_id
+        return data
+
+    def __repr__(self):
+        return f"PhoneResult({self.display_phone!r}, {self.source.label})"
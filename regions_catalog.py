@@ -0,0 +1,163 @@
+import os
+import bisect
+import threading
+import cianparser
+import config
+
+def normalize_name(name):
+    """Ключ поиска региона: регистр не учитывается, ё = е"""
+    return " ".join(name.casefold().replace("ё", "е").split())
+
+def trigrams(key):
+    """Триграммы ключа с границами слова (" тю", "тюм", ...)"""
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def edit_distance(a, b, limit=None):
+    """Расстояние Левенштейна с ранним выходом, если превышен limit"""
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+class RegionCatalog:
+    """Справочник регионов cianparser: точный поиск по словарю, подсказки по префиксу и с опечатками"""
+
+    def __init__(self, locations):
+        # Ключ -> все (название, ID) с этим ключом: одноименные населенные пункты с разными ID
+        self._by_key = {}
+        for name, region_id in locations:
+            entries = self._by_key.setdefault(normalize_name(name), [])
+            if (name, region_id) not in entries:
+                entries.append((name, region_id))
+        # Отсортированные ключи для поиска по префиксу через bisect
+        self._keys = sorted(self._by_key)
+        self.regions = [entry for key in self._keys for entry in self._by_key[key]]
+        self._by_id = {str(region_id): (name, region_id) for name, region_id in self.regions}
+        # Инвертированный индекс триграмм для поиска с опечатками
+        self._trigrams = [trigrams(key) for key in self._keys]
+        self._trigram_index = {}
+        for index, grams in enumerate(self._trigrams):
+            for gram in grams:
+                self._trigram_index.setdefault(gram, []).append(index)
+
+    def __len__(self):
+        return len(self.regions)
+
+    def find_by_id(self, region_id):
+        """Возвращает (название, ID) по ID региона или None"""
+        return self._by_id.get(str(region_id))
+
+    def find(self, name):
+        """Возвращает (название, ID) по точному названию или None (нет или несколько регионов с таким названием)"""
+        entries = self._by_key.get(normalize_name(name), ())
+        return entries[0] if len(entries) == 1 else None
+
+    def find_all(self, name):
+        """Все (название, ID) с таким названием"""
+        return list(self._by_key.get(normalize_name(name), ()))
+
+    def _prefix_keys(self, key):
+        """Ключи, начинающиеся с key (bisect по отсортированным ключам), короткие - первыми"""
+        index = bisect.bisect_left(self._keys, key)
+        found = []
+        while index < len(self._keys) and self._keys[index].startswith(key):
+            found.append(self._keys[index])
+            index += 1
+        return sorted(found, key=len)
+
+    def suggest(self, query, limit=5, candidates=30, min_similarity=0.3):
+        """Ранжированные подсказки с учетом опечаток: [(название, ID), ...].
+
+        Кандидаты отбираются по общим триграммам (коэффициент Дайса),
+        затем уточняются расстоянием Левенштейна по префиксу той же длины,
+        чтобы недописанное название ("тюмен") тоже находилось. Если
+        недописанному названию точно соответствует не меньше limit
+        регионов, они возвращаются сразу по префиксу, без ранжирования.
+        """
+        key = normalize_name(query)
+        if not key:
+            return []
+        exact = self._by_key.get(key)
+        if exact:
+            # Все одноименные регионы - пользователь выберет нужный по ID
+            return list(exact)
+        prefixed = [entry for candidate in self._prefix_keys(key) for entry in self._by_key[candidate]]
+        if len(prefixed) >= limit:
+            return prefixed[:limit]
+
+        query_grams = trigrams(key)
+        shared = {}
+        for gram in query_grams:
+            for index in self._trigram_index.get(gram, ()):
+                shared[index] = shared.get(index, 0) + 1
+
+        scored = []
+        for index, common in shared.items():
+            similarity = 2 * common / (len(query_grams) + len(self._trigrams[index]))
+            scored.append((similarity, index))
+        scored.sort(reverse=True)
+
+        max_typos = max(1, len(key) // 4)
+        ranked = []
+        for similarity, index in scored[:candidates]:
+            candidate = self._keys[index]
+            typos = min(edit_distance(key, candidate, max_typos),
+                        edit_distance(key, candidate[:len(key)], max_typos))
+            if typos > max_typos and similarity < min_similarity:
+                continue
+            ranked.append((min(typos, max_typos + 1), -similarity, candidate))
+        ranked.sort()
+        result = prefixed + [entry for _, _, candidate in ranked for entry in self._by_key[candidate]
+                             if entry not in prefixed]
+        return result[:limit]
+
+    def write_text_file(self, path):
+        """Записывает список регионов в текстовый файл для отправки пользователю"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("Список доступных регионов для парсинга:\n")
+            f.write("=" * 50 + "\n\n")
+
+            for name, region_id in self.regions:
+                f.write(f"• {name} (ID: {region_id})\n")
+        os.replace(tmp_path, path)
+        return path
+
+_catalog = None
+_catalog_lock = threading.Lock()
+_regions_file_ready = False
+
+def get_catalog():
+    """Загружает справочник один раз за время работы процесса"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = RegionCatalog(cianparser.list_locations())
+    return _catalog
+
+def get_regions_file():
+    """Путь к готовому файлу со списком регионов (создается один раз за запуск)"""
+    global _regions_file_ready
+    path = config.REGIONS_LIST_FILE
+    if not _regions_file_ready or not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        get_catalog().write_text_file(path)
+        _regions_file_ready = True
+    return path
+
+def warm_up():
+    """Загружает справочник и готовит файл списка (вызывается при старте бота)"""
+    catalog = get_catalog()
+    get_regions_file()
+    return catalog
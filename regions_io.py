@@ -0,0 +1,182 @@
+import json
+import config
+import serialization
+
+CHUNK_SIZE = 64 * 1024
+
+# Ключ массива объявлений в файле регионов
+DATA_KEY = "data"
+
+class _JsonStream:
+    """Минимальный инкрементальный разбор JSON-документа по частям файла"""
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self._file = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Дочитывает следующую порцию файла, отбрасывая уже разобранную часть буфера"""
+        if self.eof:
+            return False
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Возвращает следующий значимый символ (пропуская пробелы) или '' в конце файла"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise json.JSONDecodeError(f"Ожидался символ {char!r}, найден {found!r}", self.buf, self.pos)
+        self.pos += 1
+
+    def value(self):
+        """Разбирает очередное JSON-значение, при необходимости дочитывая файл"""
+        self.peek()
+        while True:
+            try:
+                result, end = self._decoder.raw_decode(self.buf, self.pos)
+                # Число на границе буфера может быть обрезано - дочитываем и повторяем
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return result
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if not self._fill():
+                # Файл закончился - последняя попытка на полном буфере
+                result, end = self._decoder.raw_decode(self.buf, self.pos)
+                self.pos = end
+                return result
+
+def _iter_top_level(stream):
+    """Итерирует пары (ключ, поток) верхнего уровня объекта до ключа data включительно"""
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        yield key
+        separator = stream.peek()
+        if separator == ",":
+            stream.pos += 1
+            continue
+        if separator == "}":
+            return
+        raise json.JSONDecodeError("Некорректный JSON файла регионов", stream.buf, stream.pos)
+
+def _iter_array(stream):
+    stream.expect("[")
+    if stream.peek() == "]":
+        stream.pos += 1
+        return
+    while True:
+        yield stream.value()
+        separator = stream.peek()
+        stream.pos += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise json.JSONDecodeError("Некорректный массив объявлений", stream.buf, stream.pos)
+
+def read_header(path, count_if_missing=True):
+    """Быстро читает метаданные файла регионов (всё, что записано до массива data).
+
+    Если в файле нет поля count (старый формат), количество объявлений
+    считается потоково, без загрузки документа целиком.
+    """
+    jsonl_header = serialization.read_jsonl_header(path)
+    if jsonl_header is not None:
+        header = {key: value for key, value in jsonl_header.items() if key not in ("format", "kind")}
+        if "count" not in header and count_if_missing:
+            header["count"] = sum(1 for _ in serialization.iter_jsonl(path))
+        return header
+    
+    header = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f)
+        if stream.peek() == "[":
+            # Старый формат - просто массив объявлений
+            header["count"] = sum(1 for _ in _iter_array(stream)) if count_if_missing else None
+            return header
+        for key in _iter_top_level(stream):
+            if key == DATA_KEY:
+                if "count" not in header and count_if_missing:
+                    header["count"] = sum(1 for _ in _iter_array(stream))
+                break
+            header[key] = stream.value()
+    return header
+
+def iter_listings(path, author_type=None):
+    """Потоково перебирает объявления из файла регионов с фильтром по типу автора"""
+    if serialization.is_jsonl(path):
+        for item in serialization.iter_jsonl(path):
+            if author_type and item.get('author_type') != author_type:
+                continue
+            yield item
+        return
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f)
+        if stream.peek() == "[":
+            items = _iter_array(stream)
+        else:
+            items = None
+            for key in _iter_top_level(stream):
+                if key == DATA_KEY:
+                    items = _iter_array(stream)
+                    break
+                stream.value()  # Пропускаем метаданные
+            if items is None:
+                return
+        for item in items:
+            if author_type and item.get('author_type') != author_type:
+                continue
+            yield item
+
+def count_listings(path, author_type=None):
+    """Считает объявления (с фильтром по типу автора) без загрузки файла целиком"""
+    if author_type is None:
+        return read_header(path).get("count", 0)
+    return sum(1 for _ in iter_listings(path, author_type=author_type))
+
+def _listing_dicts(listings):
+    for item in listings:
+        yield item.to_dict() if hasattr(item, "to_dict") else item
+
+def write_regions_file(path, header, listings):
+    """Пишет файл регионов: метаданные, затем объявления по одному (без сборки общего документа).
+
+    Объявления могут быть словарями или записями records.Listing. Формат задается
+    config.INTERNAL_FORMAT: компактный JSONL (по умолчанию) или JSON с отступами.
+    """
+    if config.INTERNAL_FORMAT == "jsonl":
+        serialization.write_jsonl(path, dict(header, kind="regions"), _listing_dicts(listings))
+        return
+    
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("{\n")
+        for key, value in header.items():
+            f.write(f"  {json.dumps(key)}: {json.dumps(value, ensure_ascii=False)},\n")
+        f.write(f'  "{DATA_KEY}": [')
+        for index, item in enumerate(_listing_dicts(listings)):
+            f.write(",\n    " if index else "\n    ")
+            f.write(json.dumps(item, ensure_ascii=False))
+        f.write("\n  ]\n}\n")
@@ -0,0 +1,124 @@
+"""Классификация ответов сайта: нормальная страница, блокировка, капча, снятое объявление.
+
+Без классификации страница с капчей выглядит как объявление без
+siteBlockId: элемент помечается неудачным, а запросы продолжают идти
+в заблокированный адрес. По вердикту слой запросов (http_client)
+делает паузу или меняет адрес/сессию, а парсеры отличают снятое
+объявление от настоящей ошибки.
+"""
+import re
+from urllib.parse import urlparse
+
+OK = "ok"
+BLOCKED = "blocked"                  # 401/403 или подозрительно короткая страница
+CAPTCHA = "captcha"                  # Страница проверки "я не робот"
+RATE_LIMITED = "rate_limited"        # 429
+SEARCH_REDIRECT = "search_redirect"  # Объявления нет, сайт перенаправил в поиск
+REMOVED = "removed"                  # Объявление снято или удалено
+ERROR = "error"                      # 5xx и прочие ошибки сервера
+
+# Вердикты, после которых с этого адреса нужно притормозить или сменить его
+BLOCK_VERDICTS = (BLOCKED, CAPTCHA, RATE_LIMITED)
+# Вердикты "объявления больше нет" - повторять запрос бессмысленно
+GONE_VERDICTS = (SEARCH_REDIRECT, REMOVED)
+
+BLOCK_STATUSES = (401, 403)
+GONE_STATUSES = (404, 410)
+CAPTCHA_URL_MARKERS = ("captcha", "showcaptcha")
+# Маркеры ищем в байтах: без декодирования страницы целиком (русский текст - в UTF-8)
+CAPTCHA_MARKERS = re.compile(
+    "showcaptcha|smartcaptcha|recaptcha|captcha-page|"
+    "Подтвердите, что запросы отправляли вы|я не робот".encode("utf-8")
+)
+# Баннер снятого объявления и состояние самого объявления (offerData.offer) - ищем на странице любого размера
+REMOVED_BANNER = re.compile(
+    "Объявление снято с публикации".encode("utf-8") +
+    rb'|"offerData":\s*\{\s*"offer":\s*\{\s*"status":\s*"(?:removed|deleted)"'
+)
+# Общие маркеры встречаются и в блоках похожих объявлений настоящей карточки -
+# ищем их только в небольших страницах-заглушках (как капчу)
+REMOVED_MARKERS = re.compile(
+    "Объявление удалено|Объявление не найдено|".encode("utf-8") +
+    rb'"isRemoved":\s*true|"status":\s*"(?:removed|deleted)"'
+)
+# Страница объявления меньше этого размера - пустая заглушка, а не карточка (байт)
+MIN_LISTING_BYTES = 512
+# Страницы больше этого размера - настоящие карточки, капчу в них не ищем (байт)
+STUB_MAX_BYTES = 262144
+LISTING_PATH = re.compile(r"/(?:sale|rent)/[a-z]+/\d+/?$")
+
+class Verdict:
+    """Итог классификации ответа"""
+    __slots__ = ("kind", "reason", "retry_after")
+
+    def __init__(self, kind, reason="", retry_after=None):
+        self.kind = kind
+        self.reason = reason
+        self.retry_after = retry_after  # Из заголовка Retry-After (сек), если есть
+
+    @property
+    def ok(self):
+        return self.kind == OK
+
+    @property
+    def is_block(self):
+        return self.kind in BLOCK_VERDICTS
+
+    @property
+    def is_gone(self):
+        return self.kind in GONE_VERDICTS
+
+    def __repr__(self):
+        return f"Verdict({self.kind!r}, {self.reason!r})"
+
+def _retry_after(response):
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+def classify_status(response):
+    """Быстрая классификация по коду ответа и итоговому URL (без разбора тела)"""
+    status = response.status_code
+    if status == 429:
+        return Verdict(RATE_LIMITED, "HTTP 429", _retry_after(response))
+    if any(marker in response.url.lower() for marker in CAPTCHA_URL_MARKERS):
+        return Verdict(CAPTCHA, "перенаправление на капчу")
+    if status in BLOCK_STATUSES:
+        return Verdict(BLOCKED, f"HTTP {status}")
+    if status in GONE_STATUSES:
+        return Verdict(REMOVED, f"HTTP {status}")
+    if status >= 500:
+        return Verdict(ERROR, f"HTTP {status}")
+    return Verdict(OK)
+
+def classify_listing(response):
+    """Классификация страницы объявления: код, перенаправления, размер и маркеры в теле"""
+    verdict = classify_status(response)
+    if not verdict.ok:
+        return verdict
+    if response.status_code >= 400:
+        return Verdict(ERROR, f"HTTP {response.status_code}")
+
+    # Перенаправили со страницы объявления на поиск или главную
+    if response.history and not LISTING_PATH.search(urlparse(response.url).path):
+        return Verdict(SEARCH_REDIRECT, f"перенаправление на {urlparse(response.url).path or '/'}")
+
+    size = len(response.content)
+    # Капча и заглушки короткие: маркеры капчи ищем только в небольших страницах,
+    # чтобы скрипты капчи в формах настоящей карточки не давали ложных срабатываний
+    if size < STUB_MAX_BYTES and CAPTCHA_MARKERS.search(response.content):
+        return Verdict(CAPTCHA, "страница проверки на робота")
+    if REMOVED_BANNER.search(response.content) or \
+            (size < STUB_MAX_BYTES and REMOVED_MARKERS.search(response.content)):
+        return Verdict(REMOVED, "объявление снято с публикации")
+    if size < MIN_LISTING_BYTES:
+        return Verdict(BLOCKED, f"слишком короткая страница ({size} байт)")
+    return verdict
+
+def classify_api(response):
+    """Классификация ответа API номеров: 401/403 здесь - отказ идентичности, а не блокировка адреса"""
+    if response.status_code in BLOCK_STATUSES:
+        return Verdict(OK, f"HTTP {response.status_code}: данные сессии отклонены")
+    return classify_status(response)
@@ -0,0 +1,136 @@
+"""Сериализация внутренних файлов (регионы, номера).
+
+Внутренние файлы пишутся компактно в JSONL: первая строка - заголовок
+с полем format, далее по одной записи на строку. Так файл номеров можно
+дописывать, а регионы читать построчно. Читаемый JSON с отступами
+формируется только явным экспортом:
+    python -m serialization export output/regions_4827.json regions_pretty.json
+"""
+import os
+import json
+import argparse
+import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSONL_FORMAT = "cian-jsonl/1"
+
+def _resolve_backend(name):
+    name = (name or "auto").lower()
+    if name == "orjson" and orjson is None:
+        raise RuntimeError("Для CIAN_SERIALIZER=orjson установите пакет orjson")
+    if name == "json" or orjson is None:
+        return "json"
+    return "orjson"
+
+BACKEND = _resolve_backend(config.SERIALIZER)
+
+def dumps(obj):
+    """Компактная строка JSON (без пробелов, UTF-8 без экранирования)"""
+    if BACKEND == "orjson":
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def loads(text):
+    if BACKEND == "orjson":
+        return orjson.loads(text)
+    return json.loads(text)
+
+def dumps_pretty(obj):
+    """Читаемый JSON с отступами - только для явного экспорта"""
+    return json.dumps(obj, ensure_ascii=False, indent=2)
+
+def read_jsonl_header(path):
+    """Возвращает заголовок JSONL-файла или None, если файл в старом формате JSON"""
+    with open(path, 'r', encoding='utf-8') as f:
+        first_line = f.readline()
+    try:
+        header = loads(first_line)
+    except ValueError:
+        # Старый JSON с отступами: первая строка - просто "{"
+        return None
+    if isinstance(header, dict) and header.get("format") == JSONL_FORMAT:
+        return header
+    return None
+
+def is_jsonl(path):
+    return read_jsonl_header(path) is not None
+
+def iter_jsonl(path, skip_broken=False):
+    """Перебирает записи JSONL-файла (после заголовка), пропуская пустые строки.
+
+    skip_broken - пропускать поврежденные строки (например, оборванную
+    последнюю строку после аварийного завершения дозаписи).
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        f.readline()
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                row = loads(line)
+            except ValueError:
+                if skip_broken:
+                    continue
+                raise
+            yield row
+
+def ends_with_newline(path):
+    """Проверяет, что последняя строка файла дописана полностью (можно безопасно дописывать)"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return False
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+def write_jsonl(path, header, rows):
+    """Атомарно пишет JSONL-файл: заголовок и записи по одной на строку"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(dumps(dict(header, format=JSONL_FORMAT)) + "\n")
+        for row in rows:
+            f.write(dumps(row) + "\n")
+    os.replace(tmp_path, path)
+
+def append_jsonl(path, rows):
+    """Дописывает записи в конец существующего JSONL-файла"""
+    with open(path, 'a', encoding='utf-8') as f:
+        for row in rows:
+            f.write(dumps(row) + "\n")
+
+def export_pretty_json(path, out_path):
+    """Явный экспорт внутреннего файла в читаемый JSON (в прежней структуре файлов)"""
+    header = read_jsonl_header(path)
+    if header is None:
+        with open(path, 'r', encoding='utf-8') as f:
+            document = json.load(f)
+    else:
+        kind = header.get("kind")
+        header = {key: value for key, value in header.items() if key not in ("format", "kind")}
+        rows = iter_jsonl(path)
+        if kind == "phones":
+            # Файл номеров: последняя запись по ID побеждает
+            document = {"data": {row.pop("id"): row for row in rows}}
+        else:
+            document = dict(header, data=list(rows))
+    with open(out_path, 'w', encoding='utf-8') as f:
+        f.write(dumps_pretty(document))
+    return out_path
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Экспорт внутренних файлов в читаемый JSON")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Экспорт JSONL/JSON в JSON с отступами")
+    export_parser.add_argument("path")
+    export_parser.add_argument("out_path")
+    args = arg_parser.parse_args(argv)
+
+    if args.command == "export":
+        print(f"📄 Экспортировано в {export_pretty_json(args.path, args.out_path)}")
+
+if __name__ == "__main__":
+    main()
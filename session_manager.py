@@ -0,0 +1,85 @@
+import threading
+import metrics
+
+class SessionManager:
+    """Общая сессия API номеров поверх пула идентичностей.
+
+    Если API отклоняет запросы (401/403 или пустой номер) подряд по
+    нескольким разным объявлениям, значит устарели данные сессии, а не
+    конкретное объявление. Тогда все запросы к API приостанавливаются,
+    перехват через браузер выполняется один раз, и работа продолжается
+    со свежими данными - вместо шести пустых попыток и браузера на
+    каждое объявление.
+    """
+
+    def __init__(self, pool, reject_threshold=3, max_refreshes=5, log=print):
+        self.pool = pool
+        self.reject_threshold = reject_threshold
+        self.max_refreshes = max_refreshes
+        self.log = log
+        self.refreshes = 0
+        self._rejected_ids = set()  # Разные объявления с отказом подряд, с последнего успеха
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    def acquire(self):
+        """Идентичность для запроса; во время обновления сессии ждет его завершения"""
+        self._resumed.wait()
+        return self.pool.acquire()
+
+    def report_success(self, identity):
+        with self._lock:
+            self._rejected_ids.clear()
+        self.pool.report_success(identity)
+
+    def report_failure(self, identity, announcement_id=None, rejected=False, empty=False):
+        """Учитывает сбой запроса. Возвращает True, если после него сессия была обновлена.
+
+        rejected - ответ 401/403, empty - ответ без номера; обычные сетевые
+        ошибки в счет отказов не идут.
+        """
+        self.pool.report_failure(identity, rejected=rejected)
+        if not (rejected or empty) or announcement_id is None:
+            return False
+        with self._lock:
+            self._rejected_ids.add(announcement_id)
+            triggered = len(self._rejected_ids) >= self.reject_threshold
+        if not triggered:
+            return False
+        return self.refresh(f"отказы API по {len(self._rejected_ids)} объявлениям подряд")
+
+    def refresh(self, reason):
+        """Приостанавливает запросы к API и один раз заново перехватывает сессию.
+
+        Если обновление уже идет в другом потоке, дожидается его и
+        возвращает True - повторный перехват не запускается.
+        """
+        if self.pool.harvest is None:
+            return False
+        if not self._refresh_lock.acquire(blocking=False):
+            self._resumed.wait()
+            return True
+        try:
+            with self._lock:
+                if self.refreshes >= self.max_refreshes:
+                    if self._rejected_ids:
+                        self.log(f"⚠️ Сессия API: лимит обновлений ({self.max_refreshes}) исчерпан, продолжаем без обновления")
+                        self._rejected_ids.clear()
+                    return False
+                self.refreshes += 1
+            self._resumed.clear()
+            self.log(f"⏸️ Сессия API: {reason}. Запросы приостановлены, обновляем сессию через браузер...")
+            harvested = self.pool.refresh_all()
+            metrics.session_refreshes.inc(status="success" if harvested else "failure")
+            if harvested:
+                self.log("▶️ Сессия API обновлена, запросы возобновлены")
+            else:
+                self.log("⚠️ Не удалось обновить сессию API, продолжаем со значениями по умолчанию")
+            with self._lock:
+                self._rejected_ids.clear()
+            return True
+        finally:
+            self._resumed.set()
+            self._refresh_lock.release()
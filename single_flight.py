@@ -0,0 +1,58 @@
+import threading
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Объединяет одновременные вызовы с одинаковым ключом в один.
+
+    Первый вызов (ведущий) выполняет функцию, остальные, пришедшие до ее
+    завершения, ждут и получают тот же результат или то же исключение.
+    Результат не кэшируется: следующий вызов после завершения снова
+    выполняет функцию.
+    """
+
+    def __init__(self, on_shared=None):
+        self.on_shared = on_shared  # on_shared(key) - при каждом вызове, получившем чужой результат
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Возвращает (результат, shared): shared=True, если результат получен от другого вызова"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            if self.on_shared:
+                self.on_shared(key)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
@@ -4,25 +4,83 @@ import json
 import sqlite3
 import time
 from urllib.parse import urlparse
-from datetime import datetime
 from contextlib import closing
+from functools import lru_cache
+from bs4 import BeautifulSoup
 from database import init_db
 import config
+import cpu_pool
+import regions_io
+from listing_filter import ListingFilter
 
 DB_NAME = "cian_bot.db"
 
 def ensure_output_dir():
     """Создает папку output если её нет"""
-    os.makedirs("output", exist_ok=True)
-
-def clear_parsing_data():
-    """Удаляет все файлы с данными парсинга"""
-    files_to_remove = [
-        get_region_file(),
-        get_phones_file(),
-        "output/phones.txt"
-    ]
-    
+    os.makedirs(config.OUTPUT_DIR, exist_ok=True)
+
+def clear_parsing_data(region_ids=None):
+    """Удаляет все файлы с данными парсинга (по умолчанию - для всех выбранных регионов)"""
+    if region_ids is None:
+        region_ids = [region_id for _, region_id in get_regions()]
+    files_to_remove = [os.path.join(config.OUTPUT_DIR, "phones.txt")]
+    for region_id in region_ids:
+        files_to_remove += [get_region_file(region_id), get_phones_file(region_id)]
+    _remove_files(files_to_remove)
+
+def apply_filter_change(region_ids=None):
+    """После смены комнат, этажей или цены: повторный поиск - только если фильтр стал шире.
+
+    Если новый фильтр не шире того, с которым получен файл регионов,
+    файл и полученные номера остаются: объявления отбираются локально
+    при чтении (listing_filter), а парсер номеров выгружает только их.
+    Иначе данные региона удаляются целиком, как раньше. Возвращает ID
+    регионов, где фильтр применен локально.
+    """
+    if region_ids is None:
+        region_ids = [region_id for _, region_id in get_regions()]
+    new_filter = get_listing_filter()
+    local, to_clear = [], []
+    for region_id in region_ids:
+        cached = _cached_filter(region_id)
+        if cached is not None and new_filter.is_within(cached):
+            local.append(region_id)
+        else:
+            to_clear.append(region_id)
+    if local:
+        # Номера не удаляем: парсер отбирает из них объявления под текущим фильтром,
+        # устаревает только общий файл выгрузки
+        _remove_files([os.path.join(config.OUTPUT_DIR, "phones.txt")])
+        print(f"🔎 Фильтр сужен: сохраненные объявления отбираются локально (регионы: {', '.join(map(str, local))})")
+    if to_clear:
+        clear_parsing_data(to_clear)
+    return local
+
+def is_filter_narrowed(region_id=None):
+    """True, если текущий фильтр строго уже того, с которым получен файл регионов.
+
+    Тогда объявления отбираются локально, а уже полученные номера
+    остаются действительными: парсер номеров их не удаляет, а только
+    ограничивает выгрузку текущим фильтром.
+    """
+    cached = _cached_filter(region_id)
+    if cached is None:
+        return False
+    current = get_listing_filter()
+    return current.is_within(cached) and not cached.is_within(current)
+
+def _cached_filter(region_id):
+    """Фильтр, с которым получен файл регионов (None - файла нет, он устарел или без фильтра в заголовке)"""
+    region_file = get_region_file(region_id)
+    if not os.path.exists(region_file) or should_refresh_region_file(region_id):
+        return None
+    try:
+        return ListingFilter.from_header(regions_io.read_header(region_file, count_if_missing=False))
+    except (json.JSONDecodeError, KeyError, OSError) as e:
+        print(f"Ошибка при чтении файла регионов: {str(e)}")
+        return None
+
+def _remove_files(files_to_remove):
     for file_path in files_to_remove:
         if os.path.exists(file_path):
             try:
@@ -38,16 +96,16 @@ def get_file_age(file_path):
     modified_time = os.path.getmtime(file_path)
     return (time.time() - modified_time) / (24 * 3600)  # Конвертируем в дни
 
-def should_refresh_region_file():
+def should_refresh_region_file(region_id=None):
     """Проверяет, нужно ли обновить файл региона"""
-    region_file = get_region_file()
+    region_file = get_region_file(region_id)
     if not os.path.exists(region_file):
         return True
     return get_file_age(region_file) > 1  # Старше 1 дня
 
-def remove_region_file():
+def remove_region_file(region_id=None):
     """Удаляет файл региона"""
-    region_file = get_region_file()
+    region_file = get_region_file(region_id)
     if os.path.exists(region_file):
         os.remove(region_file)
 
@@ -59,6 +117,25 @@ def get_region_id():
     """Получает ID региона из базы данных"""
     return get_setting('region_id', '4827')  # ID Тюмени по умолчанию
 
+def get_regions():
+    """Получает список регионов для парсинга [(название, ID), ...]; первый - основной"""
+    value = get_setting('regions', '')
+    if value:
+        try:
+            regions = [(name, str(region_id)) for name, region_id in json.loads(value)]
+            if regions:
+                return regions
+        except (json.JSONDecodeError, TypeError, ValueError):
+            pass
+    return [(get_region_name(), get_region_id())]
+
+def get_region_name_by_id(region_id):
+    """Название выбранного региона по его ID"""
+    for name, current_id in get_regions():
+        if str(current_id) == str(region_id):
+            return name
+    return get_region_name()
+
 def get_rooms():
     """Получает список выбранных комнат"""
     rooms_str = get_setting('rooms', '1,2,3,4')
@@ -89,38 +166,57 @@ def get_author_types():
     types_str = get_setting('author_types', 'developer')
     return types_str.split(',') if types_str else []
 
+def get_listing_filter():
+    """Фильтр объявлений из текущих настроек (комнаты, этажи, цена)"""
+    return ListingFilter(get_rooms(), get_min_floor(), get_max_floor(), get_min_price(), get_max_price())
+
 def set_region(region_name, region_id):
     """Устанавливает регион в настройках"""
-    set_setting('region', region_name)
-    set_setting('region_id', region_id)
-    clear_parsing_data()  # Удаляем старые данные
+    set_regions([(region_name, region_id)])
+
+def set_regions(regions):
+    """Устанавливает список регионов для парсинга; первый становится основным"""
+    old_region_ids = [region_id for _, region_id in get_regions()]
+    regions = [(name, str(region_id)) for name, region_id in regions]
+    set_setting('region', regions[0][0])
+    set_setting('region_id', regions[0][1])
+    set_setting('regions', json.dumps(regions, ensure_ascii=False))
+    # Удаляем данные только снятых с выбора регионов: у оставшихся они по-прежнему верны
+    kept = {region_id for _, region_id in regions}
+    clear_parsing_data([region_id for region_id in old_region_ids if region_id not in kept])
 
 def set_rooms(rooms):
     """Устанавливает выбранные комнаты"""
     set_setting('rooms', ','.join(map(str, rooms)))
-    clear_parsing_data()  # Удаляем старые данные
+    apply_filter_change()
 
-def set_min_floor(floors):
-    """Устанавливает минимальные этажи"""
+def set_min_floor(floors, apply=True):
+    """Устанавливает минимальные этажи.
+
+    apply=False - только сохранить выбор (этажи выбираются по одному в
+    боте): apply_filter_change() вызывается один раз по завершении выбора.
+    """
     value = ','.join(map(str, floors)) if floors else ''
     set_setting('min_floor', value)
-    clear_parsing_data()
+    if apply:
+        apply_filter_change()
 
-def set_max_floor(floors):
-    """Устанавливает максимальные этажи"""
+def set_max_floor(floors, apply=True):
+    """Устанавливает максимальные этажи (apply - как в set_min_floor)"""
     value = ','.join(map(str, floors)) if floors else ''
     set_setting('max_floor', value)
-    clear_parsing_data()
+    if apply:
+        apply_filter_change()
 
 def set_min_price(price):
     """Устанавливает минимальную цену"""
     set_setting('min_price', str(price) if price is not None else '')
-    clear_parsing_data()
+    apply_filter_change()
 
 def set_max_price(price):
     """Устанавливает максимальную цену"""
     set_setting('max_price', str(price) if price is not None else '')
-    clear_parsing_data()
+    apply_filter_change()
 
 def set_author_types(author_types):
     """Устанавливает выбранные типы авторов"""
@@ -141,135 +237,200 @@ def reset_settings():
     # Восстанавливаем время парсинга из конфига
     set_setting('schedule_time', config.SCHEDULE_TIME)
     
-def get_region_file():
-    """Возвращает путь к файлу регионов с ID региона"""
-    region_id = get_region_id()
+def get_region_file(region_id=None):
+    """Возвращает путь к файлу регионов с ID региона (по умолчанию - основной регион)"""
+    region_id = region_id or get_region_id()
     return os.path.join(config.OUTPUT_DIR, f"regions_{region_id}.json")
 
-def get_phones_file():
-    """Возвращает путь к файлу с номерами"""
-    return os.path.join(config.OUTPUT_DIR, "data.json")
+def get_phones_file(region_id=None):
+    """Возвращает путь к файлу с номерами региона"""
+    region_id = region_id or get_region_id()
+    return os.path.join(config.OUTPUT_DIR, f"data_{region_id}.json")
 
 
-def get_lock_file():
-    """Возвращает путь к lock-файлу"""
-    return os.path.join(config.OUTPUT_DIR, "parsing.lock")
+def get_lock_file(region_id=None):
+    """Возвращает путь к lock-файлу парсинга объявлений региона"""
+    region_id = region_id or get_region_id()
+    return os.path.join(config.OUTPUT_DIR, f"parsing_{region_id}.lock")
 
-def start_parsing():
+def start_parsing(region_id=None):
     """Создает lock-файл для индикации начала парсинга"""
     ensure_output_dir()
-    with open(get_lock_file(), 'w') as f:
+    with open(get_lock_file(region_id), 'w') as f:
         f.write("parsing in progress")
 
-def finish_parsing():
+def finish_parsing(region_id=None):
     """Удаляет lock-файл после завершения парсинга"""
-    lock_file = get_lock_file()
+    lock_file = get_lock_file(region_id)
     if os.path.exists(lock_file):
         os.remove(lock_file)
 
-def is_parsing_in_progress():
+def is_parsing_in_progress(region_id=None):
     """Проверяет, выполняется ли парсинг"""
-    return os.path.exists(get_lock_file())
+    return os.path.exists(get_lock_file(region_id))
 
 def extract_id_from_url(url):
     """Извлекает ID объявления из URL"""
-    match = re.search(r'/(\d+)/?$', url)
+    if not url:
+        return None
+    # Отбрасываем query-параметры и якорь, чтобы они не мешали поиску ID
+    match = re.search(r'/(\d+)/?$', urlparse(url).path)
     return match.group(1) if match else None
 
-def extract_urls_from_regions(author_type=None):
-    """Извлекает URL из файла регионов с фильтрацией по типу автора"""
-    region_file = get_region_file()
+def canonicalize_url(url):
+    """Приводит URL объявления к каноническому виду: нижний регистр хоста, без query и со слешем в конце"""
+    if not url:
+        return None
+    url = url.strip()
+    if not url.startswith('http'):
+        url = f"https://www.cian.ru{url}"
+    
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower() if parsed.scheme.lower() in ('http', 'https') else 'https'
+    path = parsed.path if parsed.path.endswith('/') else parsed.path + '/'
+    return f"{scheme}://{parsed.netloc.lower()}{path}"
+
+def dedupe_urls(urls):
+    """Возвращает список пар (ID объявления, канонический URL) без дублей с сохранением порядка"""
+    seen = set()
+    result = []
+    for url in urls:
+        canonical = canonicalize_url(url)
+        if not canonical:
+            continue
+        aid = extract_id_from_url(canonical)
+        # Дубли определяем по ID объявления: поддомен, слеш и query на него не влияют
+        key = aid or canonical
+        if key in seen:
+            continue
+        seen.add(key)
+        result.append((aid, canonical))
+    return result
+
+def dedupe_listings(listings):
+    """Канонизирует URL объявлений, проставляет announcement_id и удаляет дубли с сохранением порядка"""
+    seen = set()
+    result = []
+    for item in listings:
+        canonical = canonicalize_url(item.get('url'))
+        if canonical:
+            item['url'] = canonical
+            item['announcement_id'] = extract_id_from_url(canonical)
+        
+        key = item.get('announcement_id') or canonical
+        if key is not None:
+            if key in seen:
+                continue
+            seen.add(key)
+        result.append(item)
+    return result
+
+def extract_urls_from_regions(author_type=None, region_id=None):
+    """Извлекает уникальные канонические URL из файла регионов с фильтрацией по типу автора"""
+    return [url for _, url in extract_work_items_from_regions(author_type, region_id)]
+
+def extract_work_items_from_regions(author_type=None, region_id=None):
+    """Возвращает пары (ID объявления, URL) из файла регионов без дублей с сохранением порядка"""
+    region_file = get_region_file(region_id)
     
     if not os.path.exists(region_file):
         return []
     
     try:
-        with open(region_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        # Читаем файл потоково, не загружая документ целиком; файл может быть шире
+        # текущих настроек (фильтр сужен после поиска) - отбираем объявления локально
+        listings = get_listing_filter().apply(regions_io.iter_listings(region_file, author_type=author_type))
+        urls = [item['url'] for item in listings if item.get('url')]
         
-        # Проверяем новый формат файла
-        if "data" in data:
-            ads_data = data["data"]
-        else:
-            # Старый формат для обратной совместимости
-            ads_data = data
-        
-        urls = []
-        for item in ads_data:
-            # Фильтруем по типу автора, если указан
-            if author_type and item.get('author_type') != author_type:
-                continue
-                
-            url = item.get('url')
-            if url:
-                # Убеждаемся, что URL полный
-                if not url.startswith('http'):
-                    url = f"https://www.cian.ru{url}"
-                urls.append(url)
-        
-        return urls
+        # Канонизация и удаление дублей до любых сетевых запросов
+        return dedupe_urls(urls)
     except (json.JSONDecodeError, KeyError) as e:
         print(f"Ошибка при чтении файла регионов: {str(e)}")
         return []
 
-def extract_block_id_from_data(announcement_id):
-    """Извлекает blockId из данных объявления по ID"""
-    region_file = get_region_file()
+def find_listing_in_regions(announcement_id, region_id=None):
+    """Потоково ищет объявление по ID в файле регионов"""
+    region_file = get_region_file(region_id)
     
     if not os.path.exists(region_file):
         return None
     
     try:
-        with open(region_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Проверяем новый формат файла
-        if "data" in data:
-            ads_data = data["data"]
-        else:
-            # Старый формат для обратной совместимости
-            ads_data = data
-        
-        for item in ads_data:
-            url = item.get('url', '')
-            if announcement_id in url:
-                return item.get('blockId')
-        
+        for item in regions_io.iter_listings(region_file):
+            item_id = item.get('announcement_id') or extract_id_from_url(item.get('url', ''))
+            if item_id == str(announcement_id):
+                return item
         return None
     except (json.JSONDecodeError, KeyError) as e:
         print(f"Ошибка при чтении файла регионов: {str(e)}")
         return None
 
-def extract_direct_phone_from_data(announcement_id):
+def extract_block_id_from_data(announcement_id, region_id=None):
+    """Извлекает blockId из данных объявления по ID"""
+    item = find_listing_in_regions(announcement_id, region_id)
+    return item.get('blockId') if item else None
+
+def extract_direct_phone_from_data(announcement_id, region_id=None):
     """Извлекает прямой телефон из данных объявления по ID"""
-    region_file = get_region_file()
+    item = find_listing_in_regions(announcement_id, region_id)
+    return item.get('directPhone') if item else None
+
+# Ищем по байтам страницы: без декодирования (и определения кодировки) всего HTML
+SITE_BLOCK_ID_RE = re.compile(rb'"siteBlockId":\s*(\d+)')
+OFFER_PHONE_RE = re.compile(rb'"offerPhone":\s*"([^"]+)"')
+PHONE_ELEMENT_SELECTOR = '[data-testid="PhoneLink"], .phone-number'
+
+def scan_offer_fields(content):
+    """siteBlockId и offerPhone из байтов HTML карточки (None, если на странице нет)"""
+    site_block_match = SITE_BLOCK_ID_RE.search(content)
+    offer_match = OFFER_PHONE_RE.search(content)
+    return {
+        "siteBlockId": int(site_block_match.group(1)) if site_block_match else None,
+        "offerPhone": offer_match.group(1).decode("utf-8", "replace") if offer_match else None,
+    }
+
+def extract_offer_fields(response):
+    """siteBlockId и offerPhone из ответа со страницей объявления.
+
+    Используется через http_client.parse_once, чтобы одновременные запросы
+    одной страницы разбирали ее один раз. Очень большие страницы
+    разбираются в пуле процессов (cpu_pool).
+    """
+    content = response.content
+    if len(content) >= config.CPU_OFFLOAD_MIN_BYTES:
+        return cpu_pool.run(scan_offer_fields, content)
+    return scan_offer_fields(content)
+
+def extract_phone_from_html(content):
+    """Номер из элемента телефона в HTML (BeautifulSoup), только цифры и +; None, если элемента нет.
+
+    Тяжелый разбор всего документа - вызывается через cpu_pool.run.
+    """
+    soup = BeautifulSoup(content, 'html.parser')
+    phone_element = soup.select_one(PHONE_ELEMENT_SELECTOR)
+    if phone_element is None:
+        return None
+    return re.sub(r'[^\d+]', '', phone_element.get_text(strip=True))
+
+def count_region_listings(author_type=None, region_id=None):
+    """Возвращает количество объявлений в файле регионов (0 если файла нет или он поврежден)"""
+    region_file = get_region_file(region_id)
     
     if not os.path.exists(region_file):
-        return None
+        return 0
     
     try:
-        with open(region_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Проверяем новый формат файла
-        if "data" in data:
-            ads_data = data["data"]
-        else:
-            # Старый формат для обратной совместимости
-            ads_data = data
-        
-        for item in ads_data:
-            url = item.get('url', '')
-            if announcement_id in url:
-                return item.get('directPhone')
-        
-        return None
+        listing_filter = get_listing_filter()
+        if listing_filter.is_empty:
+            return regions_io.count_listings(region_file, author_type=author_type)
+        return sum(1 for _ in listing_filter.apply(regions_io.iter_listings(region_file, author_type=author_type)))
     except (json.JSONDecodeError, KeyError) as e:
         print(f"Ошибка при чтении файла регионов: {str(e)}")
-        return None
+        return 0
 
+@lru_cache(maxsize=65536)
 def format_phone(phone):
-    """Форматирует телефонный номер в читаемый вид"""
+    """Форматирует телефонный номер в читаемый вид (номера коллтрекинга повторяются - результат кэшируется)"""
     if not phone:
         return phone
     
@@ -305,28 +466,29 @@ def sanitize_payload(data):
         return sanitized
     return data
 
-def get_region_info():
+def get_region_info(region_id=None):
     """Возвращает информацию о регионе из файла"""
-    region_file = get_region_file()
+    region_file = get_region_file(region_id)
     
     if not os.path.exists(region_file):
         return None
     
     try:
-        with open(region_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        # Читаем только метаданные до массива объявлений
+        data = regions_io.read_header(region_file, count_if_missing=False)
         
         # Если файл в новом формате
         if "region" in data and "created_at" in data:
             return {
                 "name": data["region"]["name"],
                 "id": data["region"]["id"],
-                "created_at": data["created_at"]
+                "created_at": data["created_at"],
+                "count": data.get("count")
             }
         # Старый формат - возвращаем базовую информацию
         return {
-            "name": get_region_name(),
-            "id": get_region_id(),
+            "name": get_region_name_by_id(region_id) if region_id else get_region_name(),
+            "id": region_id or get_region_id(),
             "created_at": "unknown"
         }
     except (json.JSONDecodeError, KeyError) as e: